@@ -0,0 +1,257 @@
+"""End-to-end throughput benchmark of main.py against the local Cloudflare stand-in.
+
+Every run configures fresh domains on the mock API through setup_zones (or, with --via-queue,
+through the task queue and task_processor) and reports domains/sec, requests per domain,
+p50/p99 latency of each pipeline stage and peak Python memory.
+
+    python bench/benchmark.py --sizes 10,100,1000 --types 1,2,3 --latency 0.05 --jitter 0.02
+    python bench/benchmark.py --sizes 100 --engine asyncio --rate-limit 1200/300 --client-limits
+
+Settings of main.py (CF_*, DOMAIN_CONCURRENCY, ...) are read from the environment as usual.
+The client-side rate limiter is lifted unless --client-limits is given, so the numbers show
+the pipeline itself rather than Cloudflare's request budget.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from cf_mock import parse_rate_limit, start_mock_server
+
+
+class NullBot:
+    """Accepts every Telegram call instantly, so only the Cloudflare side is measured"""
+
+    def __init__(self):
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _message(self, chat_id):
+        with self._lock:
+            self._next_id += 1
+            return types.SimpleNamespace(message_id=self._next_id, chat=types.SimpleNamespace(id=chat_id))
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._message(chat_id)
+
+    def reply_to(self, message, text, **kwargs):
+        return self._message(message.chat.id)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return True
+
+    def delete_message(self, chat_id, message_id):
+        return True
+
+    def send_document(self, chat_id, document, **kwargs):
+        return self._message(chat_id)
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(share * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def instrument_stages(main, stage_times):
+    """Record every domain_stage_seconds observation and the total time of every domain.
+
+    Stages of one domain overlap after its zone exists, so they are taken from main.py's own
+    stage timing rather than from the order the dashboard reports them in.
+    """
+    observe = main.metrics.observe
+    process_domain = main.process_domain
+    process_domain_async = main.process_domain_async
+
+    def timed_observe(name, value, **labels):
+        if name == "domain_stage_seconds":
+            stage_times[labels.get("stage")].append(value)
+        return observe(name, value, **labels)
+
+    def timed_process_domain(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return process_domain(*args, **kwargs)
+        finally:
+            stage_times["Domain total"].append(time.perf_counter() - started)
+
+    async def timed_process_domain_async(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await process_domain_async(*args, **kwargs)
+        finally:
+            stage_times["Domain total"].append(time.perf_counter() - started)
+
+    main.metrics.observe = timed_observe
+    main.process_domain = timed_process_domain
+    main.process_domain_async = timed_process_domain_async
+
+
+def build_input(run_id, accounts, domains, dns_config_type):
+    """Regular-format task text with the domains split evenly between accounts"""
+    blocks = []
+    per_account = max(1, domains // accounts)
+    for account in range(accounts):
+        count = per_account if account < accounts - 1 else domains - per_account * (accounts - 1)
+        lines = [f"bench-{run_id}-{account}@example.com", "bench-key"]
+        lines += [f"d{i}.a{account}.r{run_id}.bench.test" for i in range(count)]
+        lines += ["192.0.2.10", "192.0.2.20", "true", "true", str(dns_config_type)]
+        blocks.append("\n".join(lines))
+    return "\n".join(blocks)
+
+
+def run_once(main, state, text, via_queue):
+    if via_queue:
+        job_id = main.job_store.add_job(1, 1, text, 0)
+        main.task_queue.put((job_id, 1, 1, text, 0, None), 1, main.estimate_task_cost(text))
+        time.sleep(0.05)
+        while main.task_queue.qsize() or main.active_jobs:
+            time.sleep(0.01)
+        return []
+    results = []
+    for account in main.parse_input_text(text):
+        results.append(main.setup_zones(account, 1))
+    return results
+
+
+def benchmark(main, state, stage_times, size, dns_config_type, args, run_id):
+    text = build_input(run_id, args.accounts, size, dns_config_type)
+
+    runs = [("cold", text)]
+    if args.warm:
+        runs.append(("warm", text))
+
+    reports = []
+    for phase, run_text in runs:
+        stage_times.clear()
+        state.reset_counters()
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        results = run_once(main, state, run_text, args.via_queue)
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] - memory_before
+
+        errors = sum(len(result["errors"]) for result in results)
+        requests_total = state.total_requests()
+        report = {
+            "phase": phase,
+            "domains": size,
+            "dns_config_type": dns_config_type,
+            "engine": main.CF_ENGINE,
+            "seconds": elapsed,
+            "domains_per_sec": size / elapsed if elapsed else 0.0,
+            "requests": requests_total,
+            "requests_per_domain": requests_total / size,
+            "rate_limited": state.rate_limited,
+            "errors": errors,
+            "peak_memory_mib": peak / (1024 * 1024),
+            "stages": {
+                name: {"p50": percentile(values, 0.5), "p99": percentile(values, 0.99), "count": len(values)}
+                for name, values in stage_times.items()
+            },
+        }
+        reports.append(report)
+    return reports
+
+
+def print_report(report):
+    print(
+        f"{report['domains']:>6} domains  type {report['dns_config_type']}  {report['phase']:<4}  "
+        f"{report['seconds']:8.2f} s  {report['domains_per_sec']:8.1f} dom/s  "
+        f"{report['requests_per_domain']:6.2f} req/dom  429: {report['rate_limited']:<4}  "
+        f"errors: {report['errors']:<4}  peak {report['peak_memory_mib']:7.1f} MiB"
+    )
+    for name, stats in report["stages"].items():
+        print(f"        {name:<18} p50 {stats['p50'] * 1000:8.1f} ms   p99 {stats['p99'] * 1000:8.1f} ms   n={stats['count']}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Throughput benchmark against the local Cloudflare stand-in")
+    parser.add_argument("--sizes", default="10,100,1000", help="Comma-separated domain counts")
+    parser.add_argument("--types", default="1,2,3", help="Comma-separated dns_config_type values")
+    parser.add_argument("--accounts", type=int, default=1, help="Accounts the domains are split between")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default=None, help="Overrides CF_ENGINE")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock latency per request, seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Extra random mock latency, seconds")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of mock requests answered with HTTP 500")
+    parser.add_argument("--rate-limit", default=None, help="Mock per-user budget like 1200/300")
+    parser.add_argument("--client-limits", action="store_true", help="Keep main.py's own rate limiter settings")
+    parser.add_argument("--via-queue", action="store_true", help="Run through the task queue and task_processor")
+    parser.add_argument("--warm", action="store_true", help="Run every input a second time (already configured zones)")
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the reports to this file")
+    args = parser.parse_args()
+
+    server, state, base_url = start_mock_server(
+        latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate,
+        rate_limit=parse_rate_limit(args.rate_limit)
+    )
+
+    # main.py reads its configuration at import time
+    workdir = tempfile.mkdtemp(prefix="cf-bench-")
+    os.environ["CF_API_BASE"] = base_url
+    os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+    os.environ["WHITELIST"] = "1:user"
+    os.environ["JOB_DB_PATH"] = os.path.join(workdir, "jobs.db")
+    os.environ["UPLOAD_DIR"] = os.path.join(workdir, "uploads")
+    os.environ["TELEGRAM_CHAT_INTERVAL"] = "0"
+    os.environ["TELEGRAM_GLOBAL_RATE"] = "100000"
+    if args.engine:
+        os.environ["CF_ENGINE"] = args.engine
+    if not args.client_limits:
+        os.environ["CF_RATE_LIMIT"] = "100000000"
+        os.environ["CF_RATE_BURST"] = "100000000"
+
+    # Keep bot.log and other files main.py writes out of the working tree
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import main
+    finally:
+        os.chdir(cwd)
+    main.bot = NullBot()
+    stage_times = defaultdict(list)
+    instrument_stages(main, stage_times)
+
+    threads = main.init_task_queue() if args.via_queue else []
+    tracemalloc.start()
+
+    print(f"Mock API {base_url}, latency {args.latency}s + {args.jitter}s, fail rate {args.fail_rate}, "
+          f"engine {main.CF_ENGINE}, via {'task queue' if args.via_queue else 'setup_zones'}")
+    reports = []
+    run_id = 0
+    for size in [int(value) for value in args.sizes.split(",") if value]:
+        for dns_config_type in [int(value) for value in args.types.split(",") if value]:
+            run_id += 1
+            for report in benchmark(main, state, stage_times, size, dns_config_type, args, run_id):
+                print_report(report)
+                reports.append(report)
+
+    rss_mib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Peak RSS of the whole process: {rss_mib:.1f} MiB")
+
+    if args.json_path:
+        with open(args.json_path, "w") as output:
+            json.dump({"reports": reports, "peak_rss_mib": rss_mib}, output, indent=2)
+
+    if threads:
+        main.stop_task_queue(threads)
+    main.async_engine.stop()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main_cli()
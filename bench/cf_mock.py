@@ -0,0 +1,360 @@
+"""Local stand-in for the Cloudflare v4 API endpoints used by main.py.
+
+Run standalone:
+    python bench/cf_mock.py --port 8788 --latency 0.05 --fail-rate 0.01 --rate-limit 1200/300
+
+and point the bot at it with CF_API_BASE=http://127.0.0.1:8788/client/v4
+"""
+import argparse
+import email.parser
+import email.policy
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_SETTINGS = {
+    "opportunistic_encryption": "off",
+    "tls_1_3": "off",
+    "min_tls_version": "1.0",
+    "always_use_https": "off",
+}
+
+NS_POOL = ["ada", "bob", "cruz", "dana", "eli", "fay", "gus", "hana", "ivan", "june"]
+
+
+class MockState:
+    """In-memory accounts, zones, records and settings plus request accounting"""
+
+    def __init__(self, latency=0.0, jitter=0.0, fail_rate=0.0, rate_limit=None, valid_keys=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        # (requests, seconds) per X-Auth-Email, like Cloudflare's per-user budget
+        self.rate_limit = rate_limit
+        self.valid_keys = valid_keys
+        self.lock = threading.Lock()
+        self.zones = {}
+        self.records = defaultdict(dict)
+        self.settings = {}
+        self.request_log = deque()
+        self.windows = defaultdict(deque)
+        self.counts = defaultdict(int)
+        self.rate_limited = 0
+
+    def reset_counters(self):
+        with self.lock:
+            self.counts.clear()
+            self.rate_limited = 0
+
+    def total_requests(self):
+        with self.lock:
+            return sum(self.counts.values())
+
+
+def _record(zone, payload):
+    name = payload.get("name", "@")
+    if name == "@" or name == zone["name"]:
+        fqdn = zone["name"]
+    elif name.endswith("." + zone["name"]):
+        fqdn = name
+    else:
+        fqdn = f"{name}.{zone['name']}"
+    record = {
+        "id": uuid.uuid4().hex,
+        "zone_id": zone["id"],
+        "type": payload.get("type"),
+        "name": fqdn,
+        "content": payload.get("content"),
+        "proxied": bool(payload.get("proxied", False)) and payload.get("type") in ("A", "AAAA", "CNAME"),
+        "ttl": payload.get("ttl", 1),
+    }
+    if "priority" in payload:
+        record["priority"] = payload["priority"]
+    return record
+
+
+def _multipart_fields(raw, content_type):
+    """Fields of a multipart/form-data body as {name: text}"""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + raw
+    )
+    return {
+        part.get_param("name", header="content-disposition"): part.get_payload(decode=True).decode(errors="replace")
+        for part in message.iter_parts()
+    }
+
+
+def _zone_file_records(text, proxied):
+    """Record payloads of a BIND zone file; enough of the syntax for what main.py renders"""
+    payloads = []
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) < 5 or parts[2] != "IN":
+            continue
+        name, rtype = parts[0].rstrip("."), parts[3]
+        if rtype == "MX":
+            payloads.append({"type": "MX", "name": name, "priority": int(parts[4]), "content": parts[5].rstrip(".")})
+            continue
+        content = line.split(None, 4)[4]
+        if rtype == "TXT":
+            chunks = re.findall(r'"((?:[^"\\]|\\.)*)"', content)
+            content = "".join(re.sub(r"\\(.)", r"\1", chunk) for chunk in chunks)
+        else:
+            content = content.rstrip(".")
+        payloads.append({"type": rtype, "name": name, "content": content, "proxied": proxied})
+    return payloads
+
+
+def _ok(result, **extra):
+    body = {"success": True, "errors": [], "messages": [], "result": result}
+    body.update(extra)
+    return 200, body
+
+
+def _err(status, code, message):
+    return status, {"success": False, "errors": [{"code": code, "message": message}], "messages": [], "result": None}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            return _multipart_fields(raw, content_type)
+        return json.loads(raw) if raw else {}
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self, method):
+        state = self.state
+        parsed = urlparse(self.path)
+        path = parsed.path
+        query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        body = self._body() if method in ("POST", "PATCH", "PUT") else {}
+        email = self.headers.get("X-Auth-Email", "")
+        key = self.headers.get("X-Auth-Key", "")
+
+        if state.latency or state.jitter:
+            time.sleep(state.latency + random.random() * state.jitter)
+
+        with state.lock:
+            endpoint = re.sub(r"[0-9a-f]{32}", "{id}", path)
+            state.counts[f"{method} {endpoint}"] += 1
+
+            if state.rate_limit:
+                limit, window = state.rate_limit
+                now = time.monotonic()
+                hits = state.windows[email]
+                while hits and now - hits[0] > window:
+                    hits.popleft()
+                if len(hits) >= limit:
+                    state.rate_limited += 1
+                    retry_after = max(1, int(window - (now - hits[0])) + 1)
+                    status, out = _err(429, 10100, "Rate limited")
+                    return self._send(status, out, {"Retry-After": str(retry_after)})
+                hits.append(now)
+
+        if state.valid_keys is not None and state.valid_keys.get(email) != key:
+            return self._send(*_err(403, 9103, "Unknown X-Auth-Key or X-Auth-Email"))
+
+        if state.fail_rate and random.random() < state.fail_rate:
+            return self._send(*_err(500, 10000, "Injected failure"))
+
+        with state.lock:
+            status, out = self._route(method, path, query, body, email)
+        self._send(status, out)
+
+    def _route(self, method, path, query, body, email):
+        state = self.state
+        prefix = "/client/v4"
+        if not path.startswith(prefix):
+            return _err(404, 7000, "No route for that URI")
+        path = path[len(prefix):]
+
+        if path == "/zones":
+            if method == "GET":
+                zones = [z for z in state.zones.values() if z["owner"] == email]
+                if "name" in query:
+                    zones = [z for z in zones if z["name"] == query["name"]]
+                return self._page(zones, query, 50)
+            if method == "POST":
+                name = body.get("name")
+                if any(z["name"] == name and z["owner"] == email for z in state.zones.values()):
+                    return _err(400, 1061, f"{name} already exists")
+                zone_id = uuid.uuid4().hex
+                pair = random.sample(NS_POOL, 2)
+                zone = {
+                    "id": zone_id,
+                    "name": name,
+                    "status": "pending",
+                    "owner": email,
+                    "name_servers": [f"{n}.ns.cloudflare.com" for n in sorted(pair)],
+                }
+                state.zones[zone_id] = zone
+                state.settings[zone_id] = dict(DEFAULT_SETTINGS)
+                return _ok(self._zone_view(zone))
+
+        match = re.match(r"^/zones/([0-9a-f]{32})(/.*)?$", path)
+        if not match or match.group(1) not in state.zones:
+            return _err(404, 7003, "Could not route to zone")
+        zone = state.zones[match.group(1)]
+        rest = match.group(2) or ""
+        records = state.records[zone["id"]]
+
+        if rest == "":
+            if method == "GET":
+                return _ok(self._zone_view(zone))
+            if method == "DELETE":
+                del state.zones[zone["id"]]
+                return _ok({"id": zone["id"]})
+
+        if rest == "/dns_records":
+            if method == "GET":
+                return self._page(list(records.values()), query, 100)
+            if method == "POST":
+                record = _record(zone, body)
+                records[record["id"]] = record
+                return _ok(record)
+
+        if rest == "/dns_records/batch" and method == "POST":
+            for op in body.get("deletes") or []:
+                if op.get("id") not in records:
+                    return _err(400, 81044, "Record does not exist")
+            result = {"deletes": [], "patches": [], "puts": [], "posts": []}
+            for op in body.get("deletes") or []:
+                result["deletes"].append(records.pop(op["id"]))
+            for op in body.get("patches") or []:
+                if op.get("id") not in records:
+                    return _err(400, 81044, "Record does not exist")
+                records[op["id"]].update({k: v for k, v in op.items() if k != "id"})
+                result["patches"].append(records[op["id"]])
+            for op in body.get("posts") or []:
+                record = _record(zone, op)
+                records[record["id"]] = record
+                result["posts"].append(record)
+            return _ok(result)
+
+        if rest == "/dns_records/import" and method == "POST":
+            payloads = _zone_file_records(body.get("file", ""), body.get("proxied") == "true")
+            for payload in payloads:
+                record = _record(zone, payload)
+                records[record["id"]] = record
+            return _ok({"recs_added": len(payloads), "total_records_parsed": len(payloads)})
+
+        match = re.match(r"^/dns_records/([0-9a-f]{32})$", rest)
+        if match:
+            record_id = match.group(1)
+            if record_id not in records:
+                return _err(404, 81044, "Record does not exist")
+            if method == "DELETE":
+                records.pop(record_id)
+                return _ok({"id": record_id})
+            if method == "PATCH":
+                records[record_id].update(body)
+                return _ok(records[record_id])
+
+        settings = state.settings[zone["id"]]
+        if rest == "/settings":
+            if method == "GET":
+                return _ok([{"id": k, "value": v, "editable": True} for k, v in settings.items()])
+            if method == "PATCH":
+                items = body.get("items") or []
+                for item in items:
+                    settings[item["id"]] = item["value"]
+                return _ok([{"id": item["id"], "value": item["value"]} for item in items])
+
+        match = re.match(r"^/settings/([a-z0-9_]+)$", rest)
+        if match and method == "PATCH":
+            settings[match.group(1)] = body.get("value")
+            return _ok({"id": match.group(1), "value": body.get("value")})
+
+        return _err(404, 7000, "No route for that URI")
+
+    @staticmethod
+    def _zone_view(zone):
+        return {k: v for k, v in zone.items() if k != "owner"}
+
+    def _page(self, items, query, default_per_page):
+        per_page = int(query.get("per_page", default_per_page))
+        page = int(query.get("page", 1))
+        total_pages = max(1, (len(items) + per_page - 1) // per_page)
+        chunk = items[(page - 1) * per_page:page * per_page]
+        if chunk and "name_servers" in chunk[0]:
+            chunk = [self._zone_view(z) for z in chunk]
+        return _ok(chunk, result_info={"page": page, "per_page": per_page, "count": len(chunk),
+                                       "total_count": len(items), "total_pages": total_pages})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+def start_mock_server(host="127.0.0.1", port=0, **options):
+    """Start the mock API in a background thread; returns (server, state, base_url)"""
+    state = MockState(**options)
+    handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://{host}:{server.server_address[1]}/client/v4"
+    return server, state, base_url
+
+
+def parse_rate_limit(value):
+    if not value:
+        return None
+    limit, window = value.split("/")
+    return int(limit), float(window)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Cloudflare API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8788)
+    parser.add_argument("--latency", type=float, default=0.0, help="Base latency per request, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency, seconds")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered with HTTP 500")
+    parser.add_argument("--rate-limit", default=None, help="Per-user budget like 1200/300")
+    args = parser.parse_args()
+
+    server, state, base_url = start_mock_server(
+        args.host, args.port,
+        latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate,
+        rate_limit=parse_rate_limit(args.rate_limit)
+    )
+    print(f"Mock Cloudflare API listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,100 @@
+"""Summarize a task trace written by main.py (traces/job-<id>.jsonl, or sent by /trace).
+
+    python bench/trace_report.py traces/job-42.jsonl --top 10
+
+Prints the task's critical path (at each level, the child that finished last, i.e. the one
+the parent had to wait for), the slowest domains with their stage breakdown, and time spent
+in HTTP calls per endpoint including retries.
+"""
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+
+def load_spans(path):
+    spans = {}
+    with open(path, encoding="utf-8") as trace_file:
+        for line in trace_file:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                spans[record["span"]] = record
+    children = defaultdict(list)
+    for record in spans.values():
+        children[record["parent"]].append(record)
+    return spans, children
+
+
+def label(record):
+    attrs = record.get("attrs") or {}
+    detail = attrs.get("domain") or attrs.get("login") or attrs.get("endpoint") or attrs.get("job_id")
+    if record["name"] == "http":
+        detail = f"{attrs.get('method')} {attrs.get('endpoint')} -> {attrs.get('http_status', '?')}"
+    return f"{record['name']} {detail}" if detail is not None else record["name"]
+
+
+def critical_path(root, children):
+    path = [root]
+    while children.get(path[-1]["span"]):
+        path.append(max(children[path[-1]["span"]], key=lambda record: record["end"]))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Critical path and slowest domains of a task trace")
+    parser.add_argument("trace", help="JSONL trace file")
+    parser.add_argument("--top", type=int, default=10, help="How many slow domains to list")
+    args = parser.parse_args()
+
+    spans, children = load_spans(args.trace)
+    roots = [record for record in spans.values() if record["parent"] not in spans]
+    if not roots:
+        print("No spans in trace")
+        return 1
+
+    # A resumed job appends a second run to the same file: report each run
+    for root in sorted(roots, key=lambda record: record["start"]):
+        print(f"== {label(root)}: {root['duration']:.2f}s, status {root['status']}, retries {root['retries']}")
+
+        print("\nCritical path:")
+        for depth, record in enumerate(critical_path(root, children)):
+            offset = record["start"] - root["start"]
+            print(f"  {'  ' * depth}{label(record)}  +{offset:.2f}s  {record['duration']:.3f}s  {record['status']}")
+
+        descendants = []
+        stack = [root]
+        while stack:
+            record = stack.pop()
+            descendants.append(record)
+            stack.extend(children.get(record["span"], []))
+
+        domains = sorted((record for record in descendants if record["name"] == "domain"), key=lambda record: -record["duration"])
+        if domains:
+            print(f"\nSlowest domains ({min(args.top, len(domains))} of {len(domains)}):")
+            for record in domains[:args.top]:
+                stages = ", ".join(
+                    f"{stage['name']} {stage['duration']:.2f}s" + ("!" if stage["status"] != "ok" else "")
+                    for stage in sorted(children.get(record["span"], []), key=lambda stage: stage["start"])
+                )
+                print(f"  {record['attrs'].get('domain')}: {record['duration']:.2f}s, retries {record['retries']}  [{stages}]")
+
+        endpoints = defaultdict(lambda: [0, 0.0, 0, 0])
+        for record in descendants:
+            if record["name"] == "http":
+                stats = endpoints[(record["attrs"].get("method"), record["attrs"].get("endpoint"))]
+                stats[0] += 1
+                stats[1] += record["duration"]
+                stats[2] += record["retries"]
+                stats[3] += record["status"] != "ok"
+        if endpoints:
+            print("\nHTTP calls:")
+            for (method, endpoint), (count, total, retries, failed) in sorted(endpoints.items(), key=lambda item: -item[1][1]):
+                print(f"  {method} {endpoint}: {count} calls, {total:.2f}s total, avg {total / count * 1000:.0f} ms, "
+                      f"retries {retries}, failed {failed}")
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
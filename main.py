@@ -1,4 +1,5 @@
 import telebot
+from telebot.apihelper import ApiTelegramException
 import requests
 import random
 import string
@@ -10,16 +11,37 @@ import logging
 import re
 import traceback
 import io
+import csv
+import email.utils
 from io import StringIO
 from dotenv import load_dotenv
 import os
 import queue
 import threading
 import time
+import asyncio
+import functools
+import contextlib
+import contextvars
+import bisect
+import heapq
+import itertools
+import sqlite3
+from collections import OrderedDict, deque
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import aiohttp
+except ImportError:  # only the asyncio engine needs it; checked at startup (check_async_transport)
+    aiohttp = None
 
-task_queue = queue.Queue()
 task_lock = threading.Lock()
-current_processing = False
+# Per-worker state of the jobs being processed right now, keyed by worker name
+active_jobs = {}
+# Workers the watchdog gave up on; they exit instead of taking another task if they ever return
+abandoned_workers = set()
 
 waiting_users = {}
 
@@ -51,6 +73,129 @@ SUPER_ADMIN_TAG = os.getenv("SUPER_ADMIN_TAG")
 
 WHITELIST = {int(item.split(':')[0]): item.split(':')[1] for item in os.getenv('WHITELIST', '').split(',')}
 
+# Cloudflare API client settings
+CF_API_BASE = os.getenv("CF_API_BASE", "https://api.cloudflare.com/client/v4")
+CF_POOL_SIZE = int(os.getenv("CF_POOL_SIZE", "32"))
+CF_MAX_SESSIONS = int(os.getenv("CF_MAX_SESSIONS", "64"))
+# Cloudflare allows about 1200 requests per 5 minutes per user
+CF_RATE_LIMIT = int(os.getenv("CF_RATE_LIMIT", "1200"))
+CF_RATE_WINDOW = float(os.getenv("CF_RATE_WINDOW", "300"))
+CF_RATE_BURST = int(os.getenv("CF_RATE_BURST", "100"))
+CF_RATE_LIMIT_RETRIES = int(os.getenv("CF_RATE_LIMIT_RETRIES", "5"))
+# Retries of 5xx answers, timeouts and dropped connections, with full-jitter exponential backoff
+CF_RETRIES = int(os.getenv("CF_RETRIES", "3"))
+CF_RETRY_BASE = float(os.getenv("CF_RETRY_BASE", "0.5"))
+CF_RETRY_MAX = float(os.getenv("CF_RETRY_MAX", "8"))
+# Circuit breaker per API key: this many auth failures in a row stop all calls with it for the cooldown
+CF_BREAKER_THRESHOLD = int(os.getenv("CF_BREAKER_THRESHOLD", "3"))
+CF_BREAKER_COOLDOWN = float(os.getenv("CF_BREAKER_COOLDOWN", "600"))
+# Global and per-account limits on in-flight Cloudflare requests (threads engine), also the size of the shared I/O pool
+IO_MAX_WORKERS = int(os.getenv("IO_MAX_WORKERS", "64"))
+IO_ACCOUNT_MAX_INFLIGHT = int(os.getenv("IO_ACCOUNT_MAX_INFLIGHT", "16"))
+# Stages of one domain after its zone exists run as a dependency graph: a stage starts once the stages
+# it needs have succeeded, so DNS, SSL and NS capture of a domain are in flight together
+DOMAIN_STAGE_DEPS = {"zone": (), "dns": ("zone",), "ssl": ("zone",), "ns": ("zone",)}
+# Process-wide cap on domains inside one stage at once, like "dns=20,ssl=40" (unlisted stages are unbounded)
+STAGE_LIMITS = {
+    stage.strip(): int(limit)
+    for stage, _, limit in (item.partition("=") for item in os.getenv("STAGE_LIMITS", "").split(",") if "=" in item)
+}
+# Threads that run the extra stages of a domain next to the domain's own thread (threads engine)
+STAGE_WORKERS = int(os.getenv("STAGE_WORKERS", "64"))
+CF_DNS_BATCH = os.getenv("CF_DNS_BATCH", "true").lower() == "true"
+CF_DNS_BATCH_SIZE = int(os.getenv("CF_DNS_BATCH_SIZE", "200"))
+# Create new DNS records by uploading them as one BIND zone file (/dns_records/import)
+CF_DNS_IMPORT = os.getenv("CF_DNS_IMPORT", "false").lower() == "true"
+# Zone settings managed by the bot: setting id -> desired value for an account.
+# ZONE_SETTINGS_EXTRA adds fixed values, e.g. {"brotli": "on", "ssl": "full"}; all are sent in one request
+ZONE_SETTINGS = {
+    "opportunistic_encryption": lambda account: "on" if account["opportunistic_encryption"] else "off",
+    "tls_1_3": lambda account: "on" if account["tls_1_3"] else "off",
+    "min_tls_version": lambda account: "1.2",
+    "always_use_https": lambda account: "on"
+}
+ZONE_SETTINGS.update({
+    setting: (lambda account, value=value: value)
+    for setting, value in json.loads(os.getenv("ZONE_SETTINGS_EXTRA", "{}")).items()
+})
+# Optionally read the current settings of already existing zones (one GET for all of them) and skip
+# the update when nothing differs. Off by default: it saves no calls (a GET instead of the PATCH when
+# the zone matches, a GET plus the PATCH when it does not), only writes to zones that are already right
+ZONE_SETTINGS_CHECK = os.getenv("ZONE_SETTINGS_CHECK", "false").lower() == "true"
+
+# "reconcile" sends only the differences against the zone's current records, "replace" deletes and recreates everything
+DNS_SYNC_MODE = os.getenv("DNS_SYNC_MODE", "reconcile").lower()
+# Record sets of every dns_config_type, compiled once at startup
+DNS_TEMPLATES_PATH = os.getenv("DNS_TEMPLATES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "dns_templates.json"))
+
+# Number of domains of one account processed at the same time (per-account "threads=N" line overrides it;
+# the asyncio engine uses ASYNC_DOMAIN_CONCURRENCY instead of this default)
+DOMAIN_CONCURRENCY = int(os.getenv("DOMAIN_CONCURRENCY", "5"))
+DOMAIN_CONCURRENCY_RE = re.compile(r'^(?:threads|concurrency)\s*=\s*(\d+)$', re.IGNORECASE)
+
+# Execution engine for the per-domain pipeline: "threads" (requests + thread pools) or "asyncio"
+CF_ENGINE = os.getenv("CF_ENGINE", "threads").lower()
+# HTTP client of the asyncio engine: "aiohttp" (non-blocking, needs the aiohttp package) or "requests"
+# (blocking calls in a thread pool); the bot refuses to start with CF_ENGINE=asyncio and no aiohttp
+CF_ASYNC_HTTP = os.getenv("CF_ASYNC_HTTP", "aiohttp").lower()
+ASYNC_MAX_INFLIGHT = int(os.getenv("ASYNC_MAX_INFLIGHT", "200"))
+ASYNC_DOMAIN_CONCURRENCY = int(os.getenv("ASYNC_DOMAIN_CONCURRENCY", "50"))
+
+# Outbound Telegram limits: calls per second overall and seconds between calls to one chat
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_INTERVAL = float(os.getenv("TELEGRAM_CHAT_INTERVAL", "1.0"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "5"))
+
+# Minimum seconds between two edits of a task's progress dashboard
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "1.5"))
+
+# Queue workers: how many tasks run at once and how many accounts of one task run at once
+TASK_WORKERS = int(os.getenv("TASK_WORKERS", "3"))
+ACCOUNT_CONCURRENCY = int(os.getenv("ACCOUNT_CONCURRENCY", "3"))
+# Fair queue: a task's cost is its domain count, divided by the weight of the submitter's role
+TASK_ROLE_WEIGHTS = {
+    item.split(':')[0]: float(item.split(':')[1])
+    for item in os.getenv("TASK_ROLE_WEIGHTS", "super-admin:4,admin:2,user:1").split(',') if ':' in item
+}
+# Starting guess for start-time estimates in /status, refined from finished tasks
+TASK_SECONDS_PER_DOMAIN = float(os.getenv("TASK_SECONDS_PER_DOMAIN", "3"))
+# Preflight: check keys, IPs and domains of each account before it touches any zone, and report the problems
+PREFLIGHT_ENABLED = os.getenv("PREFLIGHT_ENABLED", "true").lower() == "true"
+# Keys are verified this many accounts ahead of the account being started
+PREFLIGHT_LOOKAHEAD = int(os.getenv("PREFLIGHT_LOOKAHEAD", "10"))
+# Key checks remembered per task; a key that drops out is verified again when it shows up
+PREFLIGHT_KEY_CACHE = int(os.getenv("PREFLIGHT_KEY_CACHE", "1024"))
+# Typical Cloudflare calls per domain (zone create, DNS list and batch, settings), for the plan's estimate
+CF_CALLS_PER_DOMAIN = float(os.getenv("CF_CALLS_PER_DOMAIN", "4"))
+# Queued tasks and per-domain progress survive restarts in this SQLite file
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "7"))
+# Seconds between removals of expired jobs and traces while the bot runs
+JOB_PURGE_INTERVAL = float(os.getenv("JOB_PURGE_INTERVAL", "3600"))
+# Configurations sent as .txt/.csv documents are kept here until their task is finished
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+# Uploads are downloaded and queued this many at a time, off the Telegram polling threads
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "2"))
+
+# Prometheus-format metrics on a local HTTP endpoint (METRICS_PORT=0 turns it off)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Deadlines: socket timeouts of every Cloudflare call and time budgets per domain and per task
+CF_CONNECT_TIMEOUT = float(os.getenv("CF_CONNECT_TIMEOUT", "10"))
+CF_READ_TIMEOUT = float(os.getenv("CF_READ_TIMEOUT", "30"))
+DOMAIN_TIMEOUT = float(os.getenv("DOMAIN_TIMEOUT", "300"))
+TASK_TIMEOUT = float(os.getenv("TASK_TIMEOUT", "7200"))
+# How often waits re-check their budget, and how long past a budget a call counts as hung
+WATCHDOG_INTERVAL = float(os.getenv("WATCHDOG_INTERVAL", "5"))
+WATCHDOG_GRACE = float(os.getenv("WATCHDOG_GRACE", "60"))
+
+# Per-task JSONL traces (task → account → domain → stage → HTTP call), kept as long as jobs
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+
 EXAMPLE_CONFIG = """example@mail.com
 API_KEY_EXAMPLE
 example.com
@@ -67,11 +212,156 @@ def check_access(user_id):
     logger.info(f"Access for user {user_id}: {'Granted' if has_access else 'Denied'}")
     return has_access
 
+class AccountConfig:
+    """One parsed account. Slotted, since a large upload can hold thousands of them;
+    item access keeps the account["login"] style used across the pipeline working."""
+    
+    __slots__ = (
+        "login", "api_key", "domains", "ip_api_cdn", "ip_www",
+        "opportunistic_encryption", "tls_1_3", "dns_config_type", "domain_concurrency"
+    )
+    
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+    
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+    
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+class LineReader:
+    """Stripped non-empty lines of any iterable (text lines, an open file) with one line of lookahead"""
+    
+    __slots__ = ("_lines", "_pending")
+    
+    def __init__(self, lines):
+        self._lines = (line.strip() for line in lines)
+        self._pending = None
+    
+    def peek(self):
+        if self._pending is None:
+            self._pending = next((line for line in self._lines if line), None)
+        return self._pending
+    
+    def next(self):
+        line = self.peek()
+        self._pending = None
+        return line
+
+IPV4_RE = re.compile(r'^(?:(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)\.){3}(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)$')
+DOMAIN_RE = re.compile(
+    r'^(?=.{1,253}$)(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+(?:[a-z]{2,63}|xn--[a-z0-9-]{1,59})$',
+    re.IGNORECASE
+)
+def is_ip_line(line):
+    return line.count('.') == 3 and all(part.isdigit() for part in line.split('.'))
+
+def read_account(reader, login, api_key):
+    """Read the part shared by both formats: domains, IPs and the optional settings lines"""
+    domains = []
+    while reader.peek() is not None and not is_ip_line(reader.peek()):
+        domains.append(reader.next())
+    
+    ip_api_cdn = reader.next()
+    if ip_api_cdn is None:
+        return None
+    
+    ip_www = reader.next()
+    if ip_www is None:
+        return None
+    
+    opportunistic_encryption = False
+    tls_1_3 = False
+    dns_config_type = 1
+    
+    line = reader.next()
+    if line is not None:
+        opportunistic_encryption = line.lower() == 'true'
+    
+    line = reader.next()
+    if line is not None:
+        tls_1_3 = line.lower() == 'true'
+    
+    line = reader.next()
+    if line is not None:
+        try:
+            dns_config_type = int(line)
+        except ValueError:
+            dns_config_type = 1
+    
+    # Optional per-account domain concurrency, e.g. "threads=10"
+    domain_concurrency = None
+    if reader.peek() is not None:
+        match = DOMAIN_CONCURRENCY_RE.match(reader.peek())
+        if match:
+            domain_concurrency = max(1, int(match.group(1)))
+            reader.next()
+    
+    return AccountConfig(
+        login=login,
+        api_key=api_key,
+        domains=domains,
+        ip_api_cdn=ip_api_cdn,
+        ip_www=ip_www,
+        opportunistic_encryption=opportunistic_encryption,
+        tls_1_3=tls_1_3,
+        dns_config_type=dns_config_type,
+        domain_concurrency=domain_concurrency
+    )
+
+def iter_cloudflare_format(lines):
+    """Yield accounts of the "login|password|api_key" format one at a time"""
+    reader = lines if isinstance(lines, LineReader) else LineReader(lines)
+    while True:
+        current_line = reader.next()
+        if current_line is None:
+            return
+        
+        if '|' in current_line:
+            parts = current_line.split('|')
+            if len(parts) >= 3:
+                account = read_account(reader, parts[0].strip(), parts[2].strip())
+                if account is None:
+                    return
+                yield account
+
+def iter_regular_format(lines):
+    """Yield accounts of the regular format one at a time"""
+    reader = lines if isinstance(lines, LineReader) else LineReader(lines)
+    while True:
+        login = reader.next()
+        if login is None:
+            return
+        
+        api_key = reader.next()
+        if api_key is None:
+            return
+        
+        account = read_account(reader, login, api_key)
+        if account is None:
+            return
+        yield account
+
+def uses_cloudflare_format(lines):
+    """A '|' anywhere in the input marks the "login|password|api_key" format"""
+    return any('|' in line for line in lines)
+
+def iter_accounts(lines, cloudflare_format):
+    """Yield accounts as soon as they are parsed"""
+    if cloudflare_format:
+        return iter_cloudflare_format(lines)
+    return iter_regular_format(lines)
+
 def parse_input_text(text):
 
     logger.info(f"Received text for parsing: {text[:50]}...")
     
-    if '|' in text:
+    if uses_cloudflare_format(text.split('\n')):
         result = parse_cloudflare_format(text)
     else:
         result = parse_regular_format(text)
@@ -80,133 +370,369 @@ def parse_input_text(text):
     return result
 
 def parse_cloudflare_format(text):
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-    accounts = []
-    
-    i = 0
-    while i < len(lines):
-        current_line = lines[i]
-        i += 1
-        
-        if '|' in current_line:
-            parts = current_line.split('|')
-            if len(parts) >= 3: 
-                login = parts[0].strip()
-                api_key = parts[2].strip() 
-                
-                domains = []
-                while i < len(lines) and not (lines[i].count('.') == 3 and all(part.isdigit() for part in lines[i].split('.'))):
-                    domains.append(lines[i])
-                    i += 1
-                
-                if i >= len(lines):
-                    break
-                    
-                ip_api_cdn = lines[i]
-                i += 1
-                
-                if i >= len(lines):
-                    break
-                    
-                ip_www = lines[i]
-                i += 1
-                
-                opportunistic_encryption = False
-                tls_1_3 = False
-                dns_config_type = 1
-                
-                if i < len(lines):
-                    opportunistic_encryption = lines[i].lower() == 'true'
-                    i += 1
-                    
-                if i < len(lines):
-                    tls_1_3 = lines[i].lower() == 'true'
-                    i += 1
-                    
-                if i < len(lines):
-                    try:
-                        dns_config_type = int(lines[i])
-                    except ValueError:
-                        dns_config_type = 1
-                    i += 1
-                
-                accounts.append({
-                    "login": login,
-                    "api_key": api_key,
-                    "domains": domains,
-                    "ip_api_cdn": ip_api_cdn,
-                    "ip_www": ip_www,
-                    "opportunistic_encryption": opportunistic_encryption,
-                    "tls_1_3": tls_1_3,
-                    "dns_config_type": dns_config_type
-                })
-    
-    return accounts
+    return list(iter_cloudflare_format(text.split('\n')))
 
 def parse_regular_format(text):
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    return list(iter_regular_format(text.split('\n')))
+
+class Metrics:
+    """In-process counters, histograms and gauges, rendered in the Prometheus text format"""
     
-    accounts = []
-    i = 0
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._kinds = {}
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
     
-    while i < len(lines):
-        login = lines[i]
-        i += 1
+    def describe(self, name, kind, help_text):
+        self._kinds[name] = (kind, help_text)
+    
+    def gauge(self, name, read, help_text):
+        """Register a gauge whose value is read when metrics are rendered"""
+        self.describe(name, "gauge", help_text)
+        self._gauges[name] = read
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+    
+    def counters(self, name):
+        with self._lock:
+            return {labels: value for (key, labels), value in self._counters.items() if key == name}
+    
+    def histograms(self, name, *group_by):
+        """Histograms of name merged over every label not in group_by: {label values: [buckets, sum, count]}"""
+        merged = {}
+        with self._lock:
+            for (key, labels), (buckets, total, count) in self._histograms.items():
+                if key != name:
+                    continue
+                labels = dict(labels)
+                group = tuple(labels.get(label) for label in group_by)
+                current = merged.setdefault(group, [[0] * len(self.buckets), 0.0, 0])
+                current[0] = [a + b for a, b in zip(current[0], buckets)]
+                current[1] += total
+                current[2] += count
+        return merged
+    
+    def quantile(self, buckets, count, share):
+        """Upper bound of the bucket holding the given share of observations"""
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, buckets):
+            seen += bucket_count
+            if count and seen >= share * count:
+                return bound
+        return float("inf")
+    
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = []
+        for key, value in pairs:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            escaped.append(f'{key}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+    
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(value[0]), value[1], value[2]) for key, value in self._histograms.items()}
         
-        if i >= len(lines):
-            break
-            
-        api_key = lines[i]
-        i += 1
+        lines = []
+        described = set()
         
-        domains = []
-        while i < len(lines) and not (lines[i].count('.') == 3 and all(part.isdigit() for part in lines[i].split('.'))):
-            domains.append(lines[i])
-            i += 1
-            
-        if i >= len(lines):
-            break
-            
-        ip_api_cdn = lines[i]
-        i += 1
+        def header(name):
+            if name not in described and name in self._kinds:
+                kind, help_text = self._kinds[name]
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
         
-        if i >= len(lines):
-            break
-            
-        ip_www = lines[i]
-        i += 1
+        for (name, labels), value in sorted(counters.items()):
+            header(name)
+            lines.append(f"{name}{self._labels(labels)} {value}")
         
-        opportunistic_encryption = False
-        tls_1_3 = False
-        dns_config_type = 1
+        for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+            header(name)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, buckets):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total}")
+            lines.append(f"{name}_count{self._labels(labels)} {count}")
         
-        if i < len(lines):
-            opportunistic_encryption = lines[i].lower() == 'true'
-            i += 1
-            
-        if i < len(lines):
-            tls_1_3 = lines[i].lower() == 'true'
-            i += 1
-            
-        if i < len(lines):
+        for name, read in sorted(self._gauges.items()):
             try:
-                dns_config_type = int(lines[i])
-            except ValueError:
-                dns_config_type = 1
-            i += 1
-            
-        accounts.append({
-            "login": login,
-            "api_key": api_key,
-            "domains": domains,
-            "ip_api_cdn": ip_api_cdn,
-            "ip_www": ip_www,
-            "opportunistic_encryption": opportunistic_encryption,
-            "tls_1_3": tls_1_3,
-            "dns_config_type": dns_config_type
-        })
+                value = read()
+            except Exception as e:
+                logger.error(f"Error reading gauge {name}: {str(e)}")
+                continue
+            header(name)
+            lines.append(f"{name} {value}")
         
-    return accounts
+        return "\n".join(lines) + "\n"
+
+current_span = contextvars.ContextVar("current_span", default=None)
+
+class TaskTrace:
+    """JSONL trace file of one task; spans are appended as they finish"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+    
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self.lock:
+            if self._file is not None:
+                self._file.write(line + "\n")
+    
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class Span:
+    """One timed operation of a task trace"""
+    
+    __slots__ = ("trace", "span_id", "parent", "name", "attrs", "start", "_started", "status", "retries")
+    
+    def __init__(self, trace, name, parent=None, **attrs):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent = parent
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self._started = time.monotonic()
+        self.status = "ok"
+        self.retries = 0
+    
+    def finish(self, status=None):
+        if status is not None:
+            self.status = status
+        duration = time.monotonic() - self._started
+        # Retries bubble up, so a domain or task shows how many calls it had to repeat
+        if self.parent is not None and self.retries:
+            with self.trace.lock:
+                self.parent.retries += self.retries
+        self.trace.write({
+            "span": self.span_id,
+            "parent": self.parent.span_id if self.parent is not None else None,
+            "name": self.name,
+            "start": self.start,
+            "end": self.start + duration,
+            "duration": duration,
+            "status": self.status,
+            "retries": self.retries,
+            "attrs": self.attrs
+        })
+
+def start_span(name, **attrs):
+    """Child of the current span, or None when nothing is being traced"""
+    parent = current_span.get()
+    if parent is None:
+        return None
+    return Span(parent.trace, name, parent, **attrs)
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Trace the enclosed block as a child of the current span"""
+    child = start_span(name, **attrs)
+    if child is None:
+        yield None
+        return
+    token = current_span.set(child)
+    try:
+        yield child
+    except BaseException:
+        child.status = "error"
+        raise
+    finally:
+        current_span.reset(token)
+        child.finish()
+
+def with_context(fn):
+    """Bind fn to the caller's context (trace span, time budget), for work handed to other threads"""
+    context = contextvars.copy_context()
+    
+    def run(*args, **kwargs):
+        # A context can only be entered by one thread at a time, so every call gets its own copy
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+class DeadlineExceeded(TimeoutError):
+    """The time budget of the current domain or task ran out"""
+
+def time_left():
+    """Seconds left in the current time budget, or None without one"""
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def budget_deadline(seconds):
+    """Deadline seconds from now, never later than the current one"""
+    deadline = time.monotonic() + seconds
+    outer = current_deadline.get()
+    return deadline if outer is None else min(deadline, outer)
+
+def request_timeout(delay=0.0):
+    """(connect, read) timeout of an API call, shortened to fit the current budget"""
+    left = time_left()
+    if left is None:
+        return (CF_CONNECT_TIMEOUT, CF_READ_TIMEOUT)
+    left -= delay
+    if left <= 0:
+        raise DeadlineExceeded("time budget exceeded")
+    return (min(CF_CONNECT_TIMEOUT, left), min(CF_READ_TIMEOUT, left))
+
+def trace_path(job_id):
+    return os.path.join(TRACE_DIR, f"job-{job_id}.jsonl")
+
+def open_task_trace(job_id, **attrs):
+    """Root span of a task's trace, or None when tracing is off or the file cannot be opened"""
+    if not TRACE_ENABLED:
+        return None
+    try:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        name = job_id if job_id is not None else f"untracked-{int(time.time() * 1000)}"
+        return Span(TaskTrace(trace_path(name)), "task", job_id=job_id, **attrs)
+    except Exception as e:
+        logger.error(f"Error opening trace for job {job_id}: {str(e)}")
+        return None
+
+def purge_traces(older_than=JOB_RETENTION_DAYS * 86400):
+    if not os.path.isdir(TRACE_DIR):
+        return
+    cutoff = time.time() - older_than
+    for name in os.listdir(TRACE_DIR):
+        path = os.path.join(TRACE_DIR, name)
+        try:
+            if name.endswith(".jsonl") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError as e:
+            logger.error(f"Error removing trace {path}: {str(e)}")
+
+class StageTimer:
+    """Times consecutive pipeline stages of one domain: domain_stage_seconds and trace spans.
+
+    The domain span and the current stage span are made current, so HTTP calls of a stage
+    are traced under it. A stage is marked failed when it added to errors. Only the zone
+    lookup/create is consecutive; the stages after it overlap and are timed by StagePipeline.
+    """
+    
+    __slots__ = ("_stage", "_started", "_errors", "_error_count", "_domain_span", "_stage_span", "_tokens")
+    
+    def __init__(self, errors=None, **attrs):
+        self._stage = None
+        self._started = 0.0
+        self._errors = errors if errors is not None else []
+        self._error_count = 0
+        self._stage_span = None
+        self._tokens = []
+        self._domain_span = start_span("domain", **attrs)
+        if self._domain_span is not None:
+            self._tokens.append(current_span.set(self._domain_span))
+    
+    def enter(self, stage):
+        now = time.monotonic()
+        if self._stage is not None:
+            metrics.observe("domain_stage_seconds", now - self._started, stage=self._stage)
+        if self._stage_span is not None:
+            current_span.reset(self._tokens.pop())
+            self._stage_span.finish("error" if len(self._errors) > self._error_count else "ok")
+            self._stage_span = None
+        self._stage = stage
+        self._started = now
+        self._error_count = len(self._errors)
+        if stage is not None and self._domain_span is not None:
+            self._stage_span = Span(self._domain_span.trace, stage, self._domain_span)
+            self._tokens.append(current_span.set(self._stage_span))
+    
+    def close(self):
+        self.enter(None)
+        if self._domain_span is not None:
+            current_span.reset(self._tokens.pop())
+            self._domain_span.finish("error" if self._errors else "ok")
+            self._domain_span = None
+
+# Short stage names for metrics and traces, keyed by the text shown on the dashboard
+STAGE_NAMES = {"Checking domain": "lookup", "Setting up DNS": "dns", "Configuring SSL": "ssl"}
+
+metrics = Metrics()
+metrics.describe("cf_requests_total", "counter", "Cloudflare API calls by method, endpoint and HTTP status")
+metrics.describe("cf_request_seconds", "histogram", "Cloudflare API call latency by method and endpoint")
+metrics.describe("cf_rate_limit_wait_seconds", "histogram", "Time spent waiting for the per-account rate limiter")
+metrics.describe("telegram_requests_total", "counter", "Telegram API calls by method and outcome")
+metrics.describe("telegram_request_seconds", "histogram", "Telegram API call latency by method")
+metrics.describe("domain_stage_seconds", "histogram", "Duration of each per-domain pipeline stage")
+metrics.describe("account_setup_seconds", "histogram", "Duration of setup_zones for one account")
+metrics.describe("tasks_total", "counter", "Finished queue tasks by final status")
+metrics.describe("cf_retries_total", "counter", "Cloudflare API calls retried after a 5xx answer or a transport error")
+metrics.describe("cf_breaker_open_total", "counter", "Times a rejected API key opened its circuit breaker")
+metrics.describe("watchdog_abandoned_total", "counter", "Domains and workers abandoned after hanging past their time budget")
+metrics.gauge("task_queue_depth", lambda: task_queue.qsize(), "Tasks waiting in the queue")
+metrics.gauge("task_workers_active", lambda: len(active_jobs), "Queue workers processing a task")
+metrics.gauge("task_workers_total", lambda: TASK_WORKERS, "Queue workers started")
+metrics.gauge("cf_io_running", lambda: io_scheduler.stats()["running"], "Cloudflare requests in flight (threads engine)")
+metrics.gauge("cf_io_queued", lambda: io_scheduler.stats()["queued"], "Cloudflare calls waiting for a request slot or the shared I/O pool")
+metrics.gauge("telegram_outbox_pending", lambda: outbox.pending(), "Telegram calls waiting in the outbox")
+
+CF_ID_RE = re.compile(r'[0-9a-f]{32}')
+
+def cf_endpoint(path):
+    """Metrics label for an API path: zone and record ids collapsed so endpoints aggregate"""
+    return CF_ID_RE.sub("{id}", path.split('?')[0])
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != "/metrics":
+            self.send_error(404)
+            return
+        payload = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve /metrics for Prometheus on a background thread; returns the server or None"""
+    if port <= 0:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logger.error(f"Error starting metrics server on {host}:{port}: {str(e)}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Metrics available at http://{host}:{port}/metrics")
+    return server
 
 def get_headers(login, api_key):
     return {
@@ -215,42 +741,675 @@ def get_headers(login, api_key):
         "Content-Type": "application/json"
     }
 
+class RateLimiter:
+    """Token bucket per Cloudflare user (X-Auth-Email), shared by every task using the account.
+
+    Callers are never refused: each request reserves the next free slot and sleeps until it,
+    so bursts turn into a queue instead of 429 errors.
+    """
+
+    def __init__(self, limit=CF_RATE_LIMIT, window=CF_RATE_WINDOW, burst=CF_RATE_BURST):
+        self.capacity = max(1, min(burst, limit))
+        # burst + rate * window never exceeds the budget of one window
+        self.rate = max(limit - self.capacity, 1) / window
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = {
+                "tokens": float(self.capacity),
+                "updated": now,
+                "blocked_until": 0.0,
+                "requests": 0,
+                "waited": 0.0,
+                "max_wait": 0.0,
+                "throttled": 0,
+                "last_used": time.time()
+            }
+            self._buckets[key] = bucket
+        return bucket
+
+    def reserve(self, key):
+        """Take a token for key and return how many seconds the caller has to wait before sending"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(key, now)
+            bucket["tokens"] = min(self.capacity, bucket["tokens"] + (now - bucket["updated"]) * self.rate)
+            bucket["updated"] = now
+            bucket["tokens"] -= 1
+
+            delay = -bucket["tokens"] / self.rate if bucket["tokens"] < 0 else 0.0
+            delay = max(delay, bucket["blocked_until"] - now)
+
+            bucket["requests"] += 1
+            bucket["waited"] += delay
+            bucket["max_wait"] = max(bucket["max_wait"], delay)
+            bucket["last_used"] = time.time()
+            return delay
+
+    def acquire(self, key):
+        delay = self.reserve(key)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def penalize(self, key, retry_after):
+        """Stop every request of key for retry_after seconds after Cloudflare answered 429"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(key, now)
+            bucket["blocked_until"] = max(bucket["blocked_until"], now + retry_after)
+            bucket["tokens"] = min(bucket["tokens"], 0.0)
+            bucket["throttled"] += 1
+
+    def stats(self, key=None):
+        """Wait statistics per account: requests, total/max wait seconds and 429 count"""
+        with self._lock:
+            items = self._buckets.items() if key is None else [(key, self._buckets[key])] if key in self._buckets else []
+            return {
+                name: {
+                    "requests": bucket["requests"],
+                    "waited": bucket["waited"],
+                    "max_wait": bucket["max_wait"],
+                    "throttled": bucket["throttled"],
+                    "last_used": bucket["last_used"]
+                }
+                for name, bucket in items
+            }
+
+rate_limiter = RateLimiter()
+
+def parse_retry_after(value, default=10.0):
+    """Retry-After is either a number of seconds or an HTTP date"""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+# Cloudflare error codes for missing, malformed or unknown credentials
+CF_AUTH_ERROR_CODES = {6003, 6103, 6111, 9103, 9106, 9107, 10000}
+
+# Transport failures worth another attempt for calls that are safe to repeat
+RETRYABLE_ERRORS = (requests.ConnectionError, requests.Timeout, asyncio.TimeoutError)
+if aiohttp is not None:
+    RETRYABLE_ERRORS += (aiohttp.ClientConnectionError,)
+# Methods with the same effect when repeated. A POST that timed out or got a 5xx may still have
+# been applied, so it is only resent when no connection was made (see request_never_sent)
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "PATCH", "DELETE"}
+
+def request_never_sent(error):
+    """True when a failed call certainly did not reach Cloudflare (the connection was never made)"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if aiohttp is not None and isinstance(error, (aiohttp.ClientConnectorError, getattr(aiohttp, "ConnectionTimeoutError", ()))):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], "reason", None), NewConnectionError)
+    return False
+
+def retryable_error(idempotent, error):
+    return isinstance(error, RETRYABLE_ERRORS) if idempotent else request_never_sent(error)
+
+def classify_cf_response(status, data):
+    """'ok', 'retry' (5xx), 'auth' (credentials rejected), 'throttled' (429) or 'fatal' (other 4xx)"""
+    if status >= 500:
+        return "retry"
+    if status == 429:
+        return "throttled"
+    codes = set()
+    if status >= 400 and isinstance(data, dict):
+        codes = {error.get("code") for error in data.get("errors") or [] if isinstance(error, dict)}
+    if status == 401 or codes & CF_AUTH_ERROR_CODES:
+        return "auth"
+    return "ok" if status < 400 else "fatal"
+
+def response_data(response):
+    """JSON body of a requests response, or None when it is not JSON (e.g. a 5xx HTML page)"""
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+def retry_backoff(failures):
+    """Seconds to wait before retrying a call that failed failures times, or None to give up"""
+    if failures > CF_RETRIES:
+        return None
+    delay = random.uniform(0, min(CF_RETRY_MAX, CF_RETRY_BASE * 2 ** (failures - 1)))
+    left = time_left()
+    if left is not None and delay >= left:
+        return None
+    return delay
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Cloudflare with an API key it has just rejected"""
+
+class CredentialBreaker:
+    """Circuit breaker per Cloudflare credential (login + API key).
+
+    CF_BREAKER_THRESHOLD auth failures in a row open it: every further call with the key fails at
+    once instead of reaching Cloudflare, so a revoked key costs a few requests, not a few per domain.
+    After CF_BREAKER_COOLDOWN calls go through again, and the next auth failure reopens it at once.
+    """
+
+    def __init__(self, threshold=CF_BREAKER_THRESHOLD, cooldown=CF_BREAKER_COOLDOWN):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def is_open(self, login, api_key):
+        with self._lock:
+            state = self._states.get((login, api_key))
+            return state is not None and state["opened_at"] is not None and time.monotonic() - state["opened_at"] < self.cooldown
+
+    def check(self, login, api_key):
+        if self.is_open(login, api_key):
+            raise CircuitOpenError(f"Cloudflare rejected the API key of {login}")
+
+    def record(self, login, api_key, outcome):
+        """Count an auth failure, or forget earlier ones once the key works; other outcomes say nothing.
+
+        A non-auth 4xx (e.g. a rejected record) does not prove the key is still valid, and concurrent
+        calls can land one between two auth failures, so only a successful call resets the count.
+        """
+        key = (login, api_key)
+        with self._lock:
+            if outcome == "ok":
+                self._states.pop(key, None)
+                return
+            if outcome != "auth":
+                return
+            state = self._states.setdefault(key, {"failures": 0, "opened_at": None})
+            state["failures"] += 1
+            if state["failures"] < self.threshold:
+                return
+            now = time.monotonic()
+            if state["opened_at"] is not None and now - state["opened_at"] < self.cooldown:
+                return
+            state["opened_at"] = now
+        logger.error(f"Cloudflare rejected the API key of {login} {self.threshold} times, failing its calls for {self.cooldown:.0f}s")
+        metrics.inc("cf_breaker_open_total")
+
+credential_breaker = CredentialBreaker()
+
+class CloudflareClient:
+    """Shared Cloudflare API client with pooled keep-alive sessions per account"""
+
+    def __init__(self, base_url=CF_API_BASE, pool_size=CF_POOL_SIZE, max_sessions=CF_MAX_SESSIONS, limiter=None):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.max_sessions = max_sessions
+        self.limiter = limiter or rate_limiter
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _new_session(self, login, api_key):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        # Content-Type is set per request by requests itself (json= / files=)
+        headers = get_headers(login, api_key)
+        headers.pop("Content-Type", None)
+        session.headers.update(headers)
+        return session
+
+    def session(self, login, api_key):
+        key = (login, api_key)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+                return session
+
+            session = self._new_session(login, api_key)
+            self._sessions[key] = session
+
+            # Drop the least recently used accounts so long-running bots don't keep sockets forever.
+            # Another thread may still be sending a request on an evicted session, so it is not closed
+            # here: its connections go away with it once that request is done
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def request(self, login, api_key, method, path, idempotent=None, **kwargs):
+        """Send one API call with retries; idempotent=True marks a POST whose caller copes with a repeat"""
+        credential_breaker.check(login, api_key)
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        session = self.session(login, api_key)
+        url = f"{self.base_url}{path}"
+        endpoint = cf_endpoint(path)
+        attempt = 0
+        failures = 0
+        with span("http", method=method, endpoint=endpoint) as http_span:
+            while True:
+                request_timeout()
+                delay = self.limiter.reserve(login)
+                # Fails fast when the wait for the rate limiter alone would overrun the budget
+                request_timeout(delay)
+                if delay > 0:
+                    time.sleep(delay)
+                metrics.observe("cf_rate_limit_wait_seconds", delay)
+                started = time.monotonic()
+                try:
+                    with io_scheduler.inflight(login):
+                        started = time.monotonic()
+                        response = session.request(method, url, **dict({"timeout": request_timeout()}, **kwargs))
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    metrics.inc("cf_requests_total", method=method, endpoint=endpoint, status="error")
+                    failures += 1
+                    backoff = retry_backoff(failures) if retryable_error(idempotent, e) else None
+                    if backoff is None:
+                        raise
+                    logger.warning(f"Cloudflare call {method} {path} for {login} failed: {str(e)}, retrying in {backoff:.1f}s (attempt {failures})")
+                    metrics.inc("cf_retries_total", reason="error")
+                    time.sleep(backoff)
+                    continue
+                finally:
+                    metrics.observe("cf_request_seconds", time.monotonic() - started, method=method, endpoint=endpoint)
+                metrics.inc("cf_requests_total", method=method, endpoint=endpoint, status=response.status_code)
+                outcome = classify_cf_response(response.status_code, response_data(response) if response.status_code >= 400 else None)
+                credential_breaker.record(login, api_key, outcome)
+                if http_span is not None:
+                    http_span.attrs["http_status"] = response.status_code
+                    http_span.retries = attempt + failures
+                    http_span.status = "ok" if response.status_code < 400 else "error"
+                
+                if outcome == "retry" and idempotent:
+                    failures += 1
+                    backoff = retry_backoff(failures)
+                    if backoff is None:
+                        return response
+                    logger.warning(f"Cloudflare answered {response.status_code} to {method} {path} for {login}, retrying in {backoff:.1f}s (attempt {failures})")
+                    metrics.inc("cf_retries_total", reason="status")
+                    time.sleep(backoff)
+                    continue
+                if response.status_code != 429 or attempt >= CF_RATE_LIMIT_RETRIES:
+                    return response
+
+                # Budget exhausted: hold every request of this account, then try again
+                attempt += 1
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                logger.warning(f"Cloudflare rate limit hit for {login} on {method} {path}, retrying in {retry_after:.0f}s (attempt {attempt})")
+                self.limiter.penalize(login, retry_after)
+
+    def get(self, login, api_key, path, **kwargs):
+        return self.request(login, api_key, "GET", path, **kwargs)
+
+    def post(self, login, api_key, path, **kwargs):
+        return self.request(login, api_key, "POST", path, **kwargs)
+
+    def patch(self, login, api_key, path, **kwargs):
+        return self.request(login, api_key, "PATCH", path, **kwargs)
+
+    def delete(self, login, api_key, path, **kwargs):
+        return self.request(login, api_key, "DELETE", path, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+cf_client = CloudflareClient()
+
+class IOScheduler:
+    """Process-wide limits on Cloudflare calls, plus a bounded executor for fanning calls out.
+
+    inflight() is held by CloudflareClient around every HTTP call, whatever thread makes it:
+    at most max_workers requests are on the wire at once, and at most per_account of them for
+    one account, so a large or throttled account cannot take every connection. submit() runs a
+    call on the shared pool and blocks the caller while the account has per_account calls
+    queued or running there, so one account cannot take every worker either. Tasks submitted
+    here must not submit and wait on further tasks themselves.
+    """
+
+    def __init__(self, max_workers=IO_MAX_WORKERS, per_account=IO_ACCOUNT_MAX_INFLIGHT):
+        self.max_workers = max_workers
+        self.per_account = max(1, min(per_account, max_workers))
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cf-io")
+        self._lock = threading.Lock()
+        self._global_slots = threading.BoundedSemaphore(max_workers)
+        self._account_slots = {}
+        self._submit_slots = {}
+        self._queued = 0
+        self._waiting = 0
+        self._running = 0
+        self._completed = 0
+        self._busy_time = 0.0
+        self._started = time.monotonic()
+
+    def _slot(self, slots, account):
+        with self._lock:
+            slot = slots.get(account)
+            if slot is None:
+                slot = slots[account] = threading.BoundedSemaphore(self.per_account)
+            return slot
+
+    @contextlib.contextmanager
+    def inflight(self, account):
+        """Hold a global and a per-account request slot; the wait counts against the time budget"""
+        slots = (self._slot(self._account_slots, account), self._global_slots)
+        with self._lock:
+            self._waiting += 1
+        acquired = []
+        try:
+            for slot in slots:
+                left = time_left()
+                if not slot.acquire(timeout=None if left is None else max(0.0, left)):
+                    raise DeadlineExceeded("time budget exceeded waiting for a Cloudflare request slot")
+                acquired.append(slot)
+        except BaseException:
+            for slot in acquired:
+                slot.release()
+            raise
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        with self._lock:
+            self._running += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+                self._busy_time += time.monotonic() - started
+            for slot in acquired:
+                slot.release()
+
+    def submit(self, account, fn, *args, **kwargs):
+        """Schedule fn for account; blocks the caller while the account has per_account calls on the pool"""
+        slot = self._slot(self._submit_slots, account)
+        slot.acquire()
+        fn = with_context(fn)
+
+        def run():
+            with self._lock:
+                self._queued -= 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                slot.release()
+
+        with self._lock:
+            self._queued += 1
+        try:
+            return self._executor.submit(run)
+        except Exception:
+            with self._lock:
+                self._queued -= 1
+            slot.release()
+            raise
+
+    def stats(self):
+        """running: requests on the wire; queued: calls waiting for a request slot or a pool worker"""
+        with self._lock:
+            elapsed = max(time.monotonic() - self._started, 1e-9)
+            return {
+                "max_workers": self.max_workers,
+                "per_account": self.per_account,
+                "queued": self._queued + self._waiting,
+                "running": self._running,
+                "completed": self._completed,
+                "utilization": self._running / self.max_workers,
+                "busy_ratio": self._busy_time / (elapsed * self.max_workers)
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+io_scheduler = IOScheduler()
+
+class StagePipeline:
+    """Runs the stages of one domain as a dependency graph (DOMAIN_STAGE_DEPS).
+
+    Stages are callables returning True on success. Every stage whose dependencies succeeded is
+    started at once: one in the calling thread, the rest on a shared pool (or as asyncio tasks),
+    so a domain's independent stages overlap each other and the stages of other domains. A stage
+    whose dependency failed is skipped. STAGE_LIMITS bounds each stage process-wide.
+    The stage pool only waits on io_scheduler, never on itself.
+    """
+
+    def __init__(self, deps=DOMAIN_STAGE_DEPS, limits=STAGE_LIMITS, workers=STAGE_WORKERS):
+        unknown = [stage for stage in limits if stage not in deps]
+        if unknown:
+            raise ValueError(f"STAGE_LIMITS: unknown stages {', '.join(unknown)}")
+        self.deps = deps
+        self.limits = {stage: limit for stage, limit in limits.items() if limit > 0}
+        self.workers = workers
+        self._slots = {stage: threading.BoundedSemaphore(limit) for stage, limit in self.limits.items()}
+        self._async_slots = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="domain-stages")
+            return self._executor
+
+    def _next(self, pending, succeeded, failed):
+        """Drop stages that can no longer run and return the ones ready to start"""
+        for stage in [stage for stage in pending if any(dep in failed for dep in self.deps.get(stage, ()))]:
+            del pending[stage]
+            failed.add(stage)
+        return [stage for stage in pending if all(dep in succeeded for dep in self.deps.get(stage, ()))]
+
+    @contextlib.contextmanager
+    def _timed(self, stage):
+        started = time.monotonic()
+        try:
+            with span(stage) as stage_span:
+                yield stage_span
+        finally:
+            metrics.observe("domain_stage_seconds", time.monotonic() - started, stage=stage)
+
+    def _run_stage(self, stage, fn):
+        slot = self._slots.get(stage)
+        if slot is not None:
+            slot.acquire()
+        try:
+            with self._timed(stage) as stage_span:
+                ok = bool(fn())
+                if stage_span is not None and not ok:
+                    stage_span.status = "error"
+                return ok
+        finally:
+            if slot is not None:
+                slot.release()
+
+    def run(self, stages, done=()):
+        """Run stages ({name: fn}) whose dependencies are met; returns the names that succeeded.
+
+        An exception of a stage (deadline, open breaker) stops new stages from starting and is
+        raised once the running ones have finished.
+        """
+        succeeded, failed = set(done), set()
+        pending = dict(stages)
+        running = {}
+        error = None
+        while pending or running:
+            ready = self._next(pending, succeeded, failed) if error is None else []
+            for stage in ready[1:]:
+                running[self._pool().submit(with_context(self._run_stage), stage, pending.pop(stage))] = stage
+            if ready:
+                stage = ready[0]
+                try:
+                    ok = self._run_stage(stage, pending.pop(stage))
+                except Exception as e:
+                    error, ok = error or e, False
+                (succeeded if ok else failed).add(stage)
+                continue
+            if not running:
+                break
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    ok = future.result()
+                except Exception as e:
+                    error, ok = error or e, False
+                (succeeded if ok else failed).add(stage)
+        if error is not None:
+            raise error
+        return succeeded
+
+    async def _run_stage_async(self, stage, fn):
+        slot = None
+        if stage in self.limits:
+            slot = self._async_slots.get(stage)
+            if slot is None:
+                slot = self._async_slots[stage] = asyncio.Semaphore(self.limits[stage])
+            await slot.acquire()
+        try:
+            with self._timed(stage) as stage_span:
+                ok = bool(await fn())
+                if stage_span is not None and not ok:
+                    stage_span.status = "error"
+                return ok
+        finally:
+            if slot is not None:
+                slot.release()
+
+    async def run_async(self, stages, done=()):
+        """Asyncio version of run: stages are coroutine functions, each started as a task"""
+        succeeded, failed = set(done), set()
+        pending = dict(stages)
+        running = {}
+        error = None
+        try:
+            while pending or running:
+                ready = self._next(pending, succeeded, failed) if error is None else []
+                for stage in ready:
+                    running[asyncio.ensure_future(self._run_stage_async(stage, pending.pop(stage)))] = stage
+                if not running:
+                    break
+                finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    stage = running.pop(task)
+                    try:
+                        ok = task.result()
+                    except Exception as e:
+                        error, ok = error or e, False
+                    (succeeded if ok else failed).add(stage)
+        finally:
+            # Cancelled from outside (domain budget): do not leave stage tasks running
+            for task in running:
+                task.cancel()
+        if error is not None:
+            raise error
+        return succeeded
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+stage_pipeline = StagePipeline()
+
 def create_zone(login, api_key, domain):
-    url = "https://api.cloudflare.com/client/v4/zones"
     data = {"name": domain, "jump_start": True}
     try:
-        response = requests.post(url, headers=get_headers(login, api_key), json=data)
+        # A repeated create that Cloudflare had applied answers "already exists", which callers resolve
+        response = cf_client.post(login, api_key, "/zones", json=data, idempotent=True)
         return response.json()
     except Exception as e:
         logger.error(f"Error creating zone {domain}: {str(e)}")
         return {"success": False, "error": str(e)}
 
-def check_zone_exists(login, api_key, domain):
-    url = "https://api.cloudflare.com/client/v4/zones"
+def find_zone(login, api_key, domain):
+    """Zone object (id, status, name_servers, ...) for a domain, or None"""
     params = {"name": domain}
     try:
-        response = requests.get(url, headers=get_headers(login, api_key), params=params)
+        response = cf_client.get(login, api_key, "/zones", params=params)
         data = response.json()
         if data.get('success') and data.get('result') and len(data['result']) > 0:
-            return data['result'][0]['id']
+            return data['result'][0]
         return None
     except Exception as e:
         logger.error(f"Error checking if zone exists {domain}: {str(e)}")
         return None
 
+def check_zone_exists(login, api_key, domain):
+    zone = find_zone(login, api_key, domain)
+    return zone['id'] if zone else None
+
+class ZoneIndex:
+    """Name -> zone lookup for a whole account, built from one paginated /zones listing"""
+
+    def __init__(self, login, api_key):
+        self.login = login
+        self.api_key = api_key
+        self._zones = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        page = 1
+        while True:
+            response = cf_client.get(self.login, self.api_key, "/zones", params={"page": page, "per_page": 50})
+            data = response.json()
+            if not data.get('success'):
+                raise RuntimeError(f"Failed to list zones: {data.get('errors', ['Unknown error'])}")
+            for zone in data.get('result') or []:
+                self.add(zone)
+            if page >= data.get('result_info', {}).get('total_pages', 1):
+                break
+            page += 1
+        logger.info(f"Zone index for {self.login}: {len(self._zones)} zones")
+        return self
+
+    def add(self, zone):
+        """Record a zone from a listing or a create_zone result"""
+        entry = {
+            "id": zone["id"],
+            "status": zone.get("status"),
+            "name_servers": zone.get("name_servers") or []
+        }
+        with self._lock:
+            self._zones[zone["name"].lower()] = entry
+        return entry
+
+    def get(self, domain):
+        with self._lock:
+            return self._zones.get(domain.lower())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._zones)
+
+def load_zone_index(login, api_key):
+    """Build the account's zone index, or None when the listing fails"""
+    try:
+        return ZoneIndex(login, api_key).load()
+    except Exception as e:
+        logger.error(f"Error building zone index for {login}: {str(e)}")
+        return None
+
 def delete_zone(login, api_key, zone_id):
-    url = f"https://api.cloudflare.com/client/v4/zones/{zone_id}"
     try:
-        response = requests.delete(url, headers=get_headers(login, api_key))
+        response = cf_client.delete(login, api_key, f"/zones/{zone_id}")
         return response.json()
     except Exception as e:
         logger.error(f"Error deleting zone {zone_id}: {str(e)}")
         return {"success": False, "error": str(e)}
 
 def get_nameservers(login, api_key, zone_id):
-    url = f"https://api.cloudflare.com/client/v4/zones/{zone_id}"
     try:
-        response = requests.get(url, headers=get_headers(login, api_key))
+        response = cf_client.get(login, api_key, f"/zones/{zone_id}")
         data = response.json()
         return data['result']['name_servers'] if 'result' in data and 'name_servers' in data['result'] else None
     except Exception as e:
@@ -258,426 +1417,2243 @@ def get_nameservers(login, api_key, zone_id):
         return None
 
 def delete_existing_records(login, api_key, zone_id):
-    url = f"https://api.cloudflare.com/client/v4/zones/{zone_id}/dns_records"
+    path = f"/zones/{zone_id}/dns_records"
     try:
-        response = requests.get(url, headers=get_headers(login, api_key))
+        response = cf_client.get(login, api_key, path)
         records = response.json().get("result", [])
         
         errors = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            futures = [
-                executor.submit(
-                    requests.delete, 
-                    f"{url}/{record['id']}", 
-                    headers=get_headers(login, api_key)
-                ) 
-                for record in records
-            ]
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    future.result()
-                except Exception as e:
-                    errors.append(str(e))
-        
+        futures = [
+            io_scheduler.submit(
+                login,
+                cf_client.delete,
+                login, api_key,
+                f"{path}/{record['id']}"
+            ) 
+            for record in records
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(str(e))
+
         return len(errors) == 0
     except Exception as e:
         logger.error(f"Error deleting DNS records for zone {zone_id}: {str(e)}")
         return False
 
-def create_dns_record(login, api_key, zone_id, type, name, content, proxied=True):
-    url = f"https://api.cloudflare.com/client/v4/zones/{zone_id}/dns_records"
-    data = {
-        "type": type,
-        "name": name,
-        "content": content,
-        "ttl": 1,
-        "proxied": proxied
-    }
+def build_zone_settings(account):
+    """Desired value of every managed zone setting for an account"""
+    return {setting: value_for(account) for setting, value_for in ZONE_SETTINGS.items()}
+
+def get_zone_settings(login, api_key, zone_id):
+    """Current zone settings as {id: value}, or None if they could not be read"""
     try:
-        response = requests.post(url, headers=get_headers(login, api_key), json=data)
-        return response.json()
+        data = cf_client.get(login, api_key, f"/zones/{zone_id}/settings").json()
     except Exception as e:
-        logger.error(f"Error creating DNS record {type} {name} -> {content}: {str(e)}")
-        return {"success": False, "error": str(e)}
+        logger.error(f"Error reading settings for zone {zone_id}: {str(e)}")
+        return None
+    if not data.get('success'):
+        return None
+    return {item["id"]: item.get("value") for item in data.get('result') or []}
 
-def configure_ssl(login, api_key, zone_id, opportunistic_encryption, tls_1_3):
-    url = f"https://api.cloudflare.com/client/v4/zones/{zone_id}/settings"
-    settings = {
-        "opportunistic_encryption": "on" if opportunistic_encryption else "off",
-        "tls_1_3": "on" if tls_1_3 else "off",
-        "min_tls_version": "1.2",
-        "always_use_https": "on"
-    }
+def apply_zone_settings(login, api_key, zone_id, settings, check_current=False):
+    """Apply all settings in one bulk PATCH /zones/{id}/settings.
+
+    With check_current the current values are read first and only differing settings are sent;
+    nothing is sent when the zone already matches. Falls back to one PATCH per setting if the
+    bulk call is rejected, so a single unsupported setting does not block the others.
+    """
+    path = f"/zones/{zone_id}/settings"
+    
+    if check_current:
+        current = get_zone_settings(login, api_key, zone_id)
+        if current is not None:
+            settings = {setting: value for setting, value in settings.items() if current.get(setting) != value}
+            if not settings:
+                return True
+    
+    items = [{"id": setting, "value": value} for setting, value in settings.items()]
+    try:
+        data = cf_client.patch(login, api_key, path, json={"items": items}).json()
+        if data.get('success', False):
+            return True
+        logger.warning(f"Bulk settings update rejected for zone {zone_id}: {data.get('errors', ['Unknown error'])}")
+    except Exception as e:
+        logger.error(f"Error updating settings for zone {zone_id}: {str(e)}")
     
     errors = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-        futures = [
-            executor.submit(
-                requests.patch, 
-                f"{url}/{setting}", 
-                headers=get_headers(login, api_key), 
-                json={"value": value}
-            ) 
-            for setting, value in settings.items()
-        ]
-        for future in concurrent.futures.as_completed(futures):
+    futures = [
+        io_scheduler.submit(
+            login,
+            cf_client.patch,
+            login, api_key,
+            f"{path}/{setting}",
+            json={"value": value}
+        ) 
+        for setting, value in settings.items()
+    ]
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            data = future.result().json()
+            if not data.get('success', False):
+                errors.append(data.get('errors', ['Unknown error'])[0])
+        except Exception as e:
+            errors.append(str(e))
+
+    return len(errors) == 0
+
+def configure_ssl(login, api_key, zone_id, opportunistic_encryption, tls_1_3, check_current=False):
+    settings = build_zone_settings({
+        "opportunistic_encryption": opportunistic_encryption,
+        "tls_1_3": tls_1_3
+    })
+    return apply_zone_settings(login, api_key, zone_id, settings, check_current)
+
+DNS_RECORD_TYPES = ("A", "AAAA", "CNAME", "MX", "TXT")
+PROXIABLE_TYPES = ("A", "AAAA", "CNAME")
+# Placeholders a template may use; random ones get a fresh value for every domain
+DNS_TEMPLATE_FIELDS = ("domain", "ip_api_cdn", "ip_www")
+DNS_TEMPLATE_RANDOM = {
+    "random_domain": lambda: generate_random_domain(),
+    "random_verification": lambda: generate_random_verification_string(),
+}
+
+class DnsTemplate:
+    """Record set of one dns_config_type, compiled from dns_templates.json.
+
+    Placeholders are checked once here, so build() is only string substitution. A content with
+    a random placeholder gets a match_prefix (its text before that placeholder), so a zone that
+    already has such a record with another random value is left as it is.
+    """
+    
+    def __init__(self, config_type, records):
+        self.config_type = config_type
+        self.random_fields = set()
+        self.records = []
+        for spec in records:
+            record_type = spec.get("type")
+            if record_type not in DNS_RECORD_TYPES:
+                raise ValueError(f"DNS template {config_type}: unsupported record type {record_type!r}")
+            if record_type == "MX" and not isinstance(spec.get("priority"), int):
+                raise ValueError(f"DNS template {config_type}: MX record {spec.get('name')!r} needs an integer priority")
+            
+            name_fields, name = self._compile(spec.get("name", "@"))
+            content_fields, content = self._compile(spec.get("content", ""))
+            random_fields = [field for field in content_fields if field in DNS_TEMPLATE_RANDOM]
+            self.random_fields.update(random_fields)
+            self.random_fields.update(field for field in name_fields if field in DNS_TEMPLATE_RANDOM)
+            
+            match_prefix = None
+            if random_fields:
+                match_prefix = content[:content.index("{" + random_fields[0] + "}")]
+            self.records.append({
+                "type": record_type,
+                "name": name,
+                "content": content,
+                "priority": spec.get("priority"),
+                # Cloudflare always reports unproxiable types as unproxied
+                "proxied": bool(spec.get("proxied", False)) and record_type in PROXIABLE_TYPES,
+                "match_prefix": match_prefix,
+            })
+    
+    def _compile(self, text):
+        """Placeholder names of a template string, and the string normalised for str.format_map"""
+        fields = []
+        parts = []
+        for literal, field, format_spec, conversion in string.Formatter().parse(text):
+            parts.append(literal.replace("{", "{{").replace("}", "}}"))
+            if field is None:
+                continue
+            if format_spec or conversion or (field not in DNS_TEMPLATE_FIELDS and field not in DNS_TEMPLATE_RANDOM):
+                raise ValueError(f"DNS template {self.config_type}: unknown placeholder {{{field}}} in {text!r}")
+            fields.append(field)
+            parts.append("{" + field + "}")
+        return fields, "".join(parts)
+    
+    def build(self, domain, ip_api_cdn, ip_www):
+        """Desired records of a zone, in the format the DNS diff and payload helpers take"""
+        values = {"domain": domain, "ip_api_cdn": ip_api_cdn, "ip_www": ip_www}
+        for field in self.random_fields:
+            values[field] = DNS_TEMPLATE_RANDOM[field]()
+        records = []
+        for template in self.records:
+            record = {
+                "type": template["type"],
+                "name": template["name"].format_map(values),
+                "content": template["content"].format_map(values),
+                "proxied": template["proxied"],
+            }
+            if template["priority"] is not None:
+                record["priority"] = template["priority"]
+            if template["match_prefix"] is not None:
+                record["match_prefix"] = template["match_prefix"].format_map(values)
+            records.append(record)
+        return records
+
+def load_dns_templates(path=DNS_TEMPLATES_PATH):
+    """{dns_config_type: DnsTemplate} from the templates file; "extends" prepends another type's records"""
+    with open(path, encoding="utf-8") as templates_file:
+        specs = json.load(templates_file)
+    
+    def records_of(config_type, seen=()):
+        if config_type not in specs:
+            raise ValueError(f"DNS template {config_type} is not defined in {path}")
+        if config_type in seen:
+            raise ValueError(f"DNS template {config_type} extends itself")
+        spec = specs[config_type]
+        base = records_of(str(spec["extends"]), seen + (config_type,)) if "extends" in spec else []
+        return base + spec.get("records", [])
+    
+    templates = {int(config_type): DnsTemplate(int(config_type), records_of(config_type)) for config_type in specs}
+    logger.info(f"DNS templates loaded from {path}: types {sorted(templates)}")
+    return templates
+
+dns_templates = load_dns_templates()
+
+def build_dns_records(dns_config_type, domain, ip_api_cdn, ip_www):
+    """Full desired record set for a zone, or None for an unknown configuration type"""
+    template = dns_templates.get(dns_config_type)
+    return template.build(domain, ip_api_cdn, ip_www) if template is not None else None
+
+def dns_record_payload(record, domain):
+    """API payload for a record built from a DNS template"""
+    payload = {
+        "type": record["type"],
+        "name": record["name"] if record["name"] != "@" else domain,
+        "content": record["content"],
+        "ttl": 1,
+        "proxied": record["proxied"]
+    }
+    if record["type"] == "MX":
+        payload["priority"] = record["priority"]
+    return payload
+
+def setup_dns_config(login, api_key, zone_id, domain, dns_config_type, ip_api_cdn, ip_www, log=None):
+    """Create the records of the given configuration type one request per record, all at once"""
+    records = build_dns_records(dns_config_type, domain, ip_api_cdn, ip_www)
+    if records is None:
+        return False
+    posts = [dns_record_payload(record, domain) for record in records]
+    return apply_dns_changes(login, api_key, zone_id, posts=posts, log=log)
+
+def list_dns_records(login, api_key, zone_id):
+    """Return all DNS records of a zone, following pagination"""
+    path = f"/zones/{zone_id}/dns_records"
+    records = []
+    page = 1
+    while True:
+        data = cf_client.get(login, api_key, path, params={"page": page, "per_page": 100}).json()
+        if not data.get('success'):
+            raise RuntimeError(f"Failed to list DNS records: {data.get('errors', ['Unknown error'])}")
+        records.extend(data.get("result", []))
+        total_pages = data.get("result_info", {}).get("total_pages", 1)
+        if page >= total_pages:
+            return records
+        page += 1
+
+def chunk_dns_batch(deletes, patches, posts, size=CF_DNS_BATCH_SIZE):
+    """Split operations into batch bodies, keeping Cloudflare's delete -> patch -> post order"""
+    operations = [("deletes", op) for op in deletes] + [("patches", op) for op in patches] + [("posts", op) for op in posts]
+    for offset in range(0, len(operations), size):
+        body = {"deletes": [], "patches": [], "posts": []}
+        for kind, op in operations[offset:offset + size]:
+            body[kind].append(op)
+        yield {kind: ops for kind, ops in body.items() if ops}
+
+def log_dns_batch_result(result, log):
+    """Per-record log lines for the result of one /dns_records/batch call"""
+    if log is None:
+        return
+    for record in result.get('deletes') or []:
+        log.append(f"DNS record {record.get('name', 'unknown')} -> {record.get('content', 'unknown')} deleted")
+    for record in result.get('patches') or []:
+        log.append(f"DNS record {record.get('name', 'unknown')} -> {record.get('content', 'unknown')} updated")
+    for record in result.get('posts') or []:
+        proxied_status = "Proxied" if record.get('proxied', False) else "Unproxied"
+        log.append(f"DNS record {record.get('name', 'unknown')} -> {record.get('content', 'unknown')} added ({proxied_status})")
+
+def log_dns_record_result(data, action, errors, log):
+    """Log line for a single-record create/update/delete response; failures also go to errors"""
+    if not data.get('success'):
+        error_msg = f"Failed to {action} DNS record: {data.get('errors', ['Unknown error'])[0]}"
+        errors.append(error_msg)
+        if log is not None:
+            log.append(error_msg)
+        return
+    record = data.get('result') or {}
+    if log is not None:
+        log.append(f"DNS record {record.get('name', 'unknown')} -> {record.get('content', 'unknown')} {action}d")
+
+def apply_dns_batch(login, api_key, zone_id, deletes=(), patches=(), posts=(), log=None):
+    """Apply record changes through /dns_records/batch.
+
+    Returns the number of batches applied and whether that was all of them. Each batch is
+    transactional on Cloudflare's side, so a rejected batch changes nothing, but the ones
+    before it stay applied and a fallback has to be planned from a fresh listing.
+    """
+    path = f"/zones/{zone_id}/dns_records/batch"
+    applied = 0
+    for body in chunk_dns_batch(deletes, patches, posts):
+        try:
+            data = cf_client.post(login, api_key, path, json=body).json()
+        except Exception as e:
+            logger.error(f"Error sending DNS batch for zone {zone_id}: {str(e)}")
+            return applied, False
+
+        if not data.get('success'):
+            logger.warning(f"DNS batch rejected for zone {zone_id}: {data.get('errors', ['Unknown error'])}")
+            return applied, False
+
+        log_dns_batch_result(data.get('result') or {}, log)
+        applied += 1
+    return applied, True
+
+# One BIND line per record type (DNS_RECORD_TYPES); names are absolute, TTL 1 is Cloudflare's "automatic"
+ZONE_FILE_LINES = {
+    "A": "{name}. 1 IN A {content}",
+    "AAAA": "{name}. 1 IN AAAA {content}",
+    "CNAME": "{name}. 1 IN CNAME {content}.",
+    "MX": "{name}. 1 IN MX {priority} {content}.",
+    "TXT": "{name}. 1 IN TXT {content}",
+}
+def zone_file_text(content):
+    """TXT content as quoted character-strings of at most 255 bytes (DKIM keys are longer)"""
+    chunks = [content[offset:offset + 255] for offset in range(0, len(content), 255)] or [""]
+    return " ".join('"' + chunk.replace('\\', '\\\\').replace('"', '\\"') + '"' for chunk in chunks)
+
+def render_zone_file(payloads, domain):
+    """BIND zone file holding the given record payloads"""
+    lines = [f"$ORIGIN {domain}."]
+    for payload in payloads:
+        content = payload["content"]
+        if payload["type"] == "TXT":
+            content = zone_file_text(content)
+        elif payload["type"] in ("CNAME", "MX"):
+            content = content.rstrip('.')
+        lines.append(ZONE_FILE_LINES[payload["type"]].format(
+            name=normalize_record_name(payload["name"], domain), content=content, priority=payload.get("priority", 0)
+        ))
+    return "\n".join(lines) + "\n"
+
+def zone_import_groups(payloads):
+    """Split records into imports by their proxied flag, which the endpoint takes per upload.
+
+    Records that cannot be proxied (MX, TXT) ride along with whichever group exists.
+    """
+    proxied = [payload for payload in payloads if payload["type"] in PROXIABLE_TYPES and payload.get("proxied")]
+    direct = [payload for payload in payloads if payload["type"] in PROXIABLE_TYPES and not payload.get("proxied")]
+    other = [payload for payload in payloads if payload["type"] not in PROXIABLE_TYPES]
+    if proxied or not direct:
+        groups = [(True, proxied + other), (False, direct)]
+    else:
+        groups = [(True, proxied), (False, direct + other)]
+    return [(flag, group) for flag, group in groups if group]
+
+def zone_import_form(payloads, domain, proxied):
+    return {"file": ("records.txt", render_zone_file(payloads, domain)), "proxied": "true" if proxied else "false"}
+
+def log_dns_import_result(data, payloads, domain, log):
+    """Per-record log lines for one /dns_records/import call; True when every record was added.
+
+    The endpoint only reports counts, so a short count means some records are missing and
+    the zone has to be read again to find out which.
+    """
+    if not data.get('success'):
+        logger.warning(f"DNS import rejected for {domain}: {data.get('errors', ['Unknown error'])}")
+        return False
+    added = (data.get('result') or {}).get('recs_added', 0)
+    if added != len(payloads):
+        logger.warning(f"DNS import for {domain} added {added} of {len(payloads)} records")
+        return False
+    if log is not None:
+        for payload in payloads:
+            proxied_status = "Proxied" if payload.get('proxied') and payload["type"] in PROXIABLE_TYPES else "Unproxied"
+            log.append(f"DNS record {normalize_record_name(payload['name'], domain)} -> {payload['content']} added ({proxied_status})")
+    return True
+
+def import_dns_records(login, api_key, zone_id, domain, payloads, log=None):
+    """Create records with one zone file upload per proxied flag instead of a call per record"""
+    path = f"/zones/{zone_id}/dns_records/import"
+    for proxied, group in zone_import_groups(payloads):
+        form = zone_import_form(group, domain, proxied)
+        try:
+            data = cf_client.post(login, api_key, path, files={"file": form["file"]}, data={"proxied": form["proxied"]}).json()
+        except Exception as e:
+            logger.error(f"Error importing DNS records for {domain}: {str(e)}")
+            return False
+        if not log_dns_import_result(data, group, domain, log):
+            return False
+    return True
+
+def apply_dns_import(login, api_key, zone_id, domain, deletes=(), patches=(), posts=(), log=None):
+    """Deletes and patches through the batch endpoint (or per record), new records through one import.
+
+    A failed batch is not replayed per record here: callers fall back from a fresh listing.
+    """
+    if deletes or patches:
+        if CF_DNS_BATCH:
+            _, done = apply_dns_batch(login, api_key, zone_id, deletes=deletes, patches=patches, log=log)
+        else:
+            done = apply_dns_changes(login, api_key, zone_id, deletes, patches, (), log)
+        if not done:
+            return False
+    return import_dns_records(login, api_key, zone_id, domain, posts, log)
+
+def normalize_record_name(name, domain):
+    name = name.rstrip('.').lower()
+    domain = domain.rstrip('.').lower()
+    if name in ("@", domain):
+        return domain
+    if name.endswith("." + domain):
+        return name
+    return f"{name}.{domain}"
+
+def normalize_record_content(type, content):
+    content = str(content or "")
+    if type in ("CNAME", "MX", "NS"):
+        return content.rstrip('.').lower()
+    if type == "TXT" and len(content) >= 2 and content[0] == content[-1] == '"':
+        return content[1:-1]
+    return content
+
+def dns_record_key(record, domain):
+    """Identity used to compare records: (type, name, content, priority, proxied)"""
+    type = record["type"]
+    return (
+        type,
+        normalize_record_name(record["name"], domain),
+        normalize_record_content(type, record.get("content")),
+        record.get("priority") if type == "MX" else None,
+        bool(record.get("proxied", False))
+    )
+
+def dns_record_matches(existing, record, domain):
+    """True when an existing record already satisfies a desired one built from a DNS template"""
+    existing_key = dns_record_key(existing, domain)
+    wanted_key = dns_record_key(dns_record_payload(record, domain), domain)
+    if existing_key == wanted_key:
+        return True
+
+    # Randomised values (DMARC report address, site verification) only need the right shape
+    prefix = record.get("match_prefix")
+    if prefix:
+        same_slot = existing_key[:2] == wanted_key[:2] and existing_key[3:] == wanted_key[3:]
+        return same_slot and existing_key[2].startswith(prefix)
+    return False
+
+def diff_dns_records(existing, records, domain):
+    """Minimal changes that turn the existing records into the desired set.
+
+    Returns (unchanged, deletes, patches, posts); a record whose type and name already exist
+    with other content is patched in place rather than deleted and recreated.
+    """
+    remaining = list(existing)
+    unchanged = []
+    pending = []
+    for record in records:
+        match = next((current for current in remaining if dns_record_matches(current, record, domain)), None)
+        if match is not None:
+            remaining.remove(match)
+            unchanged.append(match)
+        else:
+            pending.append(dns_record_payload(record, domain))
+
+    patches = []
+    posts = []
+    for payload in pending:
+        slot = (payload["type"], normalize_record_name(payload["name"], domain))
+        match = next(
+            (current for current in remaining if (current["type"], normalize_record_name(current["name"], domain)) == slot),
+            None
+        )
+        if match is not None:
+            remaining.remove(match)
+            patches.append(dict(payload, id=match["id"]))
+        else:
+            posts.append(payload)
+
+    deletes = [{"id": current["id"]} for current in remaining]
+    return unchanged, deletes, patches, posts
+
+def settle_dns_records(login, api_key, zone_id, domain, records, log=None):
+    """Re-read the zone after failed per-record calls and send only what is still missing.
+
+    A create or delete that timed out (or got a 5xx) may have been applied anyway, so it is never
+    resent blindly: every round is planned from a fresh listing. True once the zone holds the records.
+    """
+    failures = 0
+    while True:
+        try:
+            existing = list_dns_records(login, api_key, zone_id)
+        except Exception as e:
+            logger.error(f"Error listing DNS records for zone {zone_id}: {str(e)}")
+            return False
+        _, deletes, patches, posts = diff_dns_records(existing, records, domain)
+        if not (deletes or patches or posts):
+            return True
+        failures += 1
+        backoff = retry_backoff(failures)
+        if backoff is None:
+            return False
+        logger.warning(f"DNS records for {domain} still differ after failed requests, resending in {backoff:.1f}s (attempt {failures})")
+        time.sleep(backoff)
+        apply_dns_changes(login, api_key, zone_id, deletes, patches, posts, log)
+
+def apply_dns_changes(login, api_key, zone_id, deletes=(), patches=(), posts=(), log=None):
+    """Per-record fallback for apply_dns_batch: deletes first, then patches and creates"""
+    path = f"/zones/{zone_id}/dns_records"
+    errors = []
+
+    futures = [io_scheduler.submit(login, cf_client.delete, login, api_key, f"{path}/{op['id']}") for op in deletes]
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            log_dns_record_result(future.result().json(), "delete", errors, log)
+        except Exception as e:
+            errors.append(str(e))
+
+    futures = [
+        (io_scheduler.submit(login, cf_client.patch, login, api_key, f"{path}/{op['id']}",
+                             json={k: v for k, v in op.items() if k != "id"}), "update")
+        for op in patches
+    ] + [
+        (io_scheduler.submit(login, cf_client.post, login, api_key, path, json=op), "create")
+        for op in posts
+    ]
+    for future, action in futures:
+        try:
+            log_dns_record_result(future.result().json(), action, errors, log)
+        except Exception as e:
+            errors.append(str(e))
+
+    return len(errors) == 0
+
+def reconcile_dns_records(login, api_key, zone_id, domain, dns_config_type, ip_api_cdn, ip_www, log=None):
+    """Bring a zone's records to the configured set with the fewest calls.
+
+    Returns "unchanged", "updated" or "failed", or None when the current records could not be read
+    and the caller should fall back to replacing everything.
+    """
+    records = build_dns_records(dns_config_type, domain, ip_api_cdn, ip_www)
+    if records is None:
+        return "failed"
+
+    try:
+        existing = list_dns_records(login, api_key, zone_id)
+    except Exception as e:
+        logger.error(f"Error listing DNS records for zone {zone_id}: {str(e)}")
+        return None
+
+    unchanged, deletes, patches, posts = diff_dns_records(existing, records, domain)
+    if not (deletes or patches or posts):
+        if log is not None:
+            log.append(f"DNS records for {domain} unchanged ({len(unchanged)} records)")
+        return "unchanged"
+
+    logger.info(f"DNS changes for {domain}: {len(deletes)} deletes, {len(patches)} patches, {len(posts)} creates, {len(unchanged)} unchanged")
+
+    if CF_DNS_IMPORT and posts:
+        if apply_dns_import(login, api_key, zone_id, domain, deletes, patches, posts, log):
+            return "updated"
+        # Part of the changes may have gone through, so plan the per-record fallback from fresh data
+        try:
+            existing = list_dns_records(login, api_key, zone_id)
+        except Exception as e:
+            logger.error(f"Error listing DNS records for zone {zone_id}: {str(e)}")
+            return "failed"
+        _, deletes, patches, posts = diff_dns_records(existing, records, domain)
+        if apply_dns_changes(login, api_key, zone_id, deletes, patches, posts, log):
+            return "updated"
+        return "updated" if settle_dns_records(login, api_key, zone_id, domain, records, log) else "failed"
+
+    if CF_DNS_BATCH:
+        applied, done = apply_dns_batch(login, api_key, zone_id, deletes=deletes, patches=patches, posts=posts, log=log)
+        if done:
+            return "updated"
+        logger.warning(f"DNS batch failed for {domain}, falling back to per-record requests")
+        
+        # Earlier batches went through, and the failed one may have too when its answer was lost,
+        # so plan the per-record fallback from fresh data
+        try:
+            existing = list_dns_records(login, api_key, zone_id)
+        except Exception as e:
+            logger.error(f"Error listing DNS records for zone {zone_id}: {str(e)}")
+            return "failed"
+        _, deletes, patches, posts = diff_dns_records(existing, records, domain)
+        if not (deletes or patches or posts):
+            return "updated"
+    if apply_dns_changes(login, api_key, zone_id, deletes, patches, posts, log):
+        return "updated"
+    return "updated" if settle_dns_records(login, api_key, zone_id, domain, records, log) else "failed"
+
+def replace_dns_records_batch(login, api_key, zone_id, domain, dns_config_type, ip_api_cdn, ip_www, log=None):
+    """Replace all records of a zone with the configured set using batch calls.
+
+    Returns True/False for the applied result, or None when the batch path could not be
+    used and the caller should fall back to per-record requests.
+    """
+    records = build_dns_records(dns_config_type, domain, ip_api_cdn, ip_www)
+    if records is None:
+        return False
+
+    try:
+        existing = list_dns_records(login, api_key, zone_id)
+    except Exception as e:
+        logger.error(f"Error listing DNS records for zone {zone_id}: {str(e)}")
+        return None
+
+    deletes = [{"id": record["id"]} for record in existing]
+    posts = [dns_record_payload(record, domain) for record in records]
+
+    _, done = apply_dns_batch(login, api_key, zone_id, deletes=deletes, posts=posts, log=log)
+    # The fallback lists and deletes whatever is there again, so batches already applied do no harm
+    return True if done else None
+
+def replace_dns_records_import(login, api_key, zone_id, domain, dns_config_type, ip_api_cdn, ip_www, log=None):
+    """Replace all records of a zone, creating the configured set with one zone file import.
+
+    Returns True/False like replace_dns_records_batch, or None when the caller should fall back
+    (the fallback deletes and recreates everything, so a partial import does no harm).
+    """
+    records = build_dns_records(dns_config_type, domain, ip_api_cdn, ip_www)
+    if records is None:
+        return False
+
+    try:
+        existing = list_dns_records(login, api_key, zone_id)
+    except Exception as e:
+        logger.error(f"Error listing DNS records for zone {zone_id}: {str(e)}")
+        return None
+
+    deletes = [{"id": record["id"]} for record in existing]
+    posts = [dns_record_payload(record, domain) for record in records]
+    if not apply_dns_import(login, api_key, zone_id, domain, deletes=deletes, posts=posts, log=log):
+        return None
+    return True
+
+def generate_random_domain():
+    """Generate a realistic-looking random domain for DMARC record"""
+    # Common prefixes and words used in domain names
+    prefixes = ["my", "web", "cloud", "cyber", "digital", "tech", "smart", "quick", "easy", "best", 
+               "pro", "top", "prime", "fast", "net", "online", "go", "get", "the", "global"]
+    
+    # Common words used in domain names
+    words = ["site", "host", "web", "tech", "soft", "data", "blog", "app", "mail", "cloud", 
+            "store", "shop", "market", "team", "tools", "hub", "zone", "spot", "space", "box",
+            "work", "group", "base", "point", "net", "systems", "software", "solutions"]
+    
+    # Randomly decide on structure (prefix+word, word+word, or just word)
+    structure = random.randint(1, 3)
+    
+    if structure == 1:
+        # prefix + word (e.g., mycloud)
+        domain_name = random.choice(prefixes) + random.choice(words)
+    elif structure == 2:
+        # word + word (e.g., cloudspace)
+        domain_name = random.choice(words) + random.choice(words)
+    else:
+        # single word with optional number (e.g., cloud365)
+        domain_name = random.choice(words)
+        # Add a number 30% of the time
+        if random.random() < 0.3:
+            domain_name += str(random.randint(1, 999))
+    
+    # Add .com extension
+    return f"{domain_name}.com"
+
+def generate_random_verification_string():
+    """Generate a random verification string matching the example length"""
+    # The example string is: G8XgjG-VV894J7gNnjJTHe8MO2cXZCvIldjZzo4FoTx (43 chars)
+    chars = string.ascii_letters + string.digits + "-_"
+    return ''.join(random.choice(chars) for _ in range(43))
+
+def format_progress_bar(progress, total):
+    progress_percentage = min(100, int(progress / total * 100)) if total else 0
+    progress_bar = '▓' * (progress_percentage // 10) + '░' * (10 - progress_percentage // 10)
+    return f"[{progress_bar}] {progress_percentage}%"
+
+def telegram_retry_after(error, default=5.0):
+    """Seconds Telegram asked us to wait, when error is a 429 from the Bot API"""
+    if isinstance(error, ApiTelegramException) and error.error_code == 429:
+        parameters = (error.result_json or {}).get("parameters") or {}
+        return float(parameters.get("retry_after", default))
+    return None
+
+class TelegramOutbox:
+    """Outbound Telegram calls on a thread of their own.
+
+    Handlers and workers only enqueue and get a Future back. The sender keeps each chat's
+    messages in order, serves chats round-robin, paces calls to TELEGRAM_GLOBAL_RATE per second
+    overall and TELEGRAM_CHAT_INTERVAL seconds per chat (longer for groups), waits out 429s and
+    retries transient failures with backoff.
+    """
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_interval=TELEGRAM_CHAT_INTERVAL):
+        self.global_interval = 1.0 / global_rate
+        self.chat_interval = chat_interval
+        self._cond = threading.Condition()
+        self._chats = OrderedDict()
+        self._chat_ready_at = {}
+        self._global_ready_at = 0.0
+        self._thread = None
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="telegram-outbox", daemon=True)
+            self._thread.start()
+
+    def _enqueue(self, chat_id, method, args, kwargs):
+        future = concurrent.futures.Future()
+        with self._cond:
+            self._ensure_thread()
+            self._chats.setdefault(chat_id, deque()).append((method, args, kwargs, future, 0))
+            self._cond.notify()
+        return future
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._enqueue(chat_id, "send_message", (chat_id, text), kwargs)
+
+    def reply_to(self, message, text, **kwargs):
+        return self._enqueue(message.chat.id, "reply_to", (message, text), kwargs)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return self._enqueue(chat_id, "edit_message_text", (text, chat_id, message_id), kwargs)
+
+    def delete_message(self, chat_id, message_id):
+        return self._enqueue(chat_id, "delete_message", (chat_id, message_id), {})
+
+    def send_document(self, chat_id, document, **kwargs):
+        return self._enqueue(chat_id, "send_document", (chat_id, document), kwargs)
+
+    def pending(self):
+        with self._cond:
+            return sum(len(items) for items in self._chats.values())
+
+    def _interval_for(self, chat_id):
+        # Telegram allows about 1 message per second in a private chat and 20 per minute in a group
+        return self.chat_interval if chat_id > 0 else max(self.chat_interval, 3.0)
+
+    def _next_item(self):
+        """Wait for the next call allowed by the per-chat and global limits"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = None
+                for chat_id in list(self._chats):
+                    ready_at = self._chat_ready_at.get(chat_id, 0.0)
+                    if ready_at <= now:
+                        items = self._chats[chat_id]
+                        item = items.popleft()
+                        if items:
+                            self._chats.move_to_end(chat_id)
+                        else:
+                            del self._chats[chat_id]
+                        return chat_id, item
+                    wait = ready_at - now if wait is None else min(wait, ready_at - now)
+                self._cond.wait(wait)
+
+    def _run(self):
+        while True:
+            chat_id, (method, args, kwargs, future, attempt) = self._next_item()
+            
+            delay = self._global_ready_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._global_ready_at = time.monotonic() + self.global_interval
+            
+            started = time.monotonic()
             try:
-                response = future.result()
-                if not response.json().get('success', False):
-                    errors.append(response.json().get('errors', ['Unknown error'])[0])
+                result = getattr(bot, method)(*args, **kwargs)
             except Exception as e:
-                errors.append(str(e))
+                metrics.observe("telegram_request_seconds", time.monotonic() - started, method=method)
+                metrics.inc(
+                    "telegram_requests_total", method=method,
+                    status=e.error_code if isinstance(e, ApiTelegramException) else "error"
+                )
+                retry_after = telegram_retry_after(e)
+                permanent = isinstance(e, ApiTelegramException) and retry_after is None and e.error_code < 500
+                if not permanent and attempt < TELEGRAM_MAX_RETRIES:
+                    if retry_after is None:
+                        retry_after = min(30.0, 2 ** attempt) * (0.5 + random.random())
+                    logger.warning(f"Telegram {method} to {chat_id} failed ({str(e)}), retrying in {retry_after:.1f}s")
+                    with self._cond:
+                        # Back to the front so the chat's order is kept
+                        self._chats.setdefault(chat_id, deque()).appendleft((method, args, kwargs, future, attempt + 1))
+                        self._chat_ready_at[chat_id] = time.monotonic() + retry_after
+                        self._cond.notify()
+                    continue
+                logger.error(f"Error in Telegram {method} to {chat_id}: {str(e)}")
+                future.set_exception(e)
+            else:
+                metrics.observe("telegram_request_seconds", time.monotonic() - started, method=method)
+                metrics.inc("telegram_requests_total", method=method, status="ok")
+                future.set_result(result)
+            
+            with self._cond:
+                self._chat_ready_at[chat_id] = time.monotonic() + self._interval_for(chat_id)
+
+outbox = TelegramOutbox()
+
+class ProgressRenderer:
+    """One live progress dashboard per task, rendered in the background.
+
+    Workers only update in-memory state. A single thread queues an edit of each dashboard at most
+    once per PROGRESS_INTERVAL, and only after the outbox has sent the previous one, so a slow
+    (group) chat never has more than one stale edit ahead of the summary. Edits that would not
+    change the text are skipped.
+    """
+
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._boards = {}
+        self._next_id = 0
+        self._thread = None
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="progress-renderer", daemon=True)
+                self._thread.start()
+
+    @staticmethod
+    def _new_account():
+        return {"stage": "Waiting", "done": 0, "total": 0, "finished": False}
+
+    def open(self, chat_id, logins):
+        """Send the dashboard message for a task and return its board id"""
+        board = {
+            "chat_id": chat_id,
+            "message_id": None,
+            "message_future": None,
+            "edit_future": None,
+            "accounts": OrderedDict((login, self._new_account()) for login in logins),
+            "dirty": False,
+            "last_text": None,
+            "last_flush": 0.0
+        }
+        text = self._render(board)
+        board["last_text"] = text
+        board["message_future"] = outbox.send_message(chat_id, text)
+        
+        def sent(future):
+            if future.exception() is None:
+                with self._lock:
+                    board["message_id"] = future.result().message_id
+        board["message_future"].add_done_callback(sent)
+        
+        with self._lock:
+            self._next_id += 1
+            board_id = self._next_id
+            self._boards[board_id] = board
+        self._ensure_thread()
+        return board_id
+
+    def update(self, board_id, login, stage=None, total=None):
+        with self._lock:
+            board = self._boards.get(board_id)
+            if board is None:
+                return
+            account = board["accounts"].setdefault(login, self._new_account())
+            if stage is not None:
+                account["stage"] = stage
+            if total is not None:
+                account["total"] = total
+            board["dirty"] = True
+
+    def advance(self, board_id, login):
+        """One more domain of login is finished"""
+        with self._lock:
+            board = self._boards.get(board_id)
+            if board is None:
+                return
+            account = board["accounts"].setdefault(login, self._new_account())
+            account["done"] += 1
+            board["dirty"] = True
+
+    def finish(self, board_id, login):
+        with self._lock:
+            board = self._boards.get(board_id)
+            if board is None:
+                return
+            account = board["accounts"].setdefault(login, self._new_account())
+            account["finished"] = True
+            account["done"] = max(account["done"], account["total"])
+            board["dirty"] = True
+
+    def close(self, board_id):
+        """Forget the board and remove its message; the final summary replaces it"""
+        with self._lock:
+            board = self._boards.pop(board_id, None)
+        if board is None:
+            return
+        
+        def delete(future):
+            if future.exception() is None:
+                outbox.delete_message(board["chat_id"], future.result().message_id)
+        board["message_future"].add_done_callback(delete)
+
+    @staticmethod
+    def _render(board):
+        accounts = board["accounts"]
+        finished = sum(1 for account in accounts.values() if account["finished"])
+        header = f"⚙️ Processed accounts: {finished}/{len(accounts)}"
+        
+        active_lines = []
+        done_lines = []
+        waiting_lines = []
+        for login, account in accounts.items():
+            if account["finished"]:
+                done_lines.append(f"✅ {login}: {account['done']}/{account['total']} domains")
+            elif account["stage"] == "Waiting":
+                waiting_lines.append(f"⏳ {login}: waiting")
+            else:
+                active_lines.append(
+                    f"👨‍💻 {login}: {account['stage']}\n"
+                    f"{format_progress_bar(account['done'], account['total'])} 🔄 {account['done']}/{account['total']} domains"
+                )
+        
+        text = "\n".join([header, ""] + active_lines + done_lines + waiting_lines)
+        if len(text) > 4000:
+            # Too many accounts for one message: keep the ones in progress, count the rest
+            text = "\n".join([header, ""] + active_lines[:40] + [
+                "",
+                f"✅ Finished: {len(done_lines)}",
+                f"⏳ Waiting: {len(waiting_lines)}"
+            ])
+        return text
+
+    def _run(self):
+        while True:
+            time.sleep(min(0.5, self.interval))
+            now = time.monotonic()
+            due = []
+            with self._lock:
+                for board in self._boards.values():
+                    if not board["dirty"] or board["message_id"] is None:
+                        continue
+                    if now - board["last_flush"] < self.interval:
+                        continue
+                    if board["edit_future"] is not None and not board["edit_future"].done():
+                        continue
+                    board["dirty"] = False
+                    due.append((board, self._render(board)))
+            
+            for board, text in due:
+                if text == board["last_text"]:
+                    continue
+                # The outbox paces and retries the edit; the next one waits until this one is sent
+                board["last_text"] = text
+                board["last_flush"] = time.monotonic()
+                board["edit_future"] = outbox.edit_message_text(text, board["chat_id"], board["message_id"])
+
+progress_renderer = ProgressRenderer()
+
+class FairTaskQueue:
+    """Task queue shared fairly between users (self-clocked weighted fair queuing).
+
+    Every task gets a virtual finish time: it starts when both the queue clock and the user's
+    previous task allow, and lasts cost / weight, where cost is the task's domain count and
+    weight comes from the user's role. get() hands out the smallest finish time first, so ten
+    large batches of one user do not push a single-domain task of another user to the back.
+    """
     
-    return len(errors) == 0
+    def __init__(self, role_weights=None, seconds_per_domain=TASK_SECONDS_PER_DOMAIN):
+        self.role_weights = role_weights if role_weights is not None else TASK_ROLE_WEIGHTS
+        self.seconds_per_domain = seconds_per_domain
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._clock = 0.0
+        self._user_finish = {}
+        self._stop_signals = 0
+    
+    def weight(self, user_id):
+        return max(0.01, self.role_weights.get(WHITELIST.get(user_id), 1.0))
+    
+    def put(self, task, user_id=None, cost=1):
+        """Queue a task; None is a stop signal for one worker"""
+        with self._cond:
+            if task is None:
+                self._stop_signals += 1
+            else:
+                cost = max(1, cost)
+                start = max(self._clock, self._user_finish.get(user_id, 0.0))
+                finish = start + cost / self.weight(user_id)
+                self._user_finish[user_id] = finish
+                heapq.heappush(self._heap, (finish, next(self._seq), user_id, cost, task))
+            self._cond.notify()
+    
+    def get(self):
+        with self._cond:
+            while not self._heap and not self._stop_signals:
+                self._cond.wait()
+            # Stop right away: unfinished tasks are kept in the job store and resumed on restart
+            if self._stop_signals:
+                self._stop_signals -= 1
+                return None
+            finish, _, user_id, cost, task = heapq.heappop(self._heap)
+            self._clock = finish
+            if not any(item[2] == user_id for item in self._heap):
+                self._user_finish.pop(user_id, None)
+            return task
+    
+    def task_done(self):
+        """Kept for queue.Queue compatibility; nothing waits on join()"""
+    
+    def qsize(self):
+        with self._cond:
+            return len(self._heap)
+    
+    def observe(self, cost, seconds):
+        """Feed the duration of a finished task into the start-time estimates"""
+        if cost > 0 and seconds > 0:
+            with self._cond:
+                self.seconds_per_domain = 0.8 * self.seconds_per_domain + 0.2 * (seconds / cost)
+    
+    def schedule(self, busy_seconds=(), workers=TASK_WORKERS):
+        """Queued tasks in the order they will start, with the estimated wait before each.
 
-def setup_dns_config_type_1(login, api_key, zone_id, domain, ip_api_cdn, ip_www, log=None):
-    """Configuration type 1 for DNS setup"""
-    records = [
-        {"type": "A", "name": "api", "content": ip_api_cdn, "proxied": True},
-        {"type": "A", "name": "cdn", "content": ip_api_cdn, "proxied": True},
-        {"type": "A", "name": "@", "content": ip_www, "proxied": True},
-        {"type": "A", "name": "www", "content": ip_www, "proxied": True}
-    ]
+        busy_seconds are the expected remaining run times of the tasks being processed now.
+        Returns a list of (task, user_id, cost, seconds_until_start).
+        """
+        with self._cond:
+            pending = sorted(self._heap)
+            seconds_per_domain = self.seconds_per_domain
+        free_at = sorted(list(busy_seconds)[:workers] + [0.0] * max(0, workers - len(busy_seconds)))
+        plan = []
+        for _, _, user_id, cost, task in pending:
+            start = heapq.heappop(free_at)
+            plan.append((task, user_id, cost, start))
+            heapq.heappush(free_at, start + cost * seconds_per_domain)
+        return plan
+
+task_queue = FairTaskQueue()
+
+def read_upload_lines(file_path):
+    """Lines of an uploaded configuration, read lazily; CSV cells count as separate lines"""
+    with open(file_path, encoding="utf-8-sig", errors="replace", newline="") as upload:
+        if file_path.lower().endswith(".csv"):
+            for row in csv.reader(upload):
+                for cell in row:
+                    yield cell
+        else:
+            for line in upload:
+                yield line
+
+def task_accounts(text, file_path=None):
+    """Accounts of a task: parsed from the message text, or streamed from the uploaded file"""
+    if file_path is None:
+        return iter(parse_input_text(text))
+    # The format is detected by the same rule as for messages; the scan stops at the first '|'
+    return iter_accounts(read_upload_lines(file_path), uses_cloudflare_format(read_upload_lines(file_path)))
+
+def estimate_task_cost(text, file_path=None):
+    """Domain count of a submission, the unit the fair queue charges users in"""
+    try:
+        return max(1, sum(len(account["domains"]) for account in task_accounts(text, file_path)))
+    except Exception:
+        return 1
+
+def queue_schedule():
+    """task_queue.schedule() with the remaining time of running tasks taken from active_jobs"""
+    now = time.time()
+    with task_lock:
+        busy = [
+            max(0.0, job["cost"] * task_queue.seconds_per_domain - (now - job["started"]))
+            for job in active_jobs.values()
+        ]
+    return task_queue.schedule(busy, max(1, TASK_WORKERS))
+
+def format_wait(seconds):
+    if seconds < 60:
+        return "меньше минуты"
+    return f"~{int(seconds // 60)} мин"
+
+def verify_credentials(login, api_key):
+    """Check an account's key with one cheap call.
+
+    Returns (True, None) when Cloudflare accepts it, (False, reason) when it rejects it and
+    (None, reason) when the check itself failed, e.g. the API could not be reached.
+    """
+    try:
+        response = cf_client.get(login, api_key, "/zones", params={"per_page": 1})
+    except CircuitOpenError as e:
+        return False, str(e)
+    except Exception as e:
+        logger.error(f"Error verifying credentials of {login}: {str(e)}")
+        return None, str(e)
+    data = response_data(response)
+    outcome = classify_cf_response(response.status_code, data)
+    if outcome == "ok" and isinstance(data, dict) and data.get('success'):
+        return True, None
+    reason = f"HTTP {response.status_code}"
+    if isinstance(data, dict) and data.get('errors'):
+        error = data['errors'][0]
+        reason = error.get('message', reason) if isinstance(error, dict) else str(error)
+    return (False if outcome in ("auth", "fatal") else None), reason
+
+def validate_account(account):
+    """Reason an account cannot be run as given, or None"""
+    if account["dns_config_type"] not in dns_templates:
+        return f"неизвестный тип DNS конфигурации: {account['dns_config_type']}"
+    for field in ("ip_api_cdn", "ip_www"):
+        if not IPV4_RE.match(account[field] or ""):
+            return f"неверный IP {field}: {account[field]}"
+    return None
+
+class TaskPreflight:
+    """Validation of a task's accounts while they stream in, before each one touches any zone.
+
+    IPs, DNS type and domain syntax are checked as an account is parsed, and its key is verified
+    on the shared I/O pool a few accounts ahead of the one being started, so the first account
+    starts as soon as its own key is accepted. Accounts come out in input order; a domain that an
+    earlier account with an accepted key already has is dropped (the first occurrence wins).
+    Claimed domains and call counts per login are kept in a temporary on-disk SQLite database,
+    and the report keeps only a sample of each problem, so memory does not grow with the input.
+    """
     
-    errors = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-        futures = []
-        for record in records:
-            record_name = record["name"] if record["name"] != "@" else domain
-            futures.append(
-                executor.submit(
-                    create_dns_record,
-                    login, api_key, zone_id, 
-                    record["type"], record_name, record["content"], record["proxied"]
+    def __init__(self, lookahead=PREFLIGHT_LOOKAHEAD, key_cache=PREFLIGHT_KEY_CACHE, sample=10):
+        self.lookahead = max(1, lookahead)
+        self.key_cache = max(1, key_cache)
+        self.sample = sample
+        self.plan = {"accounts": 0, "runnable": 0, "domains": 0, "api_calls": 0, "eta": 0.0}
+        for name in ("skipped", "invalid_domains", "duplicates", "unverified"):
+            self.plan[name] = []
+            self.plan[f"{name}_total"] = 0
+        self._checks = OrderedDict()
+        # An empty file name is a private temporary database, deleted when it is closed
+        self._db = sqlite3.connect("", check_same_thread=False)
+        self._db.execute("CREATE TABLE domains (name TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._db.execute("CREATE TABLE logins (login TEXT PRIMARY KEY, calls REAL) WITHOUT ROWID")
+    
+    def _note(self, name, value):
+        self.plan[f"{name}_total"] += 1
+        if len(self.plan[name]) < self.sample:
+            self.plan[name].append(value)
+    
+    def _check(self, login, api_key):
+        """[future of the key check, reported] shared by all accounts with the same key"""
+        key = (login, api_key)
+        entry = self._checks.get(key)
+        if entry is not None:
+            self._checks.move_to_end(key)
+            return entry
+        entry = self._checks[key] = [io_scheduler.submit(login, verify_credentials, login, api_key), False]
+        # An evicted key is simply verified again if it shows up later
+        while len(self._checks) > self.key_cache:
+            self._checks.popitem(last=False)
+        return entry
+    
+    def _prepare(self, account):
+        """Checks that need no API call: the reason to skip the account, or None"""
+        reason = validate_account(account)
+        if reason is not None:
+            return reason
+        valid = []
+        for domain in account.domains:
+            if DOMAIN_RE.match(domain):
+                valid.append(domain)
+            else:
+                self._note("invalid_domains", domain)
+        account.domains = valid
+        return None
+    
+    def _skip(self, index, account, reason):
+        self._note("skipped", (account["login"], reason))
+        return index, account, reason
+    
+    def _admit(self, index, account, reason, check):
+        """Final decision on one account, taken in input order"""
+        if reason is not None:
+            return self._skip(index, account, reason)
+        login = account["login"]
+        accepted, check_reason = check[0].result()
+        if accepted is False:
+            return self._skip(index, account, f"Cloudflare отклонил API ключ ({check_reason})")
+        if accepted is None and not check[1]:
+            check[1] = True
+            self._note("unverified", login)
+        
+        # Only accounts that will run claim their domains, so a rejected key does not take them from the others
+        kept = []
+        with self._db:
+            for domain in account.domains:
+                if self._db.execute("INSERT OR IGNORE INTO domains VALUES (?)", (domain.lower(),)).rowcount:
+                    kept.append(domain)
+                else:
+                    self._note("duplicates", domain)
+            if kept:
+                calls = len(kept) * CF_CALLS_PER_DOMAIN + 1
+                self._db.execute("INSERT OR IGNORE INTO logins VALUES (?, 0)", (login,))
+                self._db.execute("UPDATE logins SET calls = calls + ? WHERE login = ?", (calls, login))
+        account.domains = kept
+        if not kept:
+            return self._skip(index, account, "нет доменов для настройки")
+        self.plan["runnable"] += 1
+        self.plan["domains"] += len(kept)
+        self.plan["api_calls"] += calls
+        return index, account, None
+    
+    def run(self, accounts):
+        """Yield (index, account, skip_reason) in input order; the reason is None for accounts to run"""
+        window = deque()
+        try:
+            for index, account in enumerate(accounts):
+                self.plan["accounts"] += 1
+                reason = self._prepare(account)
+                check = self._check(account["login"], account["api_key"]) if reason is None else None
+                window.append((index, account, reason, check))
+                # The oldest account goes as soon as its key is known, or once the lookahead is used up
+                while window and (len(window) > self.lookahead or window[0][3] is None or window[0][3][0].done()):
+                    yield self._admit(*window.popleft())
+            while window:
+                yield self._admit(*window.popleft())
+        finally:
+            self.close()
+    
+    def close(self):
+        """Finish the plan's estimate once the whole input is read and drop the temporary database"""
+        if self._db is None:
+            return
+        # The slower of the learned pace of past tasks and what the per-account rate limit allows
+        busiest = self._db.execute("SELECT MAX(calls) FROM logins").fetchone()[0] or 0
+        rate_bound = max(0.0, busiest - rate_limiter.capacity) / rate_limiter.rate
+        self.plan["eta"] = max(self.plan["domains"] * task_queue.seconds_per_domain, rate_bound)
+        self._db.close()
+        self._db = None
+        self._checks.clear()
+
+def format_domain_list(domains, total=None, limit=10):
+    """Up to limit names of a list that may itself be a sample of total items"""
+    shown = domains[:limit]
+    rest = (len(domains) if total is None else total) - len(shown)
+    return ", ".join(shown) if rest <= 0 else f"{', '.join(shown)} и ещё {rest}"
+
+def format_preflight(plan):
+    message = "📋 Проверка данных\n\n"
+    message += f"Аккаунтов: {plan['accounts']} (к запуску: {plan['runnable']}), доменов: {plan['domains']}\n"
+    message += f"Запросов к Cloudflare: ~{int(plan['api_calls'])}, время: {format_wait(plan['eta'])}\n"
+    
+    if plan["skipped"]:
+        message += "\n"
+        for login, reason in plan["skipped"]:
+            message += f"⛔ {login}: {reason}, аккаунт пропущен\n"
+        if plan["skipped_total"] > len(plan["skipped"]):
+            message += f"⛔ ...и ещё {plan['skipped_total'] - len(plan['skipped'])} аккаунтов пропущено\n"
+    if plan["invalid_domains"]:
+        message += f"\n⚠️ Неверные домены пропущены ({plan['invalid_domains_total']}): {format_domain_list(plan['invalid_domains'], plan['invalid_domains_total'])}\n"
+    if plan["duplicates"]:
+        message += f"\n⚠️ Повторяющиеся домены пропущены ({plan['duplicates_total']}): {format_domain_list(plan['duplicates'], plan['duplicates_total'])}\n"
+    if plan["unverified"]:
+        message += f"\n❔ Не удалось проверить ключи, попробуем всё равно: {format_domain_list(plan['unverified'], plan['unverified_total'])}\n"
+    if not plan["runnable"]:
+        message += "\n❌ Нечего запускать: исправьте данные и отправьте их снова."
+    return message
+
+class JobStore:
+    """Queued tasks and per-domain checkpoints in SQLite, so a restart resumes instead of starting over.
+
+    A job stays "queued"/"running" until its worker finishes it; each domain keeps the stages it
+    has completed (zone, dns, settings, complete) together with its zone id and name servers.
+    A job's text holds the accounts' API keys: the file is private to the bot's user and the
+    text is cleared as soon as the job is finished.
+    """
+    
+    def __init__(self, path=JOB_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.close(os.open(path, os.O_CREAT | os.O_RDWR, 0o600))
+            # The -wal and -shm files hold the same data; ones left by an older version may be readable by others
+            for name in (path, f"{path}-wal", f"{path}-shm"):
+                if os.path.exists(name):
+                    os.chmod(name, 0o600)
+        # Files SQLite creates next to the database are private whatever the process umask is
+        umask = os.umask(0o077)
+        try:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            os.umask(umask)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, chat_id INTEGER, "
+                "message_id INTEGER, text TEXT, status TEXT, created REAL, updated REAL, file_path TEXT)"
+            )
+            # Databases created before uploads were supported lack the file_path column
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "file_path" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN file_path TEXT")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS domain_checkpoints ("
+                "job_id INTEGER, account_index INTEGER, domain TEXT, state TEXT, updated REAL, "
+                "PRIMARY KEY (job_id, account_index, domain))"
+            )
+    
+    def add_job(self, user_id, chat_id, text, message_id, file_path=None):
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (user_id, chat_id, message_id, text, status, created, updated, file_path) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (user_id, chat_id, message_id, text, now, now, file_path)
+            )
+            return cursor.lastrowid
+    
+    def set_status(self, job_id, status):
+        with self._lock, self._conn:
+            if status in ("queued", "running"):
+                self._conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ?", (status, time.time(), job_id))
+            else:
+                # A finished job is never run again, so its credentials are not kept
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, updated = ?, text = NULL WHERE id = ?", (status, time.time(), job_id)
                 )
+    
+    def unfinished_jobs(self):
+        """Jobs that were queued or running when the bot stopped, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, user_id, chat_id, text, message_id, status, file_path FROM jobs "
+                "WHERE status IN ('queued', 'running') ORDER BY id"
+            ).fetchall()
+        return [dict(zip(("id", "user_id", "chat_id", "text", "message_id", "status", "file_path"), row)) for row in rows]
+    
+    def save_checkpoint(self, job_id, account_index, domain, state):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO domain_checkpoints (job_id, account_index, domain, state, updated) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job_id, account_index, domain, json.dumps(state), time.time())
             )
-        
-        for future in concurrent.futures.as_completed(futures):
+    
+    def load_checkpoints(self, job_id, account_index):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT domain, state FROM domain_checkpoints WHERE job_id = ? AND account_index = ?",
+                (job_id, account_index)
+            ).fetchall()
+        return {domain: json.loads(state) for domain, state in rows}
+    
+    def purge(self, older_than=JOB_RETENTION_DAYS * 86400):
+        """Drop finished jobs (and their checkpoints) older than the retention period"""
+        cutoff = time.time() - older_than
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM domain_checkpoints WHERE job_id IN "
+                "(SELECT id FROM jobs WHERE status NOT IN ('queued', 'running') AND updated < ?)",
+                (cutoff,)
+            )
+            self._conn.execute("DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND updated < ?", (cutoff,))
+            # Jobs finished before texts were cleared on completion
+            self._conn.execute("UPDATE jobs SET text = NULL WHERE status NOT IN ('queued', 'running') AND text IS NOT NULL")
+
+class DomainCheckpoints:
+    """Checkpoints of one account of a job; what process_domain reads and writes"""
+    
+    def __init__(self, store, job_id, account_index):
+        self.store = store
+        self.job_id = job_id
+        self.account_index = account_index
+        self._states = store.load_checkpoints(job_id, account_index)
+        # Stages of a domain finish on different threads: a snapshot is taken and written under
+        # one lock, so an older stage list can never be written after a newer one
+        self._lock = threading.Lock()
+    
+    def get(self, domain):
+        return self._states.get(domain)
+    
+    def completed(self, domain):
+        state = self._states.get(domain)
+        return bool(state) and "complete" in state.get("stages", [])
+    
+    def save(self, result):
+        with self._lock:
+            state = {key: result[key] for key in ("zone_id", "name_servers", "dns_status", "stages")}
+            state["stages"] = list(state["stages"])
+            self._states[result["domain"]] = state
             try:
-                result = future.result()
-                if not result.get('success'):
-                    error_msg = f"Failed to add DNS record: {result.get('errors', ['Unknown error'])[0]}"
-                    errors.append(error_msg)
-                    if log:
-                        log.append(error_msg)
-                    continue
-                
-                record_name = result.get('result', {}).get('name', 'unknown')
-                record_content = result.get('result', {}).get('content', 'unknown')
-                success_msg = f"DNS record {record_name} -> {record_content} added (Proxied)"
-                if log:
-                    log.append(success_msg)
+                self.store.save_checkpoint(self.job_id, self.account_index, result["domain"], state)
             except Exception as e:
-                errors.append(str(e))
-                if log:
-                    log.append(f"Error: {str(e)}")
+                logger.error(f"Error saving checkpoint for {result['domain']}: {str(e)}")
+
+job_store = JobStore()
+
+def job_checkpoints(job_id, account_index):
+    """Checkpoints for one account of a job, or None when the job could not be persisted"""
+    if job_id is None:
+        return None
+    try:
+        return DomainCheckpoints(job_store, job_id, account_index)
+    except Exception as e:
+        logger.error(f"Error loading checkpoints for job {job_id}: {str(e)}")
+        return None
+
+def check_async_transport(transport=CF_ASYNC_HTTP):
+    """Raise RuntimeError when the asyncio engine's HTTP client is not available"""
+    if transport == "aiohttp" and aiohttp is None:
+        raise RuntimeError("CF_ENGINE=asyncio needs aiohttp: install it (pip install aiohttp) or set CF_ASYNC_HTTP=requests")
+    if transport not in ("aiohttp", "requests"):
+        raise RuntimeError(f"Unknown CF_ASYNC_HTTP: {transport} (expected aiohttp or requests)")
+
+class AsyncCloudflareClient:
+    """Non-blocking counterpart of CloudflareClient for the asyncio engine.
+
+    Uses aiohttp (CF_ASYNC_HTTP=aiohttp, the default); with CF_ASYNC_HTTP=requests the pooled
+    requests sessions of cf_client are driven from a small thread pool instead.
+    Shares rate_limiter with the thread engine, so both respect the same per-account budget.
+    """
+
+    def __init__(self, transport=CF_ASYNC_HTTP):
+        # Falling back to blocking calls quietly would give none of the engine's concurrency
+        check_async_transport(transport)
+        self.transport = transport
+        self.base_url = cf_client.base_url
+        self._session = None
+        self._executor = None
+        self._global_slots = None
+        self._account_slots = {}
+
+    def _slots(self, login):
+        # Semaphores are created lazily so they belong to the engine's loop
+        if self._global_slots is None:
+            self._global_slots = asyncio.Semaphore(ASYNC_MAX_INFLIGHT)
+        slot = self._account_slots.get(login)
+        if slot is None:
+            slot = self._account_slots[login] = asyncio.Semaphore(IO_ACCOUNT_MAX_INFLIGHT)
+        return self._global_slots, slot
+
+    async def _send(self, login, api_key, method, path, params, json_body, form, timeout):
+        url = f"{self.base_url}{path}"
+        # form: multipart fields, a (filename, content) tuple for a file
+        files = {name: value for name, value in (form or {}).items() if isinstance(value, tuple)}
+        fields = {name: value for name, value in (form or {}).items() if not isinstance(value, tuple)}
+        if self.transport == "aiohttp":
+            if self._session is None:
+                connector = aiohttp.TCPConnector(limit=ASYNC_MAX_INFLIGHT, limit_per_host=ASYNC_MAX_INFLIGHT)
+                self._session = aiohttp.ClientSession(connector=connector)
+            headers = get_headers(login, api_key)
+            if json_body is None:
+                headers.pop("Content-Type", None)
+            body = None
+            if form is not None:
+                # Built per attempt: a FormData body cannot be sent twice
+                body = aiohttp.FormData()
+                for name, value in fields.items():
+                    body.add_field(name, value)
+                for name, (filename, content) in files.items():
+                    body.add_field(name, content, filename=filename)
+            client_timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+            async with self._session.request(method, url, params=params, json=json_body, data=body, headers=headers, timeout=client_timeout) as response:
+                try:
+                    data = await response.json(content_type=None)
+                except ValueError:
+                    data = None
+                return response.status, response.headers, data
+
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=IO_MAX_WORKERS, thread_name_prefix="cf-async-io")
+        session = cf_client.session(login, api_key)
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(
+            self._executor,
+            functools.partial(session.request, method, url, params=params, json=json_body,
+                              files=files or None, data=fields or None, timeout=timeout)
+        )
+        return response.status_code, response.headers, response_data(response)
+
+    async def request(self, login, api_key, method, path, params=None, json=None, form=None, idempotent=None):
+        """Send one API call and return its JSON body; transport errors become a failed body"""
+        credential_breaker.check(login, api_key)
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        with span("http", method=method, endpoint=cf_endpoint(path)) as http_span:
+            return await self._request(login, api_key, method, path, params, json, form, idempotent, http_span)
     
-    return len(errors) == 0
+    async def _request(self, login, api_key, method, path, params, json, form, idempotent, http_span):
+        endpoint = cf_endpoint(path)
+        attempt = 0
+        failures = 0
+        while True:
+            request_timeout()
+            delay = rate_limiter.reserve(login)
+            request_timeout(delay)
+            metrics.observe("cf_rate_limit_wait_seconds", delay)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            
+            global_slots, account_slots = self._slots(login)
+            try:
+                async with global_slots, account_slots:
+                    started = time.monotonic()
+                    try:
+                        status, headers, data = await self._send(login, api_key, method, path, params, json, form, request_timeout())
+                    finally:
+                        metrics.observe("cf_request_seconds", time.monotonic() - started, method=method, endpoint=endpoint)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                metrics.inc("cf_requests_total", method=method, endpoint=endpoint, status="error")
+                failures += 1
+                backoff = retry_backoff(failures) if retryable_error(idempotent, e) else None
+                if backoff is not None:
+                    logger.warning(f"Cloudflare call {method} {path} for {login} failed: {str(e)}, retrying in {backoff:.1f}s (attempt {failures})")
+                    metrics.inc("cf_retries_total", reason="error")
+                    await asyncio.sleep(backoff)
+                    continue
+                if http_span is not None:
+                    http_span.status = "error"
+                logger.error(f"Error calling {method} {path} for {login}: {str(e)}")
+                return {"success": False, "errors": [{"code": None, "message": str(e)}]}
+            metrics.inc("cf_requests_total", method=method, endpoint=endpoint, status=status)
+            outcome = classify_cf_response(status, data)
+            credential_breaker.record(login, api_key, outcome)
+            if http_span is not None:
+                http_span.attrs["http_status"] = status
+                http_span.retries = attempt + failures
+                http_span.status = "ok" if status < 400 else "error"
+            
+            if outcome == "retry" and idempotent:
+                failures += 1
+                backoff = retry_backoff(failures)
+                if backoff is not None:
+                    logger.warning(f"Cloudflare answered {status} to {method} {path} for {login}, retrying in {backoff:.1f}s (attempt {failures})")
+                    metrics.inc("cf_retries_total", reason="status")
+                    await asyncio.sleep(backoff)
+                    continue
+            if status != 429 or attempt >= CF_RATE_LIMIT_RETRIES:
+                return data if isinstance(data, dict) else {"success": False, "errors": [{"code": None, "message": f"HTTP {status}"}]}
+            
+            attempt += 1
+            retry_after = parse_retry_after(headers.get("Retry-After"))
+            logger.warning(f"Cloudflare rate limit hit for {login} on {method} {path}, retrying in {retry_after:.0f}s (attempt {attempt})")
+            rate_limiter.penalize(login, retry_after)
 
-def setup_dns_config_type_2(login, api_key, zone_id, domain, ip_www, log=None):
-    """Configuration type 2 for DNS setup"""
-    records = [
-        {"type": "CNAME", "name": "partners", "content": domain, "proxied": True},
-        {"type": "A", "name": "*", "content": ip_www, "proxied": True},
-        {"type": "A", "name": "@", "content": ip_www, "proxied": True},
-        {"type": "A", "name": "www", "content": ip_www, "proxied": True}
-    ]
+    async def list_pages(self, login, api_key, path, per_page):
+        """All results of a paginated listing; raises when a page cannot be read"""
+        items = []
+        page = 1
+        while True:
+            data = await self.request(login, api_key, "GET", path, params={"page": page, "per_page": per_page})
+            if not data.get('success'):
+                raise RuntimeError(f"Failed to list {path}: {data.get('errors', ['Unknown error'])}")
+            items.extend(data.get('result') or [])
+            if page >= data.get('result_info', {}).get('total_pages', 1):
+                return items
+            page += 1
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+class AsyncEngine:
+    """One background event loop shared by every task worker in CF_ENGINE=asyncio mode"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self.client = None
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="cf-async", daemon=True)
+                self._thread.start()
+                self.client = AsyncCloudflareClient()
+                logger.info(f"Asyncio engine started ({self.client.transport} transport)")
+            return self._loop
+
+    def run(self, coro):
+        """Run a coroutine on the engine loop from any thread and wait for its result"""
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._in_context(coro, contextvars.copy_context()), loop).result()
     
-    # Create records in parallel
-    errors = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-        futures = []
-        for record in records:
-            record_name = record["name"] if record["name"] != "@" else domain
-            futures.append(
-                executor.submit(
-                    create_dns_record,
-                    login, api_key, zone_id, 
-                    record["type"], record_name, record["content"], record["proxied"]
-                )
+    @staticmethod
+    async def _in_context(coro, context):
+        # The loop thread has its own context; carry the caller's span and time budget over
+        for var, value in context.items():
+            var.set(value)
+        return await coro
+
+    def stop(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.client.close(), loop).result(timeout=5)
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout=5)
+
+async_engine = AsyncEngine()
+
+async def sync_dns_records_async(client, login, api_key, zone_id, domain, dns_config_type, ip_api_cdn, ip_www, log=None):
+    """Asyncio version of reconcile_dns_records / the replace path; returns the DNS status or "failed" """
+    records = build_dns_records(dns_config_type, domain, ip_api_cdn, ip_www)
+    if records is None:
+        return "failed"
+    
+    path = f"/zones/{zone_id}/dns_records"
+    
+    def plan(existing):
+        if DNS_SYNC_MODE == "reconcile":
+            _, deletes, patches, posts = diff_dns_records(existing, records, domain)
+            return "updated", deletes, patches, posts
+        return "replaced", [{"id": record["id"]} for record in existing], [], [dns_record_payload(record, domain) for record in records]
+    
+    async def send_batches(deletes, patches, posts):
+        """Number of batches applied and whether that was all of them"""
+        applied = 0
+        for body in chunk_dns_batch(deletes, patches, posts):
+            data = await client.request(login, api_key, "POST", f"{path}/batch", json=body)
+            if not data.get('success'):
+                logger.warning(f"DNS batch rejected for zone {zone_id}: {data.get('errors', ['Unknown error'])}")
+                return applied, False
+            log_dns_batch_result(data.get('result') or {}, log)
+            applied += 1
+        return applied, True
+    
+    async def send_each(deletes, patches, posts):
+        """Per-record requests: deletes first, then patches and creates; returns the errors"""
+        errors = []
+        results = await asyncio.gather(*(client.request(login, api_key, "DELETE", f"{path}/{op['id']}") for op in deletes))
+        for data in results:
+            log_dns_record_result(data, "delete", errors, log)
+        
+        requests_to_send = [
+            (client.request(login, api_key, "PATCH", f"{path}/{op['id']}", json={k: v for k, v in op.items() if k != "id"}), "update")
+            for op in patches
+        ] + [
+            (client.request(login, api_key, "POST", path, json=op), "create")
+            for op in posts
+        ]
+        results = await asyncio.gather(*(coro for coro, _ in requests_to_send))
+        for data, (_, action) in zip(results, requests_to_send):
+            log_dns_record_result(data, action, errors, log)
+        return errors
+    
+    async def send_import(posts):
+        for proxied, group in zone_import_groups(posts):
+            data = await client.request(login, api_key, "POST", f"{path}/import", form=zone_import_form(group, domain, proxied))
+            if not log_dns_import_result(data, group, domain, log):
+                return False
+        return True
+    
+    status, deletes, patches, posts = plan(await client.list_pages(login, api_key, path, 100))
+    if not (deletes or patches or posts):
+        if log is not None:
+            log.append(f"DNS records for {domain} unchanged ({len(records)} records)")
+        return "unchanged"
+    
+    if CF_DNS_IMPORT and posts:
+        if CF_DNS_BATCH:
+            _, done = await send_batches(deletes, patches, ())
+        else:
+            done = not await send_each(deletes, patches, ())
+        if done and await send_import(posts):
+            return status
+        
+        # Part of the changes may have gone through, so plan the per-record fallback from fresh data
+        status, deletes, patches, posts = plan(await client.list_pages(login, api_key, path, 100))
+    
+    elif CF_DNS_BATCH:
+        applied, done = await send_batches(deletes, patches, posts)
+        if done:
+            return status
+        
+        # Earlier batches went through, and the failed one may have too when its answer was lost,
+        # so plan the per-record fallback from fresh data
+        existing = await client.list_pages(login, api_key, path, 100)
+        if not any(diff_dns_records(existing, records, domain)[1:]):
+            return status
+        status, deletes, patches, posts = plan(existing)
+    
+    if not await send_each(deletes, patches, posts):
+        return status
+    
+    # A create or delete that timed out may have been applied anyway, so failed calls are not resent
+    # blindly: every further round is planned from a fresh listing (see settle_dns_records)
+    failures = 0
+    while True:
+        try:
+            existing = await client.list_pages(login, api_key, path, 100)
+        except RuntimeError as e:
+            logger.error(f"Error listing DNS records for zone {zone_id}: {str(e)}")
+            return "failed"
+        _, deletes, patches, posts = diff_dns_records(existing, records, domain)
+        if not (deletes or patches or posts):
+            return status
+        failures += 1
+        backoff = retry_backoff(failures)
+        if backoff is None:
+            return "failed"
+        logger.warning(f"DNS records for {domain} still differ after failed requests, resending in {backoff:.1f}s (attempt {failures})")
+        await asyncio.sleep(backoff)
+        await send_each(deletes, patches, posts)
+
+async def apply_zone_settings_async(client, login, api_key, zone_id, settings, check_current=False):
+    """Asyncio version of apply_zone_settings"""
+    path = f"/zones/{zone_id}/settings"
+    
+    if check_current:
+        data = await client.request(login, api_key, "GET", path)
+        if data.get('success'):
+            current = {item["id"]: item.get("value") for item in data.get('result') or []}
+            settings = {setting: value for setting, value in settings.items() if current.get(setting) != value}
+            if not settings:
+                return True
+    
+    items = [{"id": setting, "value": value} for setting, value in settings.items()]
+    data = await client.request(login, api_key, "PATCH", path, json={"items": items})
+    if data.get('success', False):
+        return True
+    logger.warning(f"Bulk settings update rejected for zone {zone_id}: {data.get('errors', ['Unknown error'])}")
+    
+    results = await asyncio.gather(*(
+        client.request(login, api_key, "PATCH", f"{path}/{setting}", json={"value": value})
+        for setting, value in settings.items()
+    ))
+    return all(data.get('success', False) for data in results)
+
+async def find_zone_async(client, login, api_key, domain):
+    data = await client.request(login, api_key, "GET", "/zones", params={"name": domain})
+    if data.get('success') and data.get('result'):
+        return data['result'][0]
+    return None
+
+async def process_domain_async(client, account, domain, zone_index=None, report_stage=None, checkpoints=None):
+    """Asyncio version of process_domain: zone lookup/create, DNS, settings and NS capture"""
+    login = account["login"]
+    api_key = account["api_key"]
+    
+    result = new_domain_result(domain, checkpoints)
+    errors = result["errors"]
+    log_messages = result["log"]
+    
+    def fail(message):
+        errors.append(message)
+        log_messages.append(message)
+    
+    stage_timer = StageTimer(errors, domain=domain, login=login)
+    
+    def stage(name):
+        stage_timer.enter(STAGE_NAMES.get(name, name))
+        if report_stage:
+            report_stage(name)
+    
+    def stage_done(name):
+        result["stages"].append(name)
+        if checkpoints is not None:
+            checkpoints.save(result)
+    
+    logger.info(f"Processing domain {domain} for account {login}")
+    stage("Checking domain")
+    
+    deadline_token = current_deadline.set(budget_deadline(DOMAIN_TIMEOUT))
+    try:
+        credential_breaker.check(login, api_key)
+        if "zone" in result["stages"]:
+            existing_zone = {"id": result["zone_id"], "name_servers": result["name_servers"]}
+        elif zone_index is not None:
+            existing_zone = zone_index.get(domain)
+        else:
+            existing_zone = await find_zone_async(client, login, api_key, domain)
+        
+        zone_created = False
+        if existing_zone:
+            result["zone_id"] = existing_zone["id"]
+            result["name_servers"] = existing_zone.get("name_servers") or []
+        else:
+            stage_timer.enter("create")
+            zone_response = await client.request(login, api_key, "POST", "/zones", json={"name": domain, "jump_start": True}, idempotent=True)
+            if zone_response.get('success'):
+                result["zone_id"] = zone_response['result']['id']
+                result["name_servers"] = zone_response['result'].get('name_servers') or []
+                zone_created = True
+                if zone_index is not None:
+                    zone_index.add(zone_response['result'])
+            else:
+                existing_zone = await find_zone_async(client, login, api_key, domain)
+                if existing_zone:
+                    result["zone_id"] = existing_zone["id"]
+                    result["name_servers"] = existing_zone.get("name_servers") or []
+            
+            if not result["zone_id"]:
+                error_msg = (zone_response.get('errors') or [{'message': 'Unknown error'}])[0].get('message')
+                fail(f"❌ Failed to add domain {domain}: {error_msg}")
+                return result
+        
+        if "zone" not in result["stages"]:
+            stage_done("zone")
+        zone_id = result["zone_id"]
+        stage_timer.enter(None)
+        
+        async def dns_stage():
+            credential_breaker.check(login, api_key)
+            if report_stage:
+                report_stage("Setting up DNS")
+            dns_status = await sync_dns_records_async(
+                client, login, api_key, zone_id, domain,
+                account["dns_config_type"], account["ip_api_cdn"], account["ip_www"], log_messages
             )
+            result["dns_status"] = dns_status
+            if dns_status == "failed":
+                fail(f"❌ Error configuring DNS records for {domain}")
+                return False
+            stage_done("dns")
+            return True
         
-        for future in concurrent.futures.as_completed(futures):
+        async def ssl_stage():
+            credential_breaker.check(login, api_key)
+            if report_stage:
+                report_stage("Configuring SSL")
+            check_current = ZONE_SETTINGS_CHECK and not zone_created
+            if await apply_zone_settings_async(client, login, api_key, zone_id, build_zone_settings(account), check_current):
+                stage_done("settings")
+                return True
+            fail(f"❌ Error configuring SSL for {domain}")
+            return False
+        
+        async def ns_stage():
+            data = await client.request(login, api_key, "GET", f"/zones/{zone_id}")
+            result["name_servers"] = (data.get('result') or {}).get('name_servers') or []
+            return bool(result["name_servers"])
+        
+        stages = {}
+        if "dns" not in result["stages"]:
+            stages["dns"] = dns_stage
+        if "settings" not in result["stages"]:
+            stages["ssl"] = ssl_stage
+        if not result["name_servers"]:
+            stages["ns"] = ns_stage
+        await stage_pipeline.run_async(stages, done={"zone"})
+        
+        if not errors:
+            stage_done("complete")
+    
+    except DeadlineExceeded:
+        mark_timed_out(result)
+    except CircuitOpenError:
+        mark_auth_failed(result, login)
+    except Exception as e:
+        fail(f"❌ Error processing domain {domain}: {str(e)}")
+    finally:
+        if time_left() is not None and time_left() <= 0:
+            mark_timed_out(result)
+        elif "complete" not in result["stages"] and credential_breaker.is_open(login, api_key):
+            mark_auth_failed(result, login)
+        current_deadline.reset(deadline_token)
+        stage_timer.close()
+    
+    return result
+
+async def process_domains_async(account, domains, width, report_stage=None, on_domain_done=None, checkpoints=None):
+    """Run the per-domain pipeline for all domains of an account on the engine loop, in input order"""
+    client = async_engine.client
+    login = account["login"]
+    api_key = account["api_key"]
+    
+    try:
+        zone_index = ZoneIndex(login, api_key)
+        for zone in await client.list_pages(login, api_key, "/zones", 50):
+            zone_index.add(zone)
+    except Exception as e:
+        logger.error(f"Error building zone index for {login}: {str(e)}")
+        zone_index = None
+    
+    limit = asyncio.Semaphore(width)
+    
+    async def run(domain):
+        async with limit:
             try:
-                result = future.result()
-                if not result.get('success'):
-                    error_msg = f"Failed to add DNS record: {result.get('errors', ['Unknown error'])[0]}"
-                    errors.append(error_msg)
-                    if log:
-                        log.append(error_msg)
-                    continue
-                
-                record_name = result.get('result', {}).get('name', 'unknown')
-                record_content = result.get('result', {}).get('content', 'unknown')
-                success_msg = f"DNS record {record_name} -> {record_content} added (Proxied)"
-                if log:
-                    log.append(success_msg)
-            except Exception as e:
-                errors.append(str(e))
-                if log:
-                    log.append(f"Error: {str(e)}")
+                # The budget is enforced here as well, so a call that ignores its timeout is cancelled
+                left = time_left()
+                timeout = DOMAIN_TIMEOUT if left is None else max(0.0, min(DOMAIN_TIMEOUT, left))
+                return await asyncio.wait_for(
+                    process_domain_async(client, account, domain, zone_index, report_stage, checkpoints),
+                    timeout + WATCHDOG_GRACE
+                )
+            except asyncio.TimeoutError:
+                logger.error(f"Domain {domain} of {login} cancelled after exceeding its time budget")
+                return mark_timed_out(new_domain_result(domain, checkpoints))
+            finally:
+                if on_domain_done:
+                    on_domain_done()
     
-    return len(errors) == 0
+    return await asyncio.gather(*(run(domain) for domain in domains))
+
+def new_domain_result(domain, checkpoints=None):
+    """Empty per-domain result, pre-filled from a checkpoint when the domain was started before a restart"""
+    result = {
+        "domain": domain, "zone_id": None, "name_servers": [], "dns_status": "replaced",
+        "stages": [], "timed_out": False, "auth_failed": False, "errors": [], "log": []
+    }
+    saved = checkpoints.get(domain) if checkpoints is not None else None
+    if saved:
+        for key in ("zone_id", "name_servers", "dns_status", "stages"):
+            if key in saved:
+                result[key] = saved[key]
+    return result
+
+def mark_timed_out(result):
+    """Record on a domain result that its time budget ran out"""
+    if result["timed_out"]:
+        return result
+    result["timed_out"] = True
+    error_msg = f"⏱ Domain {result['domain']} timed out"
+    result["errors"].append(error_msg)
+    result["log"].append(error_msg)
+    return result
+
+def mark_auth_failed(result, login):
+    """Record on a domain result that Cloudflare rejected the account's API key"""
+    if result["auth_failed"]:
+        return result
+    result["auth_failed"] = True
+    error_msg = f"🔑 Domain {result['domain']} not configured: Cloudflare rejected the API key of {login}"
+    result["errors"].append(error_msg)
+    result["log"].append(error_msg)
+    return result
+
+def configure_domain_dns(login, api_key, zone_id, domain, account, result):
+    """DNS stage of process_domain; returns True when the zone has the configured records"""
+    dns_config_type = account["dns_config_type"]
+    ip_api_cdn = account["ip_api_cdn"]
+    ip_www = account["ip_www"]
+    log_messages = result["log"]
+    
+    if DNS_SYNC_MODE == "reconcile":
+        dns_status = reconcile_dns_records(login, api_key, zone_id, domain, dns_config_type, ip_api_cdn, ip_www, log_messages)
+        if dns_status is not None:
+            result["dns_status"] = dns_status
+            return dns_status != "failed"
+    
+    # Replace the whole record set with one zone file import, or in a few batch calls, when possible
+    if CF_DNS_IMPORT:
+        dns_success = replace_dns_records_import(login, api_key, zone_id, domain, dns_config_type, ip_api_cdn, ip_www, log_messages)
+        if dns_success is not None:
+            return dns_success
+        logger.warning(f"DNS import failed for {domain}, falling back")
+    
+    if CF_DNS_BATCH:
+        dns_success = replace_dns_records_batch(login, api_key, zone_id, domain, dns_config_type, ip_api_cdn, ip_www, log_messages)
+        if dns_success is not None:
+            return dns_success
+        logger.warning(f"DNS batch failed for {domain}, falling back to per-record requests")
+    
+    with span("delete") as delete_span:
+        if not delete_existing_records(login, api_key, zone_id):
+            error_msg = f"❌ Error deleting existing DNS records for {domain}"
+            result["errors"].append(error_msg)
+            log_messages.append(error_msg)
+            if delete_span is not None:
+                delete_span.status = "error"
+    
+    # Apply DNS configuration based on type
+    if setup_dns_config(login, api_key, zone_id, domain, dns_config_type, ip_api_cdn, ip_www, log_messages):
+        return True
+    records = build_dns_records(dns_config_type, domain, ip_api_cdn, ip_www)
+    return records is not None and settle_dns_records(login, api_key, zone_id, domain, records, log_messages)
 
-def setup_dns_config_type_3(login, api_key, zone_id, domain, ip_api_cdn, ip_www, log=None):
-    """Configuration type 3 for DNS setup - includes type 1 settings plus additional Google Workspace related records"""
+def process_domain(account, domain, report_stage=None, zone_index=None, checkpoints=None):
+    """Run the full setup pipeline for one domain of an account.
 
+    Returns a per-domain result; nothing here touches state shared with other domains,
+    so several domains of the same account can be processed at once. Once the zone exists,
+    DNS, SSL and NS capture run together through stage_pipeline. Stages already recorded
+    in checkpoints (zone, dns, settings) are not repeated.
+    """
+    login = account["login"]
+    api_key = account["api_key"]
     
-    # First set up the basic records from type 1
-    basic_records_success = setup_dns_config_type_1(login, api_key, zone_id, domain, ip_api_cdn, ip_www, log)
+    result = new_domain_result(domain, checkpoints)
+    errors = result["errors"]
+    log_messages = result["log"]
     
-    if not basic_records_success:
-        if log:
-            log.append("❌ Failed to set up base records, cannot continue with additional records")
-        return False
+    stage_timer = StageTimer(errors, domain=domain, login=login)
+    
+    def stage(name):
+        stage_timer.enter(STAGE_NAMES.get(name, name))
+        if report_stage:
+            report_stage(name)
     
-    # Additional records for type 3
-    additional_records = [
-        # MX Records
-        {"type": "MX", "name": "@", "content": "ASPMX.L.GOOGLE.COM", "priority": 1, "proxied": False},
-        {"type": "MX", "name": "@", "content": "ALT1.ASPMX.L.GOOGLE.COM", "priority": 5, "proxied": False},
-        {"type": "MX", "name": "@", "content": "ALT2.ASPMX.L.GOOGLE.COM", "priority": 5, "proxied": False},
-        {"type": "MX", "name": "@", "content": "ALT3.ASPMX.L.GOOGLE.COM", "priority": 10, "proxied": False},
-        {"type": "MX", "name": "@", "content": "ALT4.ASPMX.L.GOOGLE.COM", "priority": 10, "proxied": False},
+    def stage_done(name):
+        result["stages"].append(name)
+        if checkpoints is not None:
+            checkpoints.save(result)
+    
+    logger.info(f"Processing domain {domain} for account {login}")
+    stage("Checking domain")
+    
+    deadline_token = current_deadline.set(budget_deadline(DOMAIN_TIMEOUT))
+    try:
+        # A key Cloudflare already rejected fails the remaining domains without a request
+        credential_breaker.check(login, api_key)
         
-        # SPF TXT Record
-        {"type": "TXT", "name": "@", "content": "v=spf1 include:_spf.google.com ~all", "proxied": False},
+        # Check if zone already exists: the account index when we have one, a lookup otherwise
+        # (both already carry the zone's name servers, so no extra request is needed for them)
+        if "zone" in result["stages"]:
+            existing_zone = {"id": result["zone_id"], "name_servers": result["name_servers"]}
+        elif zone_index is not None:
+            existing_zone = zone_index.get(domain)
+        else:
+            existing_zone = find_zone(login, api_key, domain)
         
-        # DKIM TXT Record - with static prefix and random characters for key part
-        {"type": "TXT", "name": "google_domainkey", "content": "v=DKIM1; k=rsa; p=MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEAiKDHvtdR3aPx8e3ZlefLwShZr2vzMhg8LIXP8pFUWixHC+IwGM818ygEMDNNdv8Fv813e7M5EjmHQT9MtsGS8dLTMyPCK0atzrk2ZyIa9AArClj1IYiSQVfXCQBQYu8dQiIE9Bfi8aSt4E7AuRby/jViSDtLSLemyqKR4GAA4KtB4nVVpMmJT4ZzwfEfUHBRrQbXIMQwvumh46RCoStKC5qe3FRC2DvA/hp7RfhasXlzFfubpE1dfy7xKGm2npKtUW7r7Hnn96Lv//kLiQnBQY82hcxvdBrQHM9ORcblx7adxElVB6f2yp2lldqL2oS9fU3HkC7bUU25XXY21YqF1wIDAQAB", "proxied": False},
+        zone_created = False
+        if existing_zone:
+            result["zone_id"] = existing_zone["id"]
+            result["name_servers"] = existing_zone.get("name_servers") or []
+        else:
+            # Create new zone
+            stage_timer.enter("create")
+            zone_response = create_zone(login, api_key, domain)
+            if zone_response.get('success'):
+                result["zone_id"] = zone_response['result']['id']
+                result["name_servers"] = zone_response['result'].get('name_servers') or []
+                zone_created = True
+                if zone_index is not None:
+                    zone_index.add(zone_response['result'])
+            else:
+                # Stale index (zone added elsewhere meanwhile), or a create that failed after Cloudflare
+                # applied it: look the zone up before giving up
+                existing_zone = find_zone(login, api_key, domain)
+                if existing_zone:
+                    result["zone_id"] = existing_zone["id"]
+                    result["name_servers"] = existing_zone.get("name_servers") or []
+            
+            if not result["zone_id"]:
+                error_msg = zone_response.get('errors', [{'message': 'Unknown error'}])[0].get('message')
+                fail_msg = f"❌ Failed to add domain {domain}: {error_msg}"
+                errors.append(fail_msg)
+                log_messages.append(fail_msg)
+                return result
         
-        # DMARC TXT Record - with static prefix and random domain
-        {"type": "TXT", "name": "_dmarc", "content": f"v=DMARC1; p=none; rua=mailto:dmarc@{generate_random_domain()}", "proxied": False},
+        if "zone" not in result["stages"]:
+            stage_done("zone")
+        zone_id = result["zone_id"]
+        # The remaining stages overlap, stage_pipeline times and traces them
+        stage_timer.enter(None)
         
-        # Google site verification - with static prefix and random string matching length
-        {"type": "TXT", "name": "@", "content": f"google-site-verification={generate_random_verification_string()}", "proxied": False}
-    ]
-    
-    errors = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        futures = []
-        for record in additional_records:
-            record_name = record["name"] if record["name"] != "@" else domain
+        def dns_stage():
+            credential_breaker.check(login, api_key)
+            if report_stage:
+                report_stage("Setting up DNS")
+            if configure_domain_dns(login, api_key, zone_id, domain, account, result):
+                stage_done("dns")
+                return True
+            error_msg = f"❌ Error configuring DNS records for {domain}"
+            errors.append(error_msg)
+            log_messages.append(error_msg)
+            return False
+        
+        def ssl_stage():
+            credential_breaker.check(login, api_key)
+            if report_stage:
+                report_stage("Configuring SSL")
             
-            # Special handling for MX records which have a priority
-            if record["type"] == "MX":
-                futures.append(
-                    executor.submit(
-                        create_mx_record,
-                        login, api_key, zone_id, 
-                        record_name, record["content"], record["priority"]
-                    )
-                )
-            else:
-                futures.append(
-                    executor.submit(
-                        create_dns_record,
-                        login, api_key, zone_id, 
-                        record["type"], record_name, record["content"], record["proxied"]
-                    )
-                )
+            # A zone we just created still has defaults, so only existing zones are worth checking first
+            check_current = ZONE_SETTINGS_CHECK and not zone_created
+            if apply_zone_settings(login, api_key, zone_id, build_zone_settings(account), check_current):
+                stage_done("settings")
+                return True
+            error_msg = f"❌ Error configuring SSL for {domain}"
+            errors.append(error_msg)
+            log_messages.append(error_msg)
+            return False
         
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                result = future.result()
-                if not result.get('success'):
-                    error_msg = f"Failed to add DNS record: {result.get('errors', ['Unknown error'])[0]}"
-                    errors.append(error_msg)
-                    if log:
-                        log.append(error_msg)
-                    continue
-                
-                record_name = result.get('result', {}).get('name', 'unknown')
-                record_content = result.get('result', {}).get('content', 'unknown')
-                proxied_status = "Proxied" if result.get('result', {}).get('proxied', False) else "Unproxied"
-                success_msg = f"DNS record {record_name} -> {record_content} added ({proxied_status})"
-                if log:
-                    log.append(success_msg)
-            except Exception as e:
-                errors.append(str(e))
-                if log:
-                    log.append(f"Error: {str(e)}")
-    
-    return len(errors) == 0
-
-def create_mx_record(login, api_key, zone_id, name, content, priority):
-    """Create an MX record with priority"""
-    url = f"https://api.cloudflare.com/client/v4/zones/{zone_id}/dns_records"
-    data = {
-        "type": "MX",
-        "name": name,
-        "content": content,
-        "priority": priority,
-        "ttl": 1,
-        "proxied": False  # MX records cannot be proxied
-    }
-    try:
-        response = requests.post(url, headers=get_headers(login, api_key), json=data)
-        return response.json()
+        def ns_stage():
+            result["name_servers"] = get_nameservers(login, api_key, zone_id) or []
+            return bool(result["name_servers"])
+        
+        stages = {}
+        if "dns" not in result["stages"]:
+            stages["dns"] = dns_stage
+        if "settings" not in result["stages"]:
+            stages["ssl"] = ssl_stage
+        if not result["name_servers"]:
+            stages["ns"] = ns_stage
+        stage_pipeline.run(stages, done={"zone"})
+        
+        if not errors:
+            stage_done("complete")
+            
+    except DeadlineExceeded:
+        mark_timed_out(result)
+    except CircuitOpenError:
+        mark_auth_failed(result, login)
     except Exception as e:
-        logger.error(f"Error creating MX record {name} -> {content} (priority {priority}): {str(e)}")
-        return {"success": False, "error": str(e)}
-
-def generate_random_domain():
-    """Generate a realistic-looking random domain for DMARC record"""
-    # Common prefixes and words used in domain names
-    prefixes = ["my", "web", "cloud", "cyber", "digital", "tech", "smart", "quick", "easy", "best", 
-               "pro", "top", "prime", "fast", "net", "online", "go", "get", "the", "global"]
-    
-    # Common words used in domain names
-    words = ["site", "host", "web", "tech", "soft", "data", "blog", "app", "mail", "cloud", 
-            "store", "shop", "market", "team", "tools", "hub", "zone", "spot", "space", "box",
-            "work", "group", "base", "point", "net", "systems", "software", "solutions"]
-    
-    # Randomly decide on structure (prefix+word, word+word, or just word)
-    structure = random.randint(1, 3)
-    
-    if structure == 1:
-        # prefix + word (e.g., mycloud)
-        domain_name = random.choice(prefixes) + random.choice(words)
-    elif structure == 2:
-        # word + word (e.g., cloudspace)
-        domain_name = random.choice(words) + random.choice(words)
-    else:
-        # single word with optional number (e.g., cloud365)
-        domain_name = random.choice(words)
-        # Add a number 30% of the time
-        if random.random() < 0.3:
-            domain_name += str(random.randint(1, 999))
+        error_msg = f"❌ Error processing domain {domain}: {str(e)}"
+        errors.append(error_msg)
+        log_messages.append(error_msg)
+    finally:
+        # Helpers swallow their own errors, so a budget that ran out mid-stage is noticed here,
+        # and so is a key rejected by Cloudflare while this domain was being set up
+        if time_left() is not None and time_left() <= 0:
+            mark_timed_out(result)
+        elif "complete" not in result["stages"] and credential_breaker.is_open(login, api_key):
+            mark_auth_failed(result, login)
+        current_deadline.reset(deadline_token)
+        stage_timer.close()
     
-    # Add .com extension
-    return f"{domain_name}.com"
+    return result
 
-def generate_random_verification_string():
-    """Generate a random verification string matching the example length"""
-    # The example string is: G8XgjG-VV894J7gNnjJTHe8MO2cXZCvIldjZzo4FoTx (43 chars)
-    chars = string.ascii_letters + string.digits + "-_"
-    return ''.join(random.choice(chars) for _ in range(43))
+def wait_for_domain(future, domain, started_at):
+    """Result of a domain future, or None once the domain (or the whole task) is hung past its budget.
 
-def update_progress_message(chat_id, message_id, progress, total, login, stage="Processing domains"):
-    progress_percentage = min(100, int(progress / total * 100))
-    progress_bar = '▓' * (progress_percentage // 10) + '░' * (10 - progress_percentage // 10)
-    
-    text = (
-        f"⚙️ Working with account: {login}\n"
-        f"👨‍💻 {stage}:\n"
-        f"[{progress_bar}] {progress_percentage}%\n"
-        f"🔄 Processed {progress}/{total} domains"
-    )
-    
-    try:
-        bot.edit_message_text(text, chat_id, message_id, parse_mode='HTML')
-    except Exception as e:
-        logger.error(f"Error updating progress message: {str(e)}")
+    Deadlines normally end a domain on their own; this covers a call that never returns.
+    """
+    task_deadline = current_deadline.get()
+    while True:
+        try:
+            return future.result(timeout=WATCHDOG_INTERVAL)
+        except concurrent.futures.TimeoutError:
+            now = time.monotonic()
+            started = started_at.get(domain)
+            if started is not None and now - started > DOMAIN_TIMEOUT + WATCHDOG_GRACE:
+                return None
+            if task_deadline is not None and now > task_deadline + WATCHDOG_GRACE:
+                return None
 
-def setup_zones(account, chat_id, all_accounts_info):
-    import random
-    
+def setup_zones(account, chat_id, all_accounts_info=None, board=None, checkpoints=None):
+    started = time.monotonic()
     login = account["login"]
     api_key = account["api_key"]
-    domains = account["domains"]
-    ip_api_cdn = account["ip_api_cdn"]
-    ip_www = account["ip_www"]
-    dns_config_type = account["dns_config_type"]
-    
-    ssl_settings = {
-        "opportunistic_encryption": account["opportunistic_encryption"],
-        "tls_1_3": account["tls_1_3"]
-    }
+    # Domains finished before a restart are taken from their checkpoints and not processed again
+    done = {}
+    if checkpoints is not None:
+        done = {domain: new_domain_result(domain, checkpoints) for domain in account["domains"] if checkpoints.completed(domain)}
+        if done:
+            logger.info(f"Resuming {login}: {len(done)} of {len(account['domains'])} domains already done")
+    domains = [domain for domain in account["domains"] if domain not in done]
     
     zone_info = {}
+    ns_info = {}
     errors = []
     log_messages = []
+    unchanged_domains = []
+    timed_out_domains = []
+    auth_failed_domains = []
     
-    # Send initial progress message
-    progress_message = bot.send_message(
-        chat_id, 
-        f"⚙️ Working with account: {login}\n👨‍💻 Preparation:\n[░░░░░░░░░░] 0%\n🔄 Processed 0/{len(domains)} domains"
-    )
-    message_id = progress_message.message_id
+    # Progress goes to the task's live dashboard; a standalone call gets a dashboard of its own
+    own_board = board is None
+    if own_board:
+        board = progress_renderer.open(chat_id, [login])
+    progress_renderer.update(board, login, stage="Preparation", total=len(account["domains"]))
+    for _ in done:
+        progress_renderer.advance(board, login)
+    
+    def report_stage(stage):
+        progress_renderer.update(board, login, stage=stage)
+    
+    def domain_done():
+        progress_renderer.advance(board, login)
     
-    # Process each domain
-    for index, domain in enumerate(domains):
-        logger.info(f"Processing domain {domain} for account {login}")
-        update_progress_message(chat_id, message_id, index, len(domains), login, "Checking domain")
+    # Process several domains at once; results are merged in input order below
+    default_width = ASYNC_DOMAIN_CONCURRENCY if CF_ENGINE == "asyncio" else DOMAIN_CONCURRENCY
+    width = max(1, min(account.get("domain_concurrency") or default_width, len(domains) or 1))
+    if not domains:
+        results = []
+    elif CF_ENGINE == "asyncio":
+        results = async_engine.run(process_domains_async(account, domains, width, report_stage, domain_done, checkpoints))
+    else:
+        # One paginated listing instead of a lookup per domain
+        report_stage("Loading zone list")
+        with span("zone_index"):
+            zone_index = load_zone_index(login, api_key)
+        
+        started_at = {}
+        
+        def run_domain(domain):
+            started_at[domain] = time.monotonic()
+            try:
+                return process_domain(account, domain, report_stage, zone_index, checkpoints)
+            finally:
+                domain_done()
         
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=width, thread_name_prefix=f"domains-{login}")
+        futures = [executor.submit(with_context(run_domain), domain) for domain in domains]
+        results = []
+        abandoned = False
         try:
-            # Check if zone already exists
-            existing_zone_id = check_zone_exists(login, api_key, domain)
-            if existing_zone_id:
-                zone_info[domain] = existing_zone_id
-            else:
-                # Create new zone
-                zone_response = create_zone(login, api_key, domain)
-                if zone_response.get('success'):
-                    zone_id = zone_response['result']['id']
-                    zone_info[domain] = zone_id
-                else:
-                    error_msg = zone_response.get('errors', [{'message': 'Unknown error'}])[0].get('message')
-                    fail_msg = f"❌ Failed to add domain {domain}: {error_msg}"
-                    errors.append(fail_msg)
-                    log_messages.append(fail_msg)
-                    continue
-
-            update_progress_message(chat_id, message_id, index + 0.33, len(domains), login, "Setting up DNS")
-            
-            if not delete_existing_records(login, api_key, zone_info[domain]):
-                error_msg = f"❌ Error deleting existing DNS records for {domain}"
-                errors.append(error_msg)
-                log_messages.append(error_msg)
-
-            # Apply DNS configuration based on type
-            dns_success = False
-            if dns_config_type == 1:
-                dns_success = setup_dns_config_type_1(login, api_key, zone_info[domain], domain, ip_api_cdn, ip_www, log_messages)
-            elif dns_config_type == 2:
-                dns_success = setup_dns_config_type_2(login, api_key, zone_info[domain], domain, ip_www, log_messages)
-            elif dns_config_type == 3:
-                dns_success = setup_dns_config_type_3(login, api_key, zone_info[domain], domain, ip_api_cdn, ip_www, log_messages)
-                
-            if not dns_success:
-                error_msg = f"❌ Error configuring DNS records for {domain}"
-                errors.append(error_msg)
-                log_messages.append(error_msg)
-            
-            update_progress_message(chat_id, message_id, index + 0.66, len(domains), login, "Configuring SSL")
-            
-            if not configure_ssl(login, api_key, zone_info[domain], ssl_settings["opportunistic_encryption"], ssl_settings["tls_1_3"]):
-                error_msg = f"❌ Error configuring SSL for {domain}"
-                errors.append(error_msg)
-                log_messages.append(error_msg)
-                
-        except Exception as e:
-            error_msg = f"❌ Error processing domain {domain}: {str(e)}"
-            errors.append(error_msg)
-            log_messages.append(error_msg)
+            for domain, future in zip(domains, futures):
+                result = wait_for_domain(future, domain, started_at)
+                if result is None:
+                    # Hung past its budget: report it as timed out and stop waiting for its thread
+                    logger.error(f"Domain {domain} of {login} is stuck past its time budget, abandoning it")
+                    metrics.inc("watchdog_abandoned_total", scope="domain")
+                    abandoned = True
+                    future.cancel()
+                    if domain not in started_at:
+                        domain_done()
+                    result = mark_timed_out(new_domain_result(domain, checkpoints))
+                results.append(result)
+        finally:
+            executor.shutdown(wait=not abandoned, cancel_futures=abandoned)
+    
+    results = iter(results)
+    results = [done[domain] if domain in done else next(results) for domain in account["domains"]]
+    for result in results:
+        if result["timed_out"]:
+            timed_out_domains.append(result["domain"])
+        elif result["auth_failed"]:
+            auth_failed_domains.append(result["domain"])
+        elif result["zone_id"]:
+            zone_info[result["domain"]] = result["zone_id"]
+            ns_info[result["domain"]] = result["name_servers"]
+        if result["dns_status"] == "unchanged":
+            unchanged_domains.append(result["domain"])
+        errors.extend(result["errors"])
+        log_messages.extend(result["log"])
     
-    update_progress_message(chat_id, message_id, len(domains), len(domains), login, "Getting NS data")
+    report_stage("Getting NS data")
+    
+    limiter_stats = rate_limiter.stats(login).get(login)
+    if limiter_stats:
+        logger.info(
+            f"Rate limiter for {login}: {limiter_stats['requests']} requests, "
+            f"waited {limiter_stats['waited']:.1f}s (max {limiter_stats['max_wait']:.1f}s), "
+            f"429 responses: {limiter_stats['throttled']}"
+        )
     
-    # Get nameservers for summary
-    ns_servers = []
-    for domain, zone_id in zone_info.items():
-        servers = get_nameservers(login, api_key, zone_id)
-        if servers:
-            ns_servers = servers
-            break 
+    # Name servers were captured from the zone listing / create responses; fetch only the missing ones
+    missing_ns = [domain for domain in zone_info if not ns_info.get(domain)]
+    if missing_ns:
+        with span("ns", domains=len(missing_ns)):
+            futures = [io_scheduler.submit(login, get_nameservers, login, api_key, zone_info[domain]) for domain in missing_ns]
+            for domain, future in zip(missing_ns, futures):
+                ns_info[domain] = future.result() or []
+
+    ns_servers = next((servers for servers in ns_info.values() if servers), [])
     
     # Prepare account info summary
     account_info = {
         "login": login,
         "ns_servers": ns_servers,
+        "ns_by_domain": ns_info,
         "errors": errors,
-        "domains": list(zone_info.keys())  
+        "domains": list(zone_info.keys()),
+        "unchanged_domains": unchanged_domains,
+        "timed_out_domains": timed_out_domains,
+        "auth_failed_domains": auth_failed_domains
     }
-    all_accounts_info.append(account_info)
+    if all_accounts_info is not None:
+        all_accounts_info.append(account_info)
     
-    # Delete progress message
-    try:
-        bot.delete_message(chat_id, message_id)
-    except Exception as e:
-        logger.error(f"Error deleting message: {str(e)}")
+    progress_renderer.finish(board, login)
+    if own_board:
+        progress_renderer.close(board)
     
+    metrics.observe("account_setup_seconds", time.monotonic() - started)
     return account_info
+
 def send_final_summary(chat_id, all_accounts_info):
 
     has_errors = any(len(acc["errors"]) > 0 for acc in all_accounts_info)
@@ -693,6 +3669,10 @@ def send_final_summary(chat_id, all_accounts_info):
         ns_servers = account_info["ns_servers"]
 
         status_message += f"🟠 {login}\n\n"
+        
+        if account_info.get("skipped"):
+            status_message += f"⛔ Аккаунт пропущен: {account_info['skipped']}\n\n"
+            continue
 
         if "domains" in account_info and account_info["domains"]:
             status_message += "🌐 Настроенные домены:\n"
@@ -700,8 +3680,43 @@ def send_final_summary(chat_id, all_accounts_info):
                 status_message += f"- {domain}\n"
             status_message += "\n"
         
+        unchanged_domains = account_info.get("unchanged_domains")
+        if unchanged_domains:
+            status_message += f"♻️ DNS уже настроен, без изменений: {len(unchanged_domains)}\n\n"
+        
+        timed_out_domains = account_info.get("timed_out_domains")
+        if timed_out_domains:
+            status_message += "⏱ Превышено время обработки (домен не настроен до конца):\n"
+            for domain in timed_out_domains:
+                status_message += f"- {domain}\n"
+            status_message += "\n"
+        
+        auth_failed_domains = account_info.get("auth_failed_domains")
+        if auth_failed_domains:
+            status_message += f"🔑 Cloudflare отклонил API ключ, домены не настроены: {len(auth_failed_domains)}\n"
+            for domain in auth_failed_domains:
+                status_message += f"- {domain}\n"
+            status_message += "\n"
+        
 
-        if ns_servers:
+        ns_by_domain = account_info.get("ns_by_domain")
+        if ns_by_domain:
+            # Cloudflare may assign different NS pairs per zone: group domains sharing a pair
+            ns_groups = {}
+            for domain, servers in ns_by_domain.items():
+                ns_groups.setdefault(tuple(servers), []).append(domain)
+            
+            missing_ns = ns_groups.pop((), [])
+            for servers, group_domains in ns_groups.items():
+                if len(ns_groups) == 1 and not missing_ns:
+                    status_message += "🔧 NS серверы:\n"
+                else:
+                    status_message += f"🔧 NS серверы для {', '.join(group_domains)}:\n"
+                for ns in servers:
+                    status_message += f"<code>{ns}</code>\n"
+            if missing_ns:
+                status_message += f"❌ Не удалось получить NS серверы для {', '.join(missing_ns)}\n"
+        elif ns_servers:
             status_message += "🔧 NS серверы:\n"
             for ns in ns_servers:
                 status_message += f"<code>{ns}</code>\n"
@@ -711,13 +3726,13 @@ def send_final_summary(chat_id, all_accounts_info):
         status_message += "\n"
     
 
-    try:
-        bot.send_message(chat_id, status_message, parse_mode='HTML')
-    except Exception as e:
-        logger.error(f"Error sending final summary: {str(e)}")
+    def fallback(future):
+        if future.exception() is not None:
+            logger.error(f"Error sending final summary: {str(future.exception())}")
+            simplified_message = status_message.replace("<code>", "").replace("</code>", "")
+            outbox.send_message(chat_id, simplified_message)
 
-        simplified_message = status_message.replace("<code>", "").replace("</code>", "")
-        bot.send_message(chat_id, simplified_message)
+    outbox.send_message(chat_id, status_message, parse_mode='HTML').add_done_callback(fallback)
 
 
 @bot.message_handler(commands=['start'])
@@ -743,16 +3758,10 @@ def welcome_command(message):
             "Используйте /format, чтобы увидеть примеры форматов конфигурации."
             )
         
-        try:
-            bot.send_message(chat_id, welcome_text)
-        except Exception as e:
-            logger.error(f"Error sending welcome message: {str(e)}")
+        outbox.send_message(chat_id, welcome_text)
     else:
         logger.warning(f"Access denied to user {user_id}")
-        try:
-            bot.send_message(chat_id, f"You don't have access to this bot. Contact admin {SUPER_ADMIN_TAG} to request access.")
-        except Exception as e:
-            logger.error(f"Error sending access denied message: {str(e)}")
+        outbox.send_message(chat_id, f"You don't have access to this bot. Contact admin {SUPER_ADMIN_TAG} to request access.")
 
 
 @bot.message_handler(commands=['add_user'])
@@ -768,18 +3777,16 @@ def add_user_command(message):
                 role = command_parts[2] if len(command_parts) >= 3 else "user"
                 
                 WHITELIST[new_user_id] = role
-                bot.reply_to(message, f"✅ User {new_user_id} added to whitelist with role {role}")
+                outbox.reply_to(message, f"✅ User {new_user_id} added to whitelist with role {role}")
                 logger.info(f"User {user_id} added {new_user_id} to whitelist with role {role}")
             else:
-                bot.reply_to(message, "❌ Invalid command format. Use: /add_user ID role")
+                outbox.reply_to(message, "❌ Invalid command format. Use: /add_user ID role")
         except ValueError:
-            bot.reply_to(message, "❌ User ID must be a number")
-        except Exception as e:
-            bot.reply_to(message, f"❌ Error adding user: {str(e)}")
+            outbox.reply_to(message, "❌ User ID must be a number")
     else:
 
         access_denied_message = f"❌ You don't have permissions to add users to whitelist. Contact {SUPER_ADMIN_TAG}"
-        bot.reply_to(message, access_denied_message)
+        outbox.reply_to(message, access_denied_message)
 
 
 @bot.message_handler(commands=['remove_user'])
@@ -796,20 +3803,18 @@ def remove_user_command(message):
                 
                 if target_user_id in WHITELIST:
                     del WHITELIST[target_user_id]
-                    bot.reply_to(message, f"✅ User {target_user_id} removed from whitelist")
+                    outbox.reply_to(message, f"✅ User {target_user_id} removed from whitelist")
                     logger.info(f"User {user_id} removed {target_user_id} from whitelist")
                 else:
-                    bot.reply_to(message, f"❌ User {target_user_id} not found in whitelist")
+                    outbox.reply_to(message, f"❌ User {target_user_id} not found in whitelist")
             else:
-                bot.reply_to(message, "❌ Invalid command format. Use: /remove_user ID")
+                outbox.reply_to(message, "❌ Invalid command format. Use: /remove_user ID")
         except ValueError:
-            bot.reply_to(message, "❌ User ID must be a number")
-        except Exception as e:
-            bot.reply_to(message, f"❌ Error removing user: {str(e)}")
+            outbox.reply_to(message, "❌ User ID must be a number")
     else:
 
         access_denied_message = f"❌ You don't have permissions to remove users from whitelist. Contact {SUPER_ADMIN_TAG}"
-        bot.reply_to(message, access_denied_message)
+        outbox.reply_to(message, access_denied_message)
 
 
 @bot.message_handler(commands=['users'])
@@ -817,20 +3822,16 @@ def list_users_command(message):
     user_id = message.from_user.id
     
     if user_id in WHITELIST and WHITELIST[user_id] in ["admin", "super-admin"]:
-        try:
-            if WHITELIST:
-                users_list = "👥 Users in whitelist:\n\n"
-                for uid, role in WHITELIST.items():
-                    users_list += f"ID: {uid}, Role: {role}\n"
-                bot.reply_to(message, users_list)
-            else:
-                bot.reply_to(message, "👥 Whitelist is empty")
-        except Exception as e:
-            bot.reply_to(message, f"❌ Error getting user list: {str(e)}")
-            logger.error(f"Error in list_users command: {str(e)}")
+        if WHITELIST:
+            users_list = "👥 Users in whitelist:\n\n"
+            for uid, role in WHITELIST.items():
+                users_list += f"ID: {uid}, Role: {role}\n"
+            outbox.reply_to(message, users_list)
+        else:
+            outbox.reply_to(message, "👥 Whitelist is empty")
     else:
         access_denied_message = f"❌ You don't have permissions to view user list. Contact {SUPER_ADMIN_TAG}"
-        bot.reply_to(message, access_denied_message)
+        outbox.reply_to(message, access_denied_message)
 
 @bot.message_handler(commands=['format'])
 def show_formats(message):
@@ -872,20 +3873,15 @@ def show_formats(message):
             "5. IP-адрес для WWW\n"
             "6. Opportunistic Encryption (true/false)\n"
             "7. TLS 1.3 (true/false)\n"
-            "8. Тип DNS конфигурации (1 или 2)"
+            "8. Тип DNS конфигурации (1 или 2)\n"
+            "9. (необязательно) threads=N - сколько доменов аккаунта настраивать одновременно"
         )
         
-        try:
-            bot.send_message(chat_id, format_text)
-            bot.send_message(chat_id, explanation_text)
-        except Exception as e:
-            logger.error(f"Error sending format examples: {str(e)}")
+        outbox.send_message(chat_id, format_text)
+        outbox.send_message(chat_id, explanation_text)
     else:
         logger.warning(f"Access denied to user {user_id}")
-        try:
-            bot.send_message(chat_id, f"You don't have access to this bot. Contact admin {SUPER_ADMIN_TAG}.")
-        except Exception as e:
-            logger.error(f"Error sending access denied message: {str(e)}")
+        outbox.send_message(chat_id, f"You don't have access to this bot. Contact admin {SUPER_ADMIN_TAG}.")
 
 @bot.message_handler(func=lambda message: not message.text.startswith('/'), content_types=['text'])
 def process_text(message):
@@ -896,7 +3892,7 @@ def process_text(message):
     
     if not check_access(user_id):
         logger.warning(f"User {user_id} tried to send data without access")
-        bot.reply_to(message, f"You don't have access to this bot. Contact admin {SUPER_ADMIN_TAG}.")
+        outbox.reply_to(message, f"You don't have access to this bot. Contact admin {SUPER_ADMIN_TAG}.")
         return
     
     text = message.text.strip()
@@ -905,28 +3901,107 @@ def process_text(message):
         return
     
     logger.info(f"Processing data from user {user_id}")
+    enqueue_task(message, text)
+
+def save_upload(document):
+    """Stream an uploaded document to UPLOAD_DIR without holding it in memory"""
+    file_info = bot.get_file(document.file_id)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    extension = os.path.splitext(document.file_name or "")[1].lower()
+    file_path = os.path.join(UPLOAD_DIR, f"{document.file_unique_id}-{int(time.time() * 1000)}{extension}")
+    file_url = (telebot.apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(BOT_TOKEN, file_info.file_path)
+    with requests.get(file_url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        # The file holds API keys until its task is finished
+        with open(file_path, "wb", opener=lambda path, flags: os.open(path, flags, 0o600)) as upload:
+            for chunk in response.iter_content(64 * 1024):
+                upload.write(chunk)
+    return file_path
+
+upload_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, UPLOAD_WORKERS), thread_name_prefix="uploads")
+
+def queue_document(message):
+    """Download an uploaded configuration, estimate its cost and queue it (runs on upload_executor)"""
+    try:
+        file_path = save_upload(message.document)
+    except Exception as e:
+        logger.error(f"Error downloading document: {str(e)}")
+        outbox.reply_to(message, f"❌ Не удалось загрузить файл: {str(e)}")
+        return
+    
+    try:
+        enqueue_task(message, "", file_path)
+    except Exception as e:
+        logger.error(f"Error queueing document: {str(e)}")
+        logger.error(traceback.format_exc())
+        outbox.reply_to(message, f"❌ Не удалось поставить файл в очередь: {str(e)}")
+
+@bot.message_handler(content_types=['document'])
+def process_document(message):
+    user_id = message.from_user.id
+    document = message.document
+    
+    logger.info(f"Document received from user {user_id}: {document.file_name}")
+    
+    if not check_access(user_id):
+        logger.warning(f"User {user_id} tried to send a file without access")
+        outbox.reply_to(message, f"You don't have access to this bot. Contact admin {SUPER_ADMIN_TAG}.")
+        return
+    
+    if not (document.file_name or "").lower().endswith((".txt", ".csv")):
+        outbox.reply_to(message, "❌ Поддерживаются только файлы .txt и .csv.")
+        return
+    
+    if document.file_size and document.file_size > UPLOAD_MAX_BYTES:
+        outbox.reply_to(message, f"❌ Файл слишком большой (максимум {UPLOAD_MAX_BYTES // (1024 * 1024)} МБ).")
+        return
+    
+    # Скачивание и разбор большого файла не должны занимать поток приёма сообщений
+    outbox.reply_to(message, "📥 Файл получен, загружаю и считаю домены...")
+    upload_executor.submit(queue_document, message)
+
+def enqueue_task(message, text, file_path=None):
+    """Persist a submission (message text or uploaded file) and put it into the fair queue"""
+    user_id = message.from_user.id
+    chat_id = message.chat.id
     
-    # Проверяем, есть ли активная задача
+    # Проверяем, есть ли свободный обработчик
     with task_lock:
-        is_processing = current_processing
+        idle_workers = TASK_WORKERS - len(active_jobs)
+    
+    cost = estimate_task_cost(text, file_path)
     
-    # Добавляем задачу в очередь
-    task_queue.put((user_id, chat_id, text, message.message_id))
+    # Сохраняем задачу, чтобы она пережила перезапуск бота, и добавляем в очередь
+    try:
+        job_id = job_store.add_job(user_id, chat_id, text, message.message_id, file_path)
+    except Exception as e:
+        logger.error(f"Error saving job: {str(e)}")
+        job_id = None
+    task = (job_id, user_id, chat_id, text, message.message_id, file_path)
+    task_queue.put(task, user_id, cost)
     
-    position = task_queue.qsize()
+    # Место в очереди зависит от справедливого планировщика, а не от порядка поступления
+    plan = queue_schedule()
+    position, wait = next(
+        ((index + 1, start) for index, (queued, _, _, start) in enumerate(plan) if queued is task),
+        (0, 0.0)
+    )
     
-    # Если уже есть активная задача или в очереди есть другие задачи, сообщаем о ждущем статусе
-    if is_processing or position > 1:
+    # Если все обработчики заняты, сообщаем о ждущем статусе
+    if position > idle_workers:
         # Сохраняем информацию о сообщении пользователя
         if user_id not in waiting_users:
             waiting_users[user_id] = {}
         waiting_users[user_id][message.message_id] = time.time()
         
-        wait_message = f"⏳ Ваша задача добавлена в очередь (позиция: {position}). Пожалуйста, ожидайте."
-        bot.reply_to(message, wait_message)
+        wait_message = (
+            f"⏳ Ваша задача добавлена в очередь (позиция: {position}, доменов: {cost}, "
+            f"начало через {format_wait(wait)}). Пожалуйста, ожидайте."
+        )
+        outbox.reply_to(message, wait_message)
     else:
         # Если очередь была пуста, сообщаем что задача сразу начала выполняться
-        bot.reply_to(message, "✅ Ваша задача начала обрабатываться.")
+        outbox.reply_to(message, "✅ Ваша задача начала обрабатываться.")
 
 # Функция для проверки статуса очереди
 @bot.message_handler(commands=['status'])
@@ -934,16 +4009,25 @@ def check_queue_status(message):
     user_id = message.from_user.id
     
     if not check_access(user_id):
-        bot.reply_to(message, f"You don't have access to this bot. Contact admin {SUPER_ADMIN_TAG}.")
+        outbox.reply_to(message, f"You don't have access to this bot. Contact admin {SUPER_ADMIN_TAG}.")
         return
     
     with task_lock:
-        is_processing = current_processing
+        jobs = [(worker, dict(job)) for worker, job in sorted(active_jobs.items())]
     
     queue_size = task_queue.qsize()
     
-    if is_processing:
-        status = "⚙️ Бот сейчас обрабатывает задачу."
+    if jobs:
+        status = f"⚙️ Активных задач: {len(jobs)}/{TASK_WORKERS}"
+        now = time.time()
+        for worker, job in jobs:
+            status += (
+                f"\n• {worker}: задача {job['job_id']}, пользователь {job['user_id']}, "
+                f"аккаунты {job['accounts_done']}/{job['accounts_total']}, "
+                f"{int(now - job['started'])} с"
+            )
+            if job["current_accounts"]:
+                status += f" ({', '.join(sorted(job['current_accounts']))})"
     else:
         status = "✅ Бот не занят в данный момент."
     
@@ -952,16 +4036,181 @@ def check_queue_status(message):
     else:
         status += "\n📋 Очередь пуста."
     
-    if user_id in waiting_users and waiting_users[user_id]:
-        status += f"\n⏳ У вас {len(waiting_users[user_id])} задач в очереди."
+    own = [
+        (index + 1, cost, start)
+        for index, (_, owner, cost, start) in enumerate(queue_schedule()) if owner == user_id
+    ]
+    if own:
+        status += f"\n⏳ У вас {len(own)} задач в очереди:"
+        for position, cost, start in own:
+            status += f"\n• позиция {position}, доменов: {cost}, начало через {format_wait(start)}"
+    
+    # Админам показываем, упираются ли аккаунты в лимит запросов Cloudflare
+    if WHITELIST.get(user_id) in ["admin", "super-admin"]:
+        io_stats = io_scheduler.stats()
+        status += (
+            f"\n\n🧵 Запросы к Cloudflare: выполняется {io_stats['running']}/{io_stats['max_workers']}, "
+            f"в очереди {io_stats['queued']}, загрузка {io_stats['busy_ratio'] * 100:.0f}%"
+        )
+        recent = {
+            login: stats for login, stats in rate_limiter.stats().items()
+            if time.time() - stats["last_used"] < 600
+        }
+        if recent:
+            status += "\n\n⏱ Ожидание лимита Cloudflare (последние 10 мин):"
+            for login, stats in sorted(recent.items()):
+                status += (
+                    f"\n• {login}: {stats['requests']} запросов, "
+                    f"ожидание {stats['waited']:.1f} с (макс. {stats['max_wait']:.1f} с), 429: {stats['throttled']}"
+                )
     
-    bot.reply_to(message, status)
+    outbox.reply_to(message, status)
 
-# Функция для обработки задач в очереди
-def task_processor():
-    global current_processing
+def format_metrics_summary():
+    """Short text version of the metrics for the /metrics command"""
+    def latency(buckets, total, count):
+        p95 = metrics.quantile(buckets, count, 0.95)
+        p95_text = f"≤{p95 * 1000:.0f}" if p95 != float("inf") else f">{metrics.buckets[-1] * 1000:.0f}"
+        return f"ср. {total / count * 1000:.0f} мс, p95 {p95_text} мс"
+    
+    lines = ["📈 Метрики с момента запуска"]
+    
+    # Cloudflare: запросы, ошибки и 429 по эндпоинтам
+    calls = {}
+    for labels, value in metrics.counters("cf_requests_total").items():
+        labels = dict(labels)
+        key = (labels["method"], labels["endpoint"])
+        total, errors, throttled = calls.get(key, (0, 0, 0))
+        status = str(labels["status"])
+        calls[key] = (
+            total + value,
+            errors + (value if not status.startswith("2") else 0),
+            throttled + (value if status == "429" else 0)
+        )
+    if calls:
+        lines.append("\n☁️ Cloudflare:")
+        endpoint_latency = metrics.histograms("cf_request_seconds", "method", "endpoint")
+        for (method, endpoint), (total, errors, throttled) in sorted(calls.items(), key=lambda item: -item[1][0])[:10]:
+            line = f"• {method} {endpoint}: {total} запросов, ошибок {errors}, 429: {throttled}"
+            histogram = endpoint_latency.get((method, endpoint))
+            if histogram and histogram[2]:
+                line += f", {latency(*histogram)}"
+            lines.append(line)
+        waits = metrics.histograms("cf_rate_limit_wait_seconds").get(())
+        if waits and waits[1]:
+            lines.append(f"⏱ Ожидание лимита запросов: {waits[1]:.1f} с всего")
+    
+    telegram = {}
+    for labels, value in metrics.counters("telegram_requests_total").items():
+        status = str(dict(labels)["status"])
+        telegram[status] = telegram.get(status, 0) + value
+    if telegram:
+        lines.append("\n✉️ Telegram: " + ", ".join(f"{status}: {value}" for status, value in sorted(telegram.items())))
+        histogram = metrics.histograms("telegram_request_seconds").get(())
+        if histogram and histogram[2]:
+            lines.append(f"• {latency(*histogram)}")
+    
+    stages = metrics.histograms("domain_stage_seconds", "stage")
+    if stages:
+        lines.append("\n🧩 Этапы обработки домена:")
+        for (stage,), histogram in sorted(stages.items()):
+            lines.append(f"• {stage}: {histogram[2]} раз, {latency(*histogram)}")
+    
+    io_stats = io_scheduler.stats()
+    with task_lock:
+        active = len(active_jobs)
+    lines.append(
+        f"\n📋 Очередь: {task_queue.qsize()} задач, обработчиков занято {active}/{TASK_WORKERS}, "
+        f"запросов к Cloudflare выполняется {io_stats['running']} (в очереди {io_stats['queued']}), "
+        f"сообщений Telegram в очереди {outbox.pending()}"
+    )
+    return "\n".join(lines)
+
+@bot.message_handler(commands=['metrics'])
+def metrics_command(message):
+    user_id = message.from_user.id
+    
+    if WHITELIST.get(user_id) in ["admin", "super-admin"]:
+        try:
+            outbox.reply_to(message, format_metrics_summary())
+        except Exception as e:
+            outbox.reply_to(message, f"❌ Error getting metrics: {str(e)}")
+            logger.error(f"Error in metrics command: {str(e)}")
+    else:
+        outbox.reply_to(message, f"❌ You don't have permissions to view metrics. Contact {SUPER_ADMIN_TAG}")
+
+@bot.message_handler(commands=['trace'])
+def trace_command(message):
+    user_id = message.from_user.id
     
+    if WHITELIST.get(user_id) not in ["admin", "super-admin"]:
+        outbox.reply_to(message, f"❌ You don't have permissions to view traces. Contact {SUPER_ADMIN_TAG}")
+        return
+    
+    command_parts = message.text.split()
+    if len(command_parts) < 2:
+        # Без номера задачи показываем последние трассировки
+        traces = []
+        if os.path.isdir(TRACE_DIR):
+            traces = sorted(
+                (name for name in os.listdir(TRACE_DIR) if name.startswith("job-") and name.endswith(".jsonl")),
+                key=lambda name: os.path.getmtime(os.path.join(TRACE_DIR, name)),
+                reverse=True
+            )[:10]
+        listing = "\n".join(f"• {name[len('job-'):-len('.jsonl')]}" for name in traces) or "нет"
+        outbox.reply_to(message, f"❌ Invalid command format. Use: /trace JOB_ID\n\nПоследние задачи:\n{listing}")
+        return
+    
+    job_id = command_parts[1]
+    path = trace_path(job_id)
+    if not re.match(r'^[\w-]+$', job_id) or not os.path.isfile(path):
+        outbox.reply_to(message, f"❌ Trace for job {job_id} not found")
+        return
+    
+    try:
+        with open(path, "rb") as trace_file:
+            document = io.BytesIO(trace_file.read())
+        document.name = os.path.basename(path)
+        outbox.send_document(message.chat.id, document, caption=f"🧭 Trace of job {job_id}")
+    except Exception as e:
+        outbox.reply_to(message, f"❌ Error reading trace: {str(e)}")
+        logger.error(f"Error in trace command: {str(e)}")
+
+def run_account(account, chat_id, worker_name, board=None, checkpoints=None):
+    """setup_zones wrapper for the account pool: one failing account must not drop the others"""
+    # The watchdog drops the job of a worker it gave up on, so bookkeeping is skipped once it is gone
+    with task_lock:
+        job = active_jobs.get(worker_name)
+        if job is not None:
+            job["current_accounts"].add(account["login"])
+    try:
+        with span("account", login=account["login"], domains=len(account["domains"])) as account_span:
+            account_info = setup_zones(account, chat_id, board=board, checkpoints=checkpoints)
+            if account_span is not None and account_info["errors"]:
+                account_span.status = "error"
+            return account_info
+    except Exception as e:
+        logger.error(f"Error processing account {account['login']}: {str(e)}")
+        logger.error(traceback.format_exc())
+        return {
+            "login": account["login"],
+            "ns_servers": [],
+            "errors": [f"❌ Error processing account {account['login']}: {str(e)}"],
+            "domains": []
+        }
+    finally:
+        with task_lock:
+            job = active_jobs.get(worker_name)
+            if job is not None:
+                job["current_accounts"].discard(account["login"])
+                job["accounts_done"] += 1
+
+# Функция для обработки задач в очереди
+def task_processor(worker_name):
     while True:
+        if worker_name in abandoned_workers:
+            logger.warning(f"{worker_name}: returned after being replaced by the watchdog, exiting")
+            break
         try:
             # Получаем задачу из очереди
             task = task_queue.get()
@@ -969,77 +4218,274 @@ def task_processor():
             if task is None:  # Сигнал для завершения потока
                 task_queue.task_done()
                 break
-                
-            with task_lock:
-                current_processing = True
             
             # Распаковываем данные задачи
-            user_id, chat_id, text, message_id = task
+            job_id, user_id, chat_id, text, message_id, file_path = task
             
-            logger.info(f"Starting queued task for user {user_id}")
+            with task_lock:
+                active_jobs[worker_name] = {
+                    "job_id": job_id,
+                    "user_id": user_id,
+                    "chat_id": chat_id,
+                    "started": time.time(),
+                    "accounts_total": 0,
+                    "accounts_done": 0,
+                    "cost": 0,
+                    "current_accounts": set()
+                }
             
-            # Уведомляем пользователя, что его задача начала выполняться
+            logger.info(f"{worker_name}: starting queued task {job_id} for user {user_id}")
+            job_status = "failed"
+            task_span = open_task_trace(job_id, user_id=user_id, worker=worker_name)
+            span_token = current_span.set(task_span)
+            deadline_token = current_deadline.set(time.monotonic() + TASK_TIMEOUT)
             try:
-                if message_id in waiting_users.get(user_id, {}):
-                    del waiting_users[user_id][message_id]
-                    
-                bot.send_message(
-                    chat_id, 
-                    "✅ Ваша задача началась обрабатываться."
-                )
+                job_store.set_status(job_id, "running")
             except Exception as e:
-                logger.error(f"Error sending start notification: {str(e)}")
+                logger.error(f"Error updating job {job_id}: {str(e)}")
+            
+            # Уведомляем пользователя, что его задача начала выполняться
+            if message_id in waiting_users.get(user_id, {}):
+                del waiting_users[user_id][message_id]
+            outbox.send_message(chat_id, "✅ Ваша задача началась обрабатываться.")
             
             # Выполняем обработку задачи
             try:
-                accounts = parse_input_text(text)
+                # Аккаунты разбираются по мере чтения: большой файл начинает обрабатываться сразу
+                accounts = task_accounts(text, file_path)
+                first_account = next(accounts, None)
                 
-                if not accounts:
-                    bot.send_message(chat_id, "❌ Could not recognize data format. Check your input.")
+                if first_account is None:
+                    outbox.send_message(chat_id, "❌ Could not recognize data format. Check your input.")
+                    job_status = "invalid"
                     continue
                 
-                all_accounts_info = []
+                # Ключи, IP и домены проверяются по ходу чтения, каждый аккаунт до того, как тронет свои зоны
+                preflight = TaskPreflight() if PREFLIGHT_ENABLED else None
+                indexed = itertools.chain([first_account], accounts)
+                indexed = preflight.run(indexed) if preflight is not None else ((index, account, None) for index, account in enumerate(indexed))
                 
-                for account in accounts:
-                    time.sleep(2)
-                    setup_zones(account, chat_id, all_accounts_info)
+                # Общий прогресс-дашборд задачи открывается с первым запущенным аккаунтом
+                board = None
                 
+                # Аккаунты независимы (у каждого свой лимит запросов), поэтому обрабатываем их параллельно.
+                # Вперёд разбираем не больше, чем пул может взять, чтобы память не зависела от размера файла
+                width = max(1, ACCOUNT_CONCURRENCY)
+                all_accounts_info = []
+                try:
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=width, thread_name_prefix=f"{worker_name}-accounts") as executor:
+                        pending = deque()
+                        for index, account, skip_reason in indexed:
+                            if skip_reason is not None:
+                                # Пропущенный аккаунт попадает в итог на своём месте
+                                skipped = concurrent.futures.Future()
+                                skipped.set_result({"login": account["login"], "skipped": skip_reason, "errors": [skip_reason], "ns_servers": []})
+                                pending.append(skipped)
+                                continue
+                            with task_lock:
+                                job = active_jobs.get(worker_name)
+                                if job is not None:
+                                    job["accounts_total"] += 1
+                                    job["cost"] += len(account["domains"])
+                            if board is None:
+                                board = progress_renderer.open(chat_id, [])
+                            progress_renderer.update(board, account["login"], total=len(account["domains"]))
+                            pending.append(executor.submit(
+                                with_context(run_account), account, chat_id, worker_name, board, job_checkpoints(job_id, index)
+                            ))
+                            while len(pending) >= 2 * width:
+                                all_accounts_info.append(pending.popleft().result())
+                        
+                        # Всё прочитано: сообщаем о найденных проблемах, пока запущенные аккаунты доделываются
+                        if preflight is not None and worker_name not in abandoned_workers:
+                            outbox.send_message(chat_id, format_preflight(preflight.plan))
+                        all_accounts_info.extend(future.result() for future in pending)
+                finally:
+                    # Закрывает и временную базу проверки, если разбор прервался ошибкой
+                    indexed.close()
+                    if board is not None:
+                        progress_renderer.close(board)
+                
+                # Сторож уже сообщил пользователю о тайм-ауте: поздний итог только запутает
+                if worker_name in abandoned_workers:
+                    job_status = "timed_out"
+                    continue
+                if preflight is not None and not preflight.plan["runnable"]:
+                    job_status = "invalid"
+                    continue
                 send_final_summary(chat_id, all_accounts_info)
+                job_status = "done"
                 
             except Exception as e:
                 logger.error(f"Error processing message: {str(e)}")
                 logger.error(traceback.format_exc())
-                bot.send_message(chat_id, f"❌ Error processing data: {str(e)}")
+                if worker_name not in abandoned_workers:
+                    outbox.send_message(chat_id, f"❌ Error processing data: {str(e)}")
             
             finally:
                 # Отмечаем задачу как выполненную
                 task_queue.task_done()
                 
+                metrics.inc("tasks_total", status=job_status)
+                current_deadline.reset(deadline_token)
+                current_span.reset(span_token)
+                if task_span is not None:
+                    task_span.attrs["job_status"] = job_status
+                    task_span.finish("ok" if job_status == "done" else "error")
+                    task_span.trace.close()
+                # A task the watchdog gave up on is already closed as timed out
+                if worker_name not in abandoned_workers:
+                    try:
+                        job_store.set_status(job_id, job_status)
+                    except Exception as e:
+                        logger.error(f"Error updating job {job_id}: {str(e)}")
+                
+                if file_path:
+                    try:
+                        os.remove(file_path)
+                    except OSError as e:
+                        logger.error(f"Error removing upload {file_path}: {str(e)}")
+                
                 with task_lock:
-                    current_processing = False
+                    job = active_jobs.pop(worker_name, None)
+                if job and job_status == "done":
+                    task_queue.observe(job["cost"], time.time() - job["started"])
                 
-                logger.info(f"Completed task for user {user_id}, queue size: {task_queue.qsize()}")
+                logger.info(f"{worker_name}: completed task for user {user_id}, queue size: {task_queue.qsize()}")
                 
         except Exception as e:
-            logger.error(f"Error in task processor: {str(e)}")
+            logger.error(f"Error in task processor {worker_name}: {str(e)}")
             logger.error(traceback.format_exc())
             time.sleep(5)  # Пауза перед следующей попыткой
 
-# Функция для инициализации обработчика очереди
+class TaskWatchdog:
+    """Replaces queue workers stuck past TASK_TIMEOUT, so one hung call cannot freeze the queue.
+
+    Deadlines normally end a task in time; this handles a call that never returns. A Python
+    thread cannot be killed, so the stuck worker is marked abandoned, its job is closed as timed
+    out and the user told, and a fresh worker takes its place.
+    """
+    
+    def __init__(self, threads, interval=WATCHDOG_INTERVAL):
+        self.threads = threads
+        self.interval = interval
+        self._replacements = itertools.count(1)
+        self._thread = None
+        self._next_purge = time.monotonic() + JOB_PURGE_INTERVAL
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="task-watchdog", daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Error in task watchdog: {str(e)}")
+            # Expired jobs and traces go on a long-running bot as well, not only at startup
+            if time.monotonic() >= self._next_purge:
+                self._next_purge = time.monotonic() + JOB_PURGE_INTERVAL
+                try:
+                    job_store.purge()
+                    purge_traces()
+                except Exception as e:
+                    logger.error(f"Error purging old jobs: {str(e)}")
+    
+    def check(self):
+        now = time.time()
+        with task_lock:
+            stuck = [
+                (worker, job) for worker, job in active_jobs.items()
+                if now - job["started"] > TASK_TIMEOUT + WATCHDOG_GRACE
+            ]
+            for worker, _ in stuck:
+                active_jobs.pop(worker, None)
+                abandoned_workers.add(worker)
+        
+        for worker, job in stuck:
+            logger.error(f"{worker}: task {job['job_id']} is stuck after {int(now - job['started'])}s, replacing the worker")
+            metrics.inc("watchdog_abandoned_total", scope="task")
+            try:
+                job_store.set_status(job["job_id"], "timed_out")
+            except Exception as e:
+                logger.error(f"Error updating job {job['job_id']}: {str(e)}")
+            outbox.send_message(
+                job["chat_id"],
+                f"⏱ Задача {job['job_id']} превысила лимит времени ({int(TASK_TIMEOUT // 60)} мин) и была остановлена. "
+                f"Остальные задачи в очереди продолжают обрабатываться."
+            )
+            
+            worker_name = f"worker-r{next(self._replacements)}"
+            processor_thread = threading.Thread(target=task_processor, args=(worker_name,), name=worker_name, daemon=True)
+            processor_thread.start()
+            self.threads.append(processor_thread)
+
+# Функция для инициализации обработчиков очереди
 def init_task_queue():
-    # Запускаем поток обработки задач
-    processor_thread = threading.Thread(target=task_processor, daemon=True)
-    processor_thread.start()
-    logger.info("Task queue processor started")
-    return processor_thread
+    # Запускаем пул потоков обработки задач
+    processor_threads = []
+    for index in range(max(1, TASK_WORKERS)):
+        worker_name = f"worker-{index + 1}"
+        processor_thread = threading.Thread(target=task_processor, args=(worker_name,), name=worker_name, daemon=True)
+        processor_thread.start()
+        processor_threads.append(processor_thread)
+    logger.info(f"Task queue processors started: {len(processor_threads)}")
+    TaskWatchdog(processor_threads).start()
+    return processor_threads
+
+def resume_jobs():
+    """Re-queue jobs left unfinished by the previous run; their finished domains are not redone"""
+    try:
+        job_store.purge()
+        purge_traces()
+        jobs = job_store.unfinished_jobs()
+    except Exception as e:
+        logger.error(f"Error loading unfinished jobs: {str(e)}")
+        return 0
+    
+    for job in jobs:
+        task_queue.put(
+            (job["id"], job["user_id"], job["chat_id"], job["text"], job["message_id"], job["file_path"]),
+            job["user_id"], estimate_task_cost(job["text"], job["file_path"])
+        )
+        waiting_users.setdefault(job["user_id"], {})[job["message_id"]] = time.time()
+        outbox.send_message(
+            job["chat_id"],
+            "🔄 Бот был перезапущен. Ваша задача возобновлена, уже обработанные домены повторно не настраиваются."
+        )
+    
+    if jobs:
+        logger.info(f"Resumed {len(jobs)} unfinished jobs")
+    return len(jobs)
+
+def stop_task_queue(processor_threads):
+    # Один сигнал остановки на каждый живой поток (брошенные сторожем потоки сигнал не заберут)
+    processor_threads = [thread for thread in processor_threads if thread.name not in abandoned_workers]
+    for _ in processor_threads:
+        task_queue.put(None)
+    for processor_thread in processor_threads:
+        processor_thread.join(timeout=5)
 
 # Измененный основной блок
 if __name__ == "__main__":
     logger.info("=== BOT STARTING ===")
     logger.info(f"Current whitelist: {WHITELIST}")
     
-    # Инициализируем обработчик очереди
-    queue_thread = init_task_queue()
+    # Без aiohttp движок asyncio ничего не даёт: лучше не стартовать, чем молча работать медленно
+    if CF_ENGINE == "asyncio":
+        try:
+            check_async_transport()
+        except RuntimeError as e:
+            logger.critical(str(e))
+            sys.exit(str(e))
+    
+    start_metrics_server()
+    
+    # Возобновляем задачи, прерванные прошлым запуском, и запускаем обработчики очереди
+    resume_jobs()
+    queue_threads = init_task_queue()
     
     try:
         while True:
@@ -1052,14 +4498,13 @@ if __name__ == "__main__":
                 time.sleep(10)  # Pause before restarting
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
-        # Отправляем сигнал для остановки потока обработки
-        task_queue.put(None)
-        queue_thread.join(timeout=5)
+        # Отправляем сигнал для остановки потоков обработки
+        stop_task_queue(queue_threads)
     except Exception as e:
         logger.critical(f"Critical error: {str(e)}")
         logger.critical(traceback.format_exc())
     finally:
-        # Убедимся, что поток обработки остановлен
-        task_queue.put(None)
-        queue_thread.join(timeout=5)
+        # Убедимся, что потоки обработки остановлены
+        stop_task_queue(queue_threads)
+        async_engine.stop()
         logger.info("=== BOT SHUTDOWN ===")
\ No newline at end of file
@@ -0,0 +1,70 @@
+"""Import main.py once for all tests, with its files (bot.log, jobs.db, traces) in a scratch directory.
+
+main.py reads its configuration at import time, so the environment is set up before the import.
+stub_client gives a CloudflareClient whose HTTP session is a StubSession fed with canned responses.
+"""
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORKDIR = tempfile.mkdtemp(prefix="cf-bot-tests-")
+os.environ.setdefault("BOT_TOKEN", "0:tests")
+os.environ.setdefault("WHITELIST", "1:user,2:user,3:admin")
+os.environ["JOB_DB_PATH"] = os.path.join(WORKDIR, "jobs.db")
+os.environ["TRACE_DIR"] = os.path.join(WORKDIR, "traces")
+os.environ["UPLOAD_DIR"] = os.path.join(WORKDIR, "uploads")
+os.environ["DNS_TEMPLATES_PATH"] = os.path.join(ROOT, "dns_templates.json")
+
+_cwd = os.getcwd()
+os.chdir(WORKDIR)
+try:
+    import main
+finally:
+    os.chdir(_cwd)
+
+
+def cf_response(status=200, body=None, headers=None):
+    """A requests.Response as Cloudflare would send it"""
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps({"success": status < 400, "errors": [], "result": {}} if body is None else body).encode()
+    response.headers.update(headers or {})
+    return response
+
+
+class StubSession:
+    """Stands in for a requests.Session: returns (or raises) the queued outcomes in order and records the calls"""
+
+    def __init__(self):
+        self.outcomes = []
+        self.calls = []
+        self.closed = False
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url))
+        outcome = self.outcomes.pop(0) if self.outcomes else cf_response()
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def stub_client(monkeypatch):
+    """A CloudflareClient on a StubSession, with no retry backoff, no rate limit and a fresh breaker"""
+    session = StubSession()
+    client = main.CloudflareClient(base_url="https://cf.test/client/v4", limiter=main.RateLimiter(limit=10 ** 6, window=1, burst=1000))
+    client._new_session = lambda login, api_key: session
+    monkeypatch.setattr(main, "CF_RETRY_BASE", 0.0)
+    monkeypatch.setattr(main, "credential_breaker", main.CredentialBreaker(threshold=3, cooldown=60))
+    client.stub = session
+    return client
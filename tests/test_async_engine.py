@@ -0,0 +1,19 @@
+"""Asyncio engine: its HTTP client must be available rather than silently replaced"""
+import pytest
+
+import main
+
+
+def test_missing_aiohttp_is_an_error(monkeypatch):
+    monkeypatch.setattr(main, "aiohttp", None)
+    with pytest.raises(RuntimeError, match="aiohttp"):
+        main.check_async_transport("aiohttp")
+    with pytest.raises(RuntimeError):
+        main.AsyncCloudflareClient("aiohttp")
+    # Blocking requests in a thread pool is an explicit choice, not a fallback
+    assert main.AsyncCloudflareClient("requests").transport == "requests"
+
+
+def test_unknown_transport_is_an_error():
+    with pytest.raises(RuntimeError, match="CF_ASYNC_HTTP"):
+        main.check_async_transport("httpx")
@@ -0,0 +1,102 @@
+"""CloudflareClient: which failures are retried, and the per-credential circuit breaker"""
+import pytest
+import requests
+
+import main
+from conftest import StubSession, cf_response
+
+AUTH_ERROR = {"success": False, "errors": [{"code": 10000, "message": "Authentication error"}]}
+RECORD_ERROR = {"success": False, "errors": [{"code": 81057, "message": "Record already exists."}]}
+
+
+def test_get_is_retried_after_a_server_error(stub_client):
+    stub_client.stub.outcomes = [cf_response(502), requests.ReadTimeout("slow"), cf_response(200)]
+    assert stub_client.get("a", "k", "/zones").status_code == 200
+    assert len(stub_client.stub.calls) == 3
+
+
+def test_retries_are_limited(stub_client, monkeypatch):
+    monkeypatch.setattr(main, "CF_RETRIES", 2)
+    stub_client.stub.outcomes = [cf_response(503)] * 5
+    assert stub_client.get("a", "k", "/zones").status_code == 503
+    assert len(stub_client.stub.calls) == 3
+
+
+def test_post_is_not_resent_when_it_may_have_been_applied(stub_client):
+    stub_client.stub.outcomes = [cf_response(502)]
+    assert stub_client.post("a", "k", "/zones", json={"name": "example.com"}).status_code == 502
+    stub_client.stub.outcomes = [requests.ReadTimeout("slow")]
+    with pytest.raises(requests.ReadTimeout):
+        stub_client.post("a", "k", "/zones", json={"name": "example.com"})
+    assert len(stub_client.stub.calls) == 2
+
+
+def test_post_is_resent_when_it_never_reached_cloudflare(stub_client):
+    stub_client.stub.outcomes = [requests.ConnectTimeout("no connection"), cf_response(200)]
+    assert stub_client.post("a", "k", "/zones", json={"name": "example.com"}).status_code == 200
+    assert len(stub_client.stub.calls) == 2
+
+
+def test_post_marked_idempotent_is_retried(stub_client):
+    stub_client.stub.outcomes = [cf_response(500), cf_response(200)]
+    assert stub_client.post("a", "k", "/zones/z/dns_records/batch", idempotent=True).status_code == 200
+    assert len(stub_client.stub.calls) == 2
+
+
+def test_client_errors_are_not_retried(stub_client):
+    stub_client.stub.outcomes = [cf_response(400, RECORD_ERROR)]
+    assert stub_client.get("a", "k", "/zones").status_code == 400
+    assert len(stub_client.stub.calls) == 1
+
+
+def test_rejected_key_opens_the_breaker(stub_client):
+    stub_client.stub.outcomes = [cf_response(403, AUTH_ERROR)] * 3
+    for _ in range(3):
+        assert stub_client.get("a", "k", "/zones").status_code == 403
+    with pytest.raises(main.CircuitOpenError):
+        stub_client.get("a", "k", "/zones")
+    assert len(stub_client.stub.calls) == 3
+    # Other credentials are not affected
+    assert stub_client.get("b", "k", "/zones").status_code == 200
+
+
+def test_breaker_counts_auth_failures_until_a_call_succeeds():
+    breaker = main.CredentialBreaker(threshold=3, cooldown=60)
+    for outcome in ("auth", "auth", "ok", "auth", "auth"):
+        breaker.record("a", "k", outcome)
+    assert not breaker.is_open("a", "k")
+    breaker.record("a", "k", "auth")
+    assert breaker.is_open("a", "k")
+
+
+def test_other_client_errors_do_not_reset_the_auth_streak():
+    breaker = main.CredentialBreaker(threshold=3, cooldown=60)
+    for outcome in ("auth", "fatal", "auth", "retry", "throttled", "fatal", "auth"):
+        breaker.record("a", "k", outcome)
+    assert breaker.is_open("a", "k")
+
+
+def test_breaker_closes_after_the_cooldown(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    breaker = main.CredentialBreaker(threshold=1, cooldown=60)
+    breaker.record("a", "k", "auth")
+    assert breaker.is_open("a", "k")
+    now[0] += 61
+    breaker.check("a", "k")
+    # Still failing after the cooldown: the next auth failure opens it again at once
+    breaker.record("a", "k", "auth")
+    assert breaker.is_open("a", "k")
+
+
+def test_evicted_session_is_not_closed_under_a_running_request():
+    sessions = []
+    client = main.CloudflareClient(max_sessions=2)
+    client._new_session = lambda login, api_key: sessions.append(StubSession()) or sessions[-1]
+    first = client.session("a", "k")
+    client.session("b", "k")
+    client.session("c", "k")
+    assert not first.closed
+    # The evicted account gets a fresh session on its next call
+    assert client.session("a", "k") is not first
+    assert len(sessions) == 4
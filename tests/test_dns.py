@@ -0,0 +1,80 @@
+"""DNS reconciliation: diffing the wanted record set against what the zone already has"""
+import main
+
+
+DOMAIN = "example.com"
+
+
+def zone_records(records, domain=DOMAIN):
+    """Records as Cloudflare lists them: fully qualified names and an id each"""
+    existing = []
+    for index, record in enumerate(records):
+        payload = main.dns_record_payload(record, domain)
+        payload["name"] = main.normalize_record_name(payload["name"], domain)
+        payload["id"] = f"rec{index}"
+        existing.append(payload)
+    return existing
+
+
+def build(config_type, ip_api_cdn="192.0.2.10", ip_www="192.0.2.20"):
+    return main.build_dns_records(config_type, DOMAIN, ip_api_cdn, ip_www)
+
+
+def test_configured_zone_needs_no_changes():
+    records = build(3)
+    unchanged, deletes, patches, posts = main.diff_dns_records(zone_records(records), records, DOMAIN)
+    assert (deletes, patches, posts) == ([], [], [])
+    assert len(unchanged) == len(records)
+
+
+def test_random_values_of_an_existing_zone_are_kept():
+    # A second build draws new random DMARC and verification values
+    existing = zone_records(build(3))
+    _, deletes, patches, posts = main.diff_dns_records(existing, build(3), DOMAIN)
+    assert (deletes, patches, posts) == ([], [], [])
+
+
+def test_match_prefix_does_not_match_other_content():
+    records = build(3)
+    existing = zone_records(records)
+    dmarc = next(record for record in existing if record["name"] == f"_dmarc.{DOMAIN}")
+    dmarc["content"] = "v=DMARC1; p=reject"
+    _, deletes, patches, posts = main.diff_dns_records(existing, records, DOMAIN)
+    assert deletes == [] and posts == []
+    assert [patch["id"] for patch in patches] == [dmarc["id"]]
+
+
+def test_changed_ip_is_patched_in_place():
+    existing = zone_records(build(1))
+    _, deletes, patches, posts = main.diff_dns_records(existing, build(1, ip_www="192.0.2.99"), DOMAIN)
+    assert deletes == [] and posts == []
+    assert sorted(patch["id"] for patch in patches) == ["rec2", "rec3"]
+    assert all(patch["content"] == "192.0.2.99" and patch["id"] for patch in patches)
+
+
+def test_extra_records_are_deleted_and_missing_ones_created():
+    records = build(1)
+    existing = zone_records(records[1:])
+    existing.append({"id": "junk", "type": "TXT", "name": f"old.{DOMAIN}", "content": "stale", "proxied": False})
+    _, deletes, patches, posts = main.diff_dns_records(existing, records, DOMAIN)
+    assert deletes == [{"id": "junk"}]
+    assert patches == []
+    assert posts == [main.dns_record_payload(records[0], DOMAIN)]
+
+
+def test_proxied_flag_is_part_of_the_identity():
+    records = build(1)
+    existing = zone_records(records)
+    existing[0]["proxied"] = False
+    _, deletes, patches, posts = main.diff_dns_records(existing, records, DOMAIN)
+    assert [patch["id"] for patch in patches] == ["rec0"] and deletes == [] and posts == []
+
+
+def test_record_comparison_normalises_cloudflare_formatting():
+    record = {"type": "MX", "name": "@", "content": "ASPMX.L.GOOGLE.COM", "priority": 1, "proxied": False}
+    listed = {"type": "MX", "name": "Example.com.", "content": "aspmx.l.google.com.", "priority": 1, "proxied": False}
+    assert main.dns_record_matches(listed, record, DOMAIN)
+    assert not main.dns_record_matches(dict(listed, priority=5), record, DOMAIN)
+
+    txt = {"type": "TXT", "name": "@", "content": "v=spf1 ~all", "proxied": False}
+    assert main.dns_record_matches({"type": "TXT", "name": DOMAIN, "content": '"v=spf1 ~all"'}, txt, DOMAIN)
@@ -0,0 +1,18 @@
+"""Batch DNS endpoint: splitting deletes, patches and posts into request bodies"""
+import main
+
+
+def test_chunk_dns_batch_keeps_delete_patch_post_order():
+    deletes = [{"id": f"d{i}"} for i in range(3)]
+    patches = [{"id": f"p{i}"} for i in range(2)]
+    posts = [{"name": f"n{i}"} for i in range(4)]
+    bodies = list(main.chunk_dns_batch(deletes, patches, posts, size=4))
+    assert bodies == [
+        {"deletes": deletes[:3], "patches": patches[:1]},
+        {"patches": patches[1:], "posts": posts[:3]},
+        {"posts": posts[3:]},
+    ]
+
+
+def test_chunk_dns_batch_without_changes_is_empty():
+    assert list(main.chunk_dns_batch([], [], [], size=10)) == []
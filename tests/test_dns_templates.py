@@ -0,0 +1,78 @@
+"""DNS record templates: validation, placeholders and extends"""
+import json
+
+import pytest
+
+import main
+
+
+DOMAIN = "example.com"
+
+
+def build(config_type, ip_api_cdn="192.0.2.10", ip_www="192.0.2.20"):
+    return main.build_dns_records(config_type, DOMAIN, ip_api_cdn, ip_www)
+
+
+def test_type_3_extends_type_1():
+    base = build(1)
+    full = build(3)
+    assert full[:len(base)] == base
+    assert {record["type"] for record in full[len(base):]} == {"MX", "TXT"}
+
+
+def test_build_fills_placeholders():
+    records = build(2)
+    partners = next(record for record in records if record["name"] == "partners")
+    assert partners == {"type": "CNAME", "name": "partners", "content": DOMAIN, "proxied": True}
+    assert all(record["content"] == "192.0.2.20" for record in records if record["type"] == "A")
+
+
+def test_random_placeholders_get_a_match_prefix():
+    records = build(3)
+    dmarc = next(record for record in records if record["name"] == "_dmarc")
+    verification = next(record for record in records if record["content"].startswith("google-site-verification="))
+    assert dmarc["match_prefix"] == "v=DMARC1; p=none; rua=mailto:dmarc@"
+    assert verification["match_prefix"] == "google-site-verification="
+    assert all("match_prefix" not in record for record in records if record["type"] != "TXT")
+
+
+def test_unproxiable_types_are_never_proxied():
+    template = main.DnsTemplate(9, [{"type": "MX", "name": "@", "content": "mx.{domain}", "priority": 5, "proxied": True}])
+    assert template.build(DOMAIN, "", "")[0]["proxied"] is False
+
+
+@pytest.mark.parametrize("spec", [
+    {"type": "SRV", "name": "@", "content": "x"},
+    {"type": "MX", "name": "@", "content": "mx.example.com"},
+    {"type": "A", "name": "@", "content": "{unknown}"},
+    {"type": "A", "name": "@", "content": "{ip_www!r}"},
+])
+def test_invalid_templates_are_rejected(spec):
+    with pytest.raises(ValueError):
+        main.DnsTemplate(9, [spec])
+
+
+def test_literal_braces_survive_compilation():
+    template = main.DnsTemplate(9, [{"type": "TXT", "name": "@", "content": "{{literal}} {domain}"}])
+    assert template.build(DOMAIN, "", "")[0]["content"] == "{literal} example.com"
+
+
+def test_load_dns_templates_resolves_extends(tmp_path):
+    path = tmp_path / "templates.json"
+    path.write_text(json.dumps({
+        "1": {"records": [{"type": "A", "name": "@", "content": "{ip_www}"}]},
+        "2": {"extends": "1", "records": [{"type": "A", "name": "www", "content": "{ip_www}"}]},
+    }))
+    templates = main.load_dns_templates(str(path))
+    assert [record["name"] for record in templates[2].build(DOMAIN, "", "192.0.2.1")] == ["@", "www"]
+
+
+@pytest.mark.parametrize("specs", [
+    {"1": {"extends": "5", "records": []}},
+    {"1": {"extends": "2", "records": []}, "2": {"extends": "1", "records": []}},
+])
+def test_load_dns_templates_rejects_broken_extends(tmp_path, specs):
+    path = tmp_path / "templates.json"
+    path.write_text(json.dumps(specs))
+    with pytest.raises(ValueError):
+        main.load_dns_templates(str(path))
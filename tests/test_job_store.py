@@ -0,0 +1,119 @@
+"""Durable jobs: the SQLite job store, per-domain checkpoints and resuming unfinished jobs"""
+import os
+import stat
+import threading
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def store(tmp_path):
+    return main.JobStore(str(tmp_path / "jobs.db"))
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_database_files_are_private(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    # Left behind world-readable by an older version
+    for name in (path, f"{path}-wal"):
+        with open(name, "wb"):
+            pass
+        os.chmod(name, 0o644)
+    umask = os.umask(0o022)
+    try:
+        store = main.JobStore(path)
+        store.add_job(1, 1, "login\nkey", 10)
+    finally:
+        os.umask(umask)
+    assert {name: mode(name) for name in (path, f"{path}-wal", f"{path}-shm")} == {
+        path: 0o600, f"{path}-wal": 0o600, f"{path}-shm": 0o600
+    }
+
+
+def test_finished_jobs_drop_their_credentials(store):
+    first = store.add_job(1, 100, "login\nkey-1", 10)
+    second = store.add_job(2, 200, "", 11, file_path="/tmp/upload.txt")
+    store.set_status(first, "running")
+    assert [(job["id"], job["status"], job["text"]) for job in store.unfinished_jobs()] == [
+        (first, "running", "login\nkey-1"), (second, "queued", "")
+    ]
+    store.set_status(first, "done")
+    assert [job["id"] for job in store.unfinished_jobs()] == [second]
+    text = store._conn.execute("SELECT text FROM jobs WHERE id = ?", (first,)).fetchone()[0]
+    assert text is None
+
+
+def test_purge_removes_old_finished_jobs_only(store):
+    old = store.add_job(1, 1, "a", 1)
+    store.save_checkpoint(old, 0, "example.com", {"stages": ["zone"]})
+    store.set_status(old, "done")
+    queued = store.add_job(1, 1, "b", 2)
+    store.purge(older_than=-1)
+    ids = [row[0] for row in store._conn.execute("SELECT id FROM jobs")]
+    assert ids == [queued]
+    assert store.load_checkpoints(old, 0) == {}
+
+
+def test_checkpoints_round_trip(store):
+    job_id = store.add_job(1, 1, "a", 1)
+    checkpoints = main.DomainCheckpoints(store, job_id, 0)
+    result = {"domain": "example.com", "zone_id": "z1", "name_servers": ["a.ns"], "dns_status": "ok", "stages": ["zone"]}
+    checkpoints.save(result)
+    result["stages"].append("complete")
+    checkpoints.save(result)
+    reloaded = main.DomainCheckpoints(store, job_id, 0)
+    assert reloaded.get("example.com")["zone_id"] == "z1"
+    assert reloaded.completed("example.com")
+    assert not main.DomainCheckpoints(store, job_id, 1).completed("example.com")
+
+
+def test_concurrent_stage_saves_keep_the_newest_state(tmp_path):
+    class SlowFirstWrite(main.JobStore):
+        writes = 0
+
+        def save_checkpoint(self, *args):
+            SlowFirstWrite.writes += 1
+            if SlowFirstWrite.writes == 1:
+                time.sleep(0.2)
+            super().save_checkpoint(*args)
+
+    store = SlowFirstWrite(str(tmp_path / "jobs.db"))
+    job_id = store.add_job(1, 1, "a", 1)
+    checkpoints = main.DomainCheckpoints(store, job_id, 0)
+    result = {"domain": "example.com", "zone_id": "z1", "name_servers": [], "dns_status": None, "stages": ["zone", "dns"]}
+
+    # The dns stage saves first and is slow to write; the ssl stage finishes meanwhile
+    dns = threading.Thread(target=checkpoints.save, args=(result,))
+    dns.start()
+    time.sleep(0.05)
+    result["stages"].append("settings")
+    checkpoints.save(result)
+    dns.join()
+    assert store.load_checkpoints(job_id, 0)["example.com"]["stages"] == ["zone", "dns", "settings"]
+
+
+def test_resume_jobs_requeues_unfinished_jobs(store, monkeypatch):
+    sent = []
+    queue = main.FairTaskQueue(role_weights={"user": 1.0})
+    monkeypatch.setattr(main, "job_store", store)
+    monkeypatch.setattr(main, "task_queue", queue)
+    monkeypatch.setattr(main, "waiting_users", {})
+    monkeypatch.setattr(main, "outbox", type("Outbox", (), {"send_message": lambda self, chat_id, text: sent.append(chat_id)})())
+
+    running = store.add_job(1, 100, "l\nk\none.com\n1.1.1.1\n2.2.2.2", 10)
+    store.set_status(running, "running")
+    finished = store.add_job(1, 100, "l\nk\ntwo.com\n1.1.1.1\n2.2.2.2", 11)
+    store.set_status(finished, "done")
+    queued = store.add_job(2, 200, "l\nk\nthree.com\nfour.com\n1.1.1.1\n2.2.2.2", 12)
+
+    assert main.resume_jobs() == 2
+    tasks = [queue.get() for _ in range(queue.qsize())]
+    assert sorted(task[0] for task in tasks) == [running, queued]
+    assert sorted(sent) == [100, 200]
+    assert main.waiting_users == {1: {10: pytest.approx(time.time(), abs=5)}, 2: {12: pytest.approx(time.time(), abs=5)}}
@@ -0,0 +1,90 @@
+"""Telegram outbox: per-chat order, round-robin between chats, retries and errors handed back on the Future"""
+import threading
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+import main
+
+
+def api_error(code, retry_after=None):
+    result_json = {"ok": False, "error_code": code, "description": f"error {code}"}
+    if retry_after is not None:
+        result_json["parameters"] = {"retry_after": retry_after}
+    return ApiTelegramException("sendMessage", None, result_json)
+
+
+class FakeBot:
+    """Records sent messages; .failures maps a text to the errors raised before it goes through"""
+
+    def __init__(self):
+        self.sent = []
+        self.attempts = []
+        self.failures = {}
+        self.hold = threading.Event()
+        self.holding = threading.Event()
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.attempts.append((chat_id, text))
+        if text == "hold":
+            self.holding.set()
+            self.hold.wait(5)
+        errors = self.failures.get(text)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((chat_id, text))
+        return f"sent {text}"
+
+
+@pytest.fixture
+def fake_bot(monkeypatch):
+    fake = FakeBot()
+    monkeypatch.setattr(main, "bot", fake)
+    return fake
+
+
+@pytest.fixture
+def outbox(fake_bot):
+    return main.TelegramOutbox(global_rate=1000, chat_interval=0)
+
+
+def test_chats_keep_their_order_and_take_turns(fake_bot, outbox):
+    first = outbox.send_message(1, "hold")
+    assert fake_bot.holding.wait(5)
+    # Queued while the sender is busy, so the round-robin order is deterministic
+    futures = [outbox.send_message(chat_id, text) for chat_id, text in ((1, "a1"), (1, "a2"), (2, "b1"), (2, "b2"))]
+    fake_bot.hold.set()
+    assert first.result(timeout=5) == "sent hold"
+    assert [future.result(timeout=5) for future in futures] == ["sent a1", "sent a2", "sent b1", "sent b2"]
+    assert fake_bot.sent == [(1, "hold"), (1, "a1"), (2, "b1"), (1, "a2"), (2, "b2")]
+    assert outbox.pending() == 0
+
+
+def test_flood_wait_is_waited_out_without_reordering_the_chat(fake_bot, outbox):
+    fake_bot.failures["x"] = [api_error(429, retry_after=0.05)]
+    futures = [outbox.send_message(1, "x"), outbox.send_message(1, "y")]
+    assert [future.result(timeout=5) for future in futures] == ["sent x", "sent y"]
+    assert fake_bot.attempts == [(1, "x"), (1, "x"), (1, "y")]
+
+
+def test_transient_errors_are_retried(fake_bot, outbox, monkeypatch):
+    monkeypatch.setattr(main.random, "random", lambda: 0.0)
+    fake_bot.failures["x"] = [api_error(502)]
+    assert outbox.send_message(1, "x").result(timeout=5) == "sent x"
+    assert fake_bot.attempts == [(1, "x"), (1, "x")]
+
+
+def test_retries_are_bounded(fake_bot, outbox, monkeypatch):
+    monkeypatch.setattr(main, "TELEGRAM_MAX_RETRIES", 0)
+    error = ConnectionError("reset by peer")
+    fake_bot.failures["x"] = [error]
+    assert outbox.send_message(1, "x").exception(timeout=5) is error
+
+
+def test_permanent_error_goes_to_the_caller_and_the_chat_moves_on(fake_bot, outbox):
+    error = api_error(400)
+    fake_bot.failures["x"] = [error]
+    failed, sent = outbox.send_message(1, "x"), outbox.send_message(1, "y")
+    assert failed.exception(timeout=5) is error
+    assert sent.result(timeout=5) == "sent y"
+    assert fake_bot.attempts == [(1, "x"), (1, "y")]
@@ -0,0 +1,134 @@
+"""Account parsing: the streaming parsers must give what the original list-based parsers gave"""
+import pytest
+
+import main
+
+
+def account(login, api_key, domains, ip_api_cdn="1.1.1.1", ip_www="2.2.2.2",
+            opportunistic_encryption=False, tls_1_3=False, dns_config_type=1, domain_concurrency=None):
+    return {
+        "login": login,
+        "api_key": api_key,
+        "domains": domains,
+        "ip_api_cdn": ip_api_cdn,
+        "ip_www": ip_www,
+        "opportunistic_encryption": opportunistic_encryption,
+        "tls_1_3": tls_1_3,
+        "dns_config_type": dns_config_type,
+        "domain_concurrency": domain_concurrency,
+    }
+
+
+def as_dicts(accounts):
+    return [{name: parsed[name] for name in main.AccountConfig.__slots__} for parsed in accounts]
+
+
+REGULAR = """
+a@example.com
+key-a
+one.com
+two.com
+1.1.1.1
+2.2.2.2
+true
+false
+3
+
+b@example.com
+key-b
+three.com
+1.1.1.1
+2.2.2.2
+"""
+
+CLOUDFLARE = """
+a@example.com|secret|key-a
+one.com
+1.1.1.1
+2.2.2.2
+false
+TRUE
+2
+not an account line
+b@example.com | secret | key-b
+two.com
+1.1.1.1
+2.2.2.2
+"""
+
+
+@pytest.mark.parametrize("text, expected", [
+    (REGULAR, [
+        account("a@example.com", "key-a", ["one.com", "two.com"],
+                opportunistic_encryption=True, dns_config_type=3),
+        account("b@example.com", "key-b", ["three.com"]),
+    ]),
+    (CLOUDFLARE, [
+        account("a@example.com", "key-a", ["one.com"], tls_1_3=True, dns_config_type=2),
+        account("b@example.com", "key-b", ["two.com"]),
+    ]),
+    # A non-numeric DNS type falls back to 1
+    ("l\nk\nd.com\n1.1.1.1\n2.2.2.2\nfalse\nfalse\nthree", [account("l", "k", ["d.com"])]),
+    # Input that ends before both IPs drops the account, like the old parsers did
+    ("l\nk\nd.com\n1.1.1.1", []),
+    ("l\nk\nd.com\n1.1.1.1\n2.2.2.2\n\nl2\nk2\nd2.com", [account("l", "k", ["d.com"])]),
+    ("l|p|k\nd.com", []),
+    ("l|p\nd.com\n1.1.1.1\n2.2.2.2", []),
+    ("", []),
+])
+def test_parse_input_text(text, expected):
+    assert as_dicts(main.parse_input_text(text)) == expected
+
+
+def test_threads_line_sets_domain_concurrency():
+    text = "l\nk\nd.com\n1.1.1.1\n2.2.2.2\nfalse\nfalse\n1\nthreads=4\nl2\nk2\nd2.com\n1.1.1.1\n2.2.2.2"
+    assert as_dicts(main.parse_input_text(text)) == [
+        account("l", "k", ["d.com"], domain_concurrency=4),
+        account("l2", "k2", ["d2.com"]),
+    ]
+
+
+def test_messages_and_uploads_detect_the_format_alike(tmp_path):
+    # The first line is not an account line, the '|' only shows up later
+    text = "accounts for today\n" + CLOUDFLARE
+    upload = tmp_path / "accounts.txt"
+    upload.write_text(text, encoding="utf-8")
+    expected = as_dicts(main.parse_input_text(text))
+    assert [parsed["login"] for parsed in expected] == ["a@example.com", "b@example.com"]
+    assert as_dicts(main.task_accounts(None, str(upload))) == expected
+
+
+def test_iter_accounts_is_lazy():
+    consumed = []
+
+    def lines():
+        for line in REGULAR.splitlines():
+            consumed.append(line)
+            yield line
+
+    accounts = main.iter_accounts(lines(), cloudflare_format=False)
+    assert next(accounts)["login"] == "a@example.com"
+    # One line of lookahead for the optional "threads=N" line, nothing more
+    assert "key-b" not in consumed
+
+
+def test_account_config_item_access():
+    parsed = main.parse_input_text(REGULAR)[0]
+    assert parsed["domains"] == ["one.com", "two.com"]
+    assert parsed.get("dns_config_type") == 3
+    with pytest.raises(KeyError):
+        parsed["password"]
+
+
+def test_uploaded_files_match_the_message_text(tmp_path):
+    txt = tmp_path / "accounts.txt"
+    txt.write_text(REGULAR, encoding="utf-8")
+    csv = tmp_path / "accounts.csv"
+    csv.write_text(
+        "﻿a@example.com,key-a,one.com,two.com,1.1.1.1,2.2.2.2,true,false,3\n"
+        "b@example.com,key-b,three.com,1.1.1.1,2.2.2.2\n",
+        encoding="utf-8",
+    )
+    expected = as_dicts(main.parse_input_text(REGULAR))
+    assert as_dicts(main.task_accounts(None, str(txt))) == expected
+    assert as_dicts(main.task_accounts(None, str(csv))) == expected
@@ -0,0 +1,143 @@
+"""Preflight: per-account validation, key checks and duplicate domains while accounts stream in"""
+import threading
+
+import pytest
+
+import main
+
+
+def account(login, domains, api_key="key", ip_www="192.0.2.2", dns_config_type=1):
+    return main.AccountConfig(
+        login=login, api_key=api_key, domains=list(domains), ip_api_cdn="192.0.2.1", ip_www=ip_www,
+        opportunistic_encryption=False, tls_1_3=False, dns_config_type=dns_config_type
+    )
+
+
+@pytest.fixture
+def verified(monkeypatch):
+    """Stands in for the key check: keys listed in .rejected are refused, in .unreachable cannot be checked"""
+    calls = []
+
+    def verify_credentials(login, api_key):
+        calls.append((login, api_key))
+        if (login, api_key) in verify_credentials.rejected:
+            return False, "Unknown X-Auth-Key or X-Auth-Email"
+        if (login, api_key) in verify_credentials.unreachable:
+            return None, "HTTP 503"
+        return True, None
+
+    verify_credentials.calls = calls
+    verify_credentials.rejected = set()
+    verify_credentials.unreachable = set()
+    monkeypatch.setattr(main, "verify_credentials", verify_credentials)
+    return verify_credentials
+
+
+def run(accounts, **options):
+    preflight = main.TaskPreflight(**options)
+    return preflight, [(index, item["login"], list(item["domains"]), reason) for index, item, reason in preflight.run(accounts)]
+
+
+def test_accounts_come_out_in_order_with_their_problems(verified):
+    preflight, results = run([
+        account("a", ["one.com", "bad..com", "two.com"]),
+        account("b", ["three.com"], ip_www="999.1.1.1"),
+        account("c", ["four.com"], dns_config_type=99),
+        account("d", ["five.com"]),
+    ])
+    assert results == [
+        (0, "a", ["one.com", "two.com"], None),
+        (1, "b", ["three.com"], "неверный IP ip_www: 999.1.1.1"),
+        (2, "c", ["four.com"], "неизвестный тип DNS конфигурации: 99"),
+        (3, "d", ["five.com"], None),
+    ]
+    plan = preflight.plan
+    assert (plan["accounts"], plan["runnable"], plan["domains"]) == (4, 2, 3)
+    assert plan["invalid_domains"] == ["bad..com"]
+    assert plan["skipped_total"] == 2
+    # Accounts that fail the offline checks are not sent to Cloudflare
+    assert sorted(verified.calls) == [("a", "key"), ("d", "key")]
+
+
+def test_first_occurrence_of_a_domain_wins(verified):
+    preflight, results = run([
+        account("a", ["shared.com", "one.com", "ONE.com"]),
+        account("b", ["Shared.com"]),
+        account("c", ["shared.com", "two.com"]),
+    ])
+    assert [(login, domains, reason) for _, login, domains, reason in results] == [
+        ("a", ["shared.com", "one.com"], None),
+        ("b", [], "нет доменов для настройки"),
+        ("c", ["two.com"], None),
+    ]
+    assert preflight.plan["duplicates"] == ["ONE.com", "Shared.com", "shared.com"]
+
+
+def test_rejected_key_does_not_claim_domains(verified):
+    verified.rejected.add(("bad", "nope"))
+    _, results = run([
+        account("bad", ["shared.com"], api_key="nope"),
+        account("good", ["shared.com", "other.com"]),
+    ])
+    assert results[0][3].startswith("Cloudflare отклонил API ключ")
+    assert results[1] == (1, "good", ["shared.com", "other.com"], None)
+
+
+def test_each_key_is_checked_once(verified):
+    verified.unreachable.add(("a", "key"))
+    preflight, results = run([account("a", ["one.com"]), account("a", ["two.com"]), account("b", ["three.com"])])
+    assert all(reason is None for *_, reason in results)
+    assert sorted(verified.calls) == [("a", "key"), ("b", "key")]
+    # Keys that could not be checked are tried anyway and reported once
+    assert preflight.plan["unverified"] == ["a"] and preflight.plan["unverified_total"] == 1
+
+
+def test_first_account_starts_before_later_keys_are_verified(monkeypatch):
+    release = threading.Event()
+
+    def verify_credentials(login, api_key):
+        if login != "first":
+            release.wait(5)
+        return True, None
+
+    monkeypatch.setattr(main, "verify_credentials", verify_credentials)
+    preflight = main.TaskPreflight(lookahead=5)
+    accounts = preflight.run(iter([account("first", ["one.com"])] + [account(f"next{i}", [f"d{i}.com"]) for i in range(3)]))
+    index, first, reason = next(accounts)
+    assert (index, first["login"], reason) == (0, "first", None)
+    assert not release.is_set()
+    release.set()
+    assert [item["login"] for _, item, _ in accounts] == ["next0", "next1", "next2"]
+
+
+def test_lookahead_bounds_the_accounts_read_ahead(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(main, "verify_credentials", lambda login, api_key: (release.wait(5), None))
+    read = []
+
+    def accounts():
+        for i in range(10):
+            read.append(i)
+            yield account(f"a{i}", [f"d{i}.com"])
+
+    stream = main.TaskPreflight(lookahead=3).run(accounts())
+    threading.Timer(0.2, release.set).start()
+    # The oldest account waits for its key while at most lookahead others are read behind it
+    next(stream)
+    assert read == [0, 1, 2, 3]
+    stream.close()
+
+
+def test_report_keeps_samples_and_totals(verified):
+    preflight, _ = run([account(f"a{i}", [f"bad{i}..com", f"ok{i}.com"], dns_config_type=1) for i in range(15)], lookahead=2)
+    plan = preflight.plan
+    assert plan["invalid_domains_total"] == 15 and len(plan["invalid_domains"]) == 10
+    message = main.format_preflight(plan)
+    assert "Аккаунтов: 15 (к запуску: 15), доменов: 15" in message
+    assert "Неверные домены пропущены (15):" in message and "и ещё 5" in message
+
+
+def test_nothing_to_run_is_reported(verified):
+    preflight, _ = run([account("a", ["one.com"], ip_www="not-an-ip")])
+    assert preflight.plan["runnable"] == 0
+    assert "Нечего запускать" in main.format_preflight(preflight.plan)
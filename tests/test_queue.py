@@ -0,0 +1,63 @@
+"""Fair task queue: ordering between users and roles"""
+import main
+
+
+WEIGHTS = {"super-admin": 4.0, "admin": 2.0, "user": 1.0}
+
+
+def drain(queue):
+    return [queue.get() for _ in range(queue.qsize())]
+
+
+def test_single_user_keeps_submission_order():
+    queue = main.FairTaskQueue(role_weights=WEIGHTS)
+    for name in ("a", "b", "c"):
+        queue.put(name, user_id=1, cost=5)
+    assert drain(queue) == ["a", "b", "c"]
+
+
+def test_small_task_is_not_stuck_behind_another_users_backlog():
+    queue = main.FairTaskQueue(role_weights=WEIGHTS)
+    for index in range(10):
+        queue.put(f"big{index}", user_id=1, cost=50)
+    queue.put("small", user_id=2, cost=1)
+    assert drain(queue)[:2] == ["small", "big0"]
+
+
+def test_equal_users_alternate():
+    queue = main.FairTaskQueue(role_weights=WEIGHTS)
+    for index in range(3):
+        queue.put(f"u1-{index}", user_id=1, cost=10)
+    for index in range(3):
+        queue.put(f"u2-{index}", user_id=2, cost=10)
+    assert drain(queue) == ["u1-0", "u2-0", "u1-1", "u2-1", "u1-2", "u2-2"]
+
+
+def test_role_weight_shifts_the_share():
+    # User 3 is an admin in the test whitelist: twice the share of a regular user
+    queue = main.FairTaskQueue(role_weights=WEIGHTS)
+    for index in range(4):
+        queue.put(f"user-{index}", user_id=1, cost=10)
+    for index in range(4):
+        queue.put(f"admin-{index}", user_id=3, cost=10)
+    order = drain(queue)
+    assert order.index("admin-1") < order.index("user-1")
+    assert order[:3].count("user-0") == 1 and order[:3].count("admin-0") == 1
+
+
+def test_stop_signal_wins_over_queued_tasks():
+    queue = main.FairTaskQueue(role_weights=WEIGHTS)
+    queue.put("task", user_id=1)
+    queue.put(None)
+    assert queue.get() is None
+    assert queue.get() == "task"
+
+
+def test_schedule_estimates_waits():
+    queue = main.FairTaskQueue(role_weights=WEIGHTS, seconds_per_domain=2.0)
+    queue.put("a", user_id=1, cost=5)
+    queue.put("b", user_id=2, cost=1)
+    queue.put("c", user_id=1, cost=1)
+    plan = queue.schedule(busy_seconds=[3.0], workers=2)
+    # b finishes first virtually; the idle worker is free again after b's 2 s, the busy one after 3 s
+    assert [(task, wait) for task, _, _, wait in plan] == [("b", 0.0), ("a", 2.0), ("c", 3.0)]
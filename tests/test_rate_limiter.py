@@ -0,0 +1,63 @@
+"""Per-account token bucket and 429 / Retry-After handling"""
+import email.utils
+
+import pytest
+
+import main
+from conftest import cf_response
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_burst_then_steady_rate(clock):
+    # 14 requests per 10 s with a burst of 4: the other 10 are spread over the window, one a second
+    limiter = main.RateLimiter(limit=14, window=10, burst=4)
+    assert [limiter.reserve("a") for _ in range(4)] == [0.0] * 4
+    assert limiter.reserve("a") == pytest.approx(1.0)
+    assert limiter.reserve("a") == pytest.approx(2.0)
+    clock[0] += 3
+    assert limiter.reserve("a") == pytest.approx(0.0)
+
+
+def test_accounts_have_separate_buckets(clock):
+    limiter = main.RateLimiter(limit=10, window=10, burst=1)
+    assert limiter.reserve("a") == 0.0
+    assert limiter.reserve("b") == 0.0
+    assert limiter.reserve("a") > 0
+    assert limiter.stats("a")["a"]["requests"] == 2
+
+
+def test_penalize_holds_every_request_of_the_account(clock):
+    limiter = main.RateLimiter(limit=100, window=1, burst=100)
+    limiter.penalize("a", 30)
+    assert limiter.reserve("a") == pytest.approx(30.0)
+    assert limiter.reserve("b") == 0.0
+    assert limiter.stats("a")["a"]["throttled"] == 1
+
+
+def test_parse_retry_after():
+    assert main.parse_retry_after("7") == 7.0
+    assert main.parse_retry_after(None) == 10.0
+    assert main.parse_retry_after("soon", default=3.0) == 3.0
+    date = email.utils.formatdate(main.time.time() + 60, usegmt=True)
+    assert 55 <= main.parse_retry_after(date) <= 60
+
+
+def test_429_is_retried_after_the_account_is_held(stub_client):
+    stub_client.stub.outcomes = [cf_response(429, headers={"Retry-After": "0"}), cf_response(200)]
+    # A 429 means the call was not applied, so even a POST is sent again
+    assert stub_client.post("a", "k", "/zones", json={"name": "example.com"}).status_code == 200
+    assert len(stub_client.stub.calls) == 2
+    assert stub_client.limiter.stats("a")["a"]["throttled"] == 1
+
+
+def test_429_retries_are_limited(stub_client, monkeypatch):
+    monkeypatch.setattr(main, "CF_RATE_LIMIT_RETRIES", 2)
+    stub_client.stub.outcomes = [cf_response(429, headers={"Retry-After": "0"})] * 5
+    assert stub_client.get("a", "k", "/zones").status_code == 429
+    assert len(stub_client.stub.calls) == 3
@@ -0,0 +1,124 @@
+"""Stage pipeline: dependency ordering, overlapping independent stages, failures and errors"""
+import asyncio
+import threading
+
+import pytest
+
+import main
+
+
+# a -> (b, c) -> d: b and c are independent of each other
+DEPS = {"a": (), "b": ("a",), "c": ("a",), "d": ("b", "c")}
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = main.StagePipeline(deps=DEPS, limits={}, workers=4)
+    yield pipeline
+    pipeline.shutdown()
+
+
+class Log:
+    """Thread-safe record of stage starts and ends"""
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def add(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def stage(self, name, ok=True, during=None):
+        def run():
+            self.add(("start", name))
+            result = during() if during is not None else ok
+            self.add(("end", name))
+            return result
+        return run
+
+    def index(self, event):
+        return self.events.index(event)
+
+
+def test_stages_start_after_their_dependencies(pipeline):
+    log = Log()
+    succeeded = pipeline.run({name: log.stage(name) for name in ("d", "c", "b", "a")})
+    assert succeeded == {"a", "b", "c", "d"}
+    for stage, deps in DEPS.items():
+        for dep in deps:
+            assert log.index(("end", dep)) < log.index(("start", stage))
+
+
+def test_independent_stages_overlap(pipeline):
+    log = Log()
+    both = threading.Barrier(2, timeout=5)
+
+    def meet():
+        # Fails with BrokenBarrierError unless b and c are running at the same time
+        both.wait()
+        return True
+
+    stages = {"a": log.stage("a"), "b": log.stage("b", during=meet), "c": log.stage("c", during=meet), "d": log.stage("d")}
+    assert pipeline.run(stages) == {"a", "b", "c", "d"}
+
+
+def test_failed_stage_skips_its_dependents(pipeline):
+    log = Log()
+    succeeded = pipeline.run({"a": log.stage("a"), "b": log.stage("b", ok=False), "c": log.stage("c"), "d": log.stage("d")})
+    assert succeeded == {"a", "c"}
+    assert ("start", "d") not in log.events
+
+
+def test_done_stages_are_not_run_again(pipeline):
+    log = Log()
+    succeeded = pipeline.run({"b": log.stage("b"), "c": log.stage("c")}, done={"a"})
+    assert succeeded == {"a", "b", "c"}
+    assert ("start", "a") not in log.events
+
+
+def test_stage_error_is_raised_after_running_stages_finish(pipeline):
+    log = Log()
+    b_started = threading.Event()
+
+    def c():
+        assert b_started.wait(5)
+        raise TimeoutError("domain deadline")
+
+    def slow_b():
+        b_started.set()
+        threading.Event().wait(0.1)
+        return True
+
+    with pytest.raises(TimeoutError):
+        pipeline.run({"a": log.stage("a"), "b": log.stage("b", during=slow_b), "c": c, "d": log.stage("d")})
+    # b was already running and is let finish; d is never started
+    assert ("end", "b") in log.events
+    assert ("start", "d") not in log.events
+
+
+def test_async_run_keeps_the_same_order(pipeline):
+    log = Log()
+
+    def stage(name, ok=True):
+        async def run():
+            log.add(("start", name))
+            await asyncio.sleep(0)
+            log.add(("end", name))
+            return ok
+        return run
+
+    succeeded = asyncio.run(pipeline.run_async({name: stage(name) for name in DEPS}))
+    assert succeeded == {"a", "b", "c", "d"}
+    for name, deps in DEPS.items():
+        for dep in deps:
+            assert log.index(("end", dep)) < log.index(("start", name))
+
+    log.events.clear()
+    assert asyncio.run(pipeline.run_async({"b": stage("b", ok=False), "c": stage("c"), "d": stage("d")}, done={"a"})) == {"a", "c"}
+    assert ("start", "d") not in log.events
+
+
+def test_limits_must_name_known_stages():
+    with pytest.raises(ValueError):
+        main.StagePipeline(deps=DEPS, limits={"dsn": 5})
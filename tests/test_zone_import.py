@@ -0,0 +1,50 @@
+"""Zone file import: rendering record sets as BIND zone files for the import endpoint"""
+import main
+
+
+DOMAIN = "example.com"
+
+
+def build(config_type, ip_api_cdn="192.0.2.10", ip_www="192.0.2.20"):
+    return main.build_dns_records(config_type, DOMAIN, ip_api_cdn, ip_www)
+
+
+def test_zone_file_text_splits_long_strings_before_escaping():
+    content = 'a"' + "x" * 300
+    rendered = main.zone_file_text(content)
+    assert rendered == '"a\\"' + "x" * 253 + '" "' + "x" * 47 + '"'
+    assert main.zone_file_text("") == '""'
+
+
+def test_render_zone_file():
+    payloads = [
+        {"type": "A", "name": "@", "content": "192.0.2.1", "proxied": True},
+        {"type": "CNAME", "name": "partners", "content": "example.com.", "proxied": True},
+        {"type": "MX", "name": "@", "content": "mx.example.net", "priority": 10, "proxied": False},
+        {"type": "TXT", "name": "_dmarc", "content": 'v=DMARC1; p="none"', "proxied": False},
+    ]
+    assert main.render_zone_file(payloads, DOMAIN).splitlines() == [
+        "$ORIGIN example.com.",
+        "example.com. 1 IN A 192.0.2.1",
+        "partners.example.com. 1 IN CNAME example.com.",
+        "example.com. 1 IN MX 10 mx.example.net.",
+        '_dmarc.example.com. 1 IN TXT "v=DMARC1; p=\\"none\\""',
+    ]
+
+
+def test_zone_import_groups_split_by_proxied_flag():
+    proxied = {"type": "A", "name": "@", "content": "192.0.2.1", "proxied": True}
+    direct = {"type": "A", "name": "mail", "content": "192.0.2.2", "proxied": False}
+    mx = {"type": "MX", "name": "@", "content": "mail.example.com", "priority": 1, "proxied": False}
+    assert main.zone_import_groups([proxied, direct, mx]) == [(True, [proxied, mx]), (False, [direct])]
+    # Unproxiable records join the unproxied group when nothing is proxied
+    assert main.zone_import_groups([direct, mx]) == [(False, [direct, mx])]
+    assert main.zone_import_groups([mx]) == [(True, [mx])]
+
+
+def test_every_template_renders_as_a_zone_file():
+    for config_type in main.dns_templates:
+        payloads = [main.dns_record_payload(record, DOMAIN) for record in build(config_type)]
+        imported = [payload for _, group in main.zone_import_groups(payloads) for payload in group]
+        assert sorted(map(repr, imported)) == sorted(map(repr, payloads))
+        assert len(main.render_zone_file(payloads, DOMAIN).splitlines()) == len(payloads) + 1
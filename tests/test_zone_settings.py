@@ -0,0 +1,53 @@
+"""Zone settings: one bulk PATCH, and the optional read of the current values"""
+import pytest
+
+import main
+from conftest import cf_response
+
+SETTINGS = {"tls_1_3": "on", "always_use_https": "on"}
+
+
+@pytest.fixture
+def client(stub_client, monkeypatch):
+    monkeypatch.setattr(main, "cf_client", stub_client)
+    return stub_client
+
+
+def current(**values):
+    return cf_response(200, {"success": True, "result": [{"id": key, "value": value} for key, value in values.items()]})
+
+
+def test_settings_are_sent_in_one_request(client, monkeypatch):
+    sent = []
+    monkeypatch.setattr(client, "patch", lambda login, api_key, path, json: sent.append((path, json)) or cf_response(200))
+    assert main.apply_zone_settings("a", "k", "z1", SETTINGS)
+    assert sent == [("/zones/z1/settings", {"items": [{"id": "tls_1_3", "value": "on"}, {"id": "always_use_https", "value": "on"}]})]
+
+
+def test_matching_zone_is_read_once_and_left_alone(client):
+    client.stub.outcomes = [current(tls_1_3="on", always_use_https="on", brotli="off")]
+    assert main.apply_zone_settings("a", "k", "z1", SETTINGS, check_current=True)
+    assert client.stub.calls == [("GET", "https://cf.test/client/v4/zones/z1/settings")]
+
+
+def test_only_differing_settings_are_sent(client, monkeypatch):
+    sent = []
+    client.stub.outcomes = [current(tls_1_3="on", always_use_https="off")]
+    original = client.request
+
+    def request(login, api_key, method, path, **kwargs):
+        if method == "PATCH":
+            sent.append(kwargs["json"])
+        return original(login, api_key, method, path, **kwargs)
+
+    monkeypatch.setattr(client, "request", request)
+    assert main.apply_zone_settings("a", "k", "z1", SETTINGS, check_current=True)
+    assert sent == [{"items": [{"id": "always_use_https", "value": "on"}]}]
+    assert [method for method, _ in client.stub.calls] == ["GET", "PATCH"]
+
+
+def test_rejected_bulk_update_falls_back_to_single_settings(client):
+    client.stub.outcomes = [cf_response(400, {"success": False, "errors": [{"code": 1, "message": "bad"}]})]
+    assert main.apply_zone_settings("a", "k", "z1", SETTINGS)
+    assert sorted(url.rsplit("/", 1)[1] for method, url in client.stub.calls[1:]) == ["always_use_https", "tls_1_3"]
+